@@ -0,0 +1,91 @@
+"""バックテスト(utils.backtest)のベンチマーク
+
+ダミーの20年分の日次のcloseで、3つの計算方法のバックテストを行い、
+    平均と分散: 窓ごとに calculate_statistics で計算し直す時間と、RollingStatistics で窓をずらす時間(と結果の差)
+    最適化: 全ての買い直す日を1つずつ解く時間と、map_in_process_pool で並列に解く時間
+    全体: backtest にかかる時間
+を表示する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_backtest
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import executors
+from utils.backtest import RollingStatistics, backtest, solve_weights
+from utils.calculate_config import CalculateConfig
+from utils.calculate_methods import get_calculate_methods
+from utils.statistics_cache import calculate_statistics
+
+YEARS = 20
+INSTRUMENT_COUNTS = [6, 30]
+LOOKBACK_DAYS = CalculateConfig.backtest_lookback_days
+REBALANCE_DAYS = CalculateConfig.backtest_rebalance_days
+
+
+def make_prices(n_instruments: int) -> pd.DataFrame:
+    """相関のある日次リターンから、YEARS 年分のcloseを作る"""
+    rng = np.random.default_rng(0)
+    n_days = YEARS * 252
+    loadings = rng.normal(0, 0.008, size=(n_instruments, 2))
+    shocks = rng.standard_normal((n_days, 2)) @ loadings.T + \
+        rng.normal(0, 0.006, size=(n_days, n_instruments))
+    returns = rng.normal(0.0003, 0.0001, n_instruments) + shocks
+    return pd.DataFrame(100 * np.cumprod(1 + returns, axis=0),
+                        index=pd.bdate_range(end="2022-09-30", periods=n_days),
+                        columns=[f"index_{i:04d}" for i in range(n_instruments)])
+
+
+def main():
+    method_names = get_calculate_methods()
+    print(f"{YEARS} years daily, lookback {LOOKBACK_DAYS} days, rebalance every {REBALANCE_DAYS} days, "
+          f"{len(method_names)} methods, {CalculateConfig.process_pool_workers} processes")
+    print(f"{'instruments':>12} {'solves':>7} {'stats_full[s]':>14} {'stats_roll[s]':>14} {'max_diff':>9} "
+          f"{'solve_serial[s]':>16} {'solve_pool[s]':>14} {'backtest[s]':>12}")
+    for n_instruments in INSTRUMENT_COUNTS:
+        data = make_prices(n_instruments)
+        prices = data.to_numpy()
+        returns = prices[1:] / prices[:-1] - 1
+        rows = list(range(LOOKBACK_DAYS, len(prices) - 1, REBALANCE_DAYS))
+
+        start = time.perf_counter()
+        full = [calculate_statistics(data.iloc[row - LOOKBACK_DAYS:row + 1])
+                for row in rows]
+        full_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rolling = RollingStatistics(returns=returns, names=list(data.columns))
+        rolled = []
+        for row in rows:
+            rolling.move_to(row - LOOKBACK_DAYS, row)
+            rolled.append(rolling.get_statistics())
+        rolling_seconds = time.perf_counter() - start
+        max_diff = max(max(np.abs(a.mean - b.mean).max(), np.abs(a.cov - b.cov).to_numpy().max())
+                       for a, b in zip(full, rolled))
+
+        tasks = [(method_name, statistics, dict())
+                 for method_name in method_names for statistics in rolled]
+        start = time.perf_counter()
+        for task in tasks:
+            solve_weights(*task)
+        serial_seconds = time.perf_counter() - start
+        # プロセスの起動を計測に含めない
+        executors.map_in_process_pool(solve_weights, tasks[:CalculateConfig.process_pool_workers])
+        start = time.perf_counter()
+        executors.map_in_process_pool(solve_weights, tasks)
+        pool_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        backtest(data, method_names, lookback_days=LOOKBACK_DAYS,
+                 rebalance_days=REBALANCE_DAYS)
+        backtest_seconds = time.perf_counter() - start
+        print(f"{n_instruments:>12} {len(tasks):>7} {full_seconds:>14.2f} {rolling_seconds:>14.3f} {max_diff:>9.1e} "
+              f"{serial_seconds:>16.2f} {pool_seconds:>14.2f} {backtest_seconds:>12.2f}")
+    executors.shutdown_pools()
+
+
+if __name__ == "__main__":
+    main()
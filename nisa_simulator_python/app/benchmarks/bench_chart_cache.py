@@ -0,0 +1,68 @@
+"""/graph/ のレスポンスキャッシュのベンチマーク
+
+一時的なsqliteにダミーデータを作り、TestClient から /graph/ を呼んで1秒あたりのリクエスト数を比較する。
+    legacy: 毎回 make_chart_data().to_json() を作っていた以前の /graph/
+    cached: データのバージョンごとに作り置きしたbytesを返す /graph/
+    304: If-None-Match にETagを付けた /graph/
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_chart_cache
+"""
+import tempfile
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+import main
+from benchmarks.bench_get_datas_from_db import create_dummy_db
+from utils import get_finance
+from utils.chart_cache import chart_payload_cache
+
+YEARS = [1, 10]
+# make_chart_data の色の数より多くはできない
+N_INSTRUMENTS = 6
+DURATION_SECONDS = 3.0
+
+legacy_app = FastAPI()
+
+
+@legacy_app.get("/graph/")
+async def legacy_get_graph():
+    """以前の /graph/"""
+    return get_finance.make_chart_data().to_json()
+
+
+def requests_per_second(client: TestClient, headers: dict = None) -> float:
+    """DURATION_SECONDS の間 /graph/ を呼び続けて、1秒あたりのリクエスト数を返す"""
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION_SECONDS:
+        client.get("/graph/", headers=headers)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main_():
+    print(f"{'years':>6} {'legacy[req/s]':>14} {'cached[req/s]':>14} {'304[req/s]':>12} {'body[KB]':>10}")
+    for years in YEARS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = create_engine(f"sqlite:///{tmp_dir}/bench.db")
+            create_dummy_db(engine, N_INSTRUMENTS, years=years)
+            get_finance.session = scoped_session(sessionmaker(bind=engine))
+            chart_payload_cache.clear()
+            legacy = requests_per_second(TestClient(legacy_app))
+            client = TestClient(main.app)
+            response = client.get("/graph/")
+            cached = requests_per_second(client)
+            not_modified = requests_per_second(
+                client, headers={"If-None-Match": response.headers["etag"]})
+            print(f"{years:>6} {legacy:>14.1f} {cached:>14.1f} {not_modified:>12.1f} {len(response.content) / 1024:>10.1f}")
+            get_finance.session.remove()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main_()
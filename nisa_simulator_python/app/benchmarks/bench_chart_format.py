@@ -0,0 +1,73 @@
+"""/graph/ のレスポンス形式のベンチマーク
+
+ダミーの10年分のclose(休場日のNaN入り)を、以前の dataclasses_json での作り方と
+utils.chart_format の各形式でエンコードして、時間とサイズを比較する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_chart_format
+"""
+import datetime
+import gzip
+import json
+import time
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from utils.chart_format import (BINARY_MEDIA_TYPE, CHART_ENCODERS, COLOR_PALETTE, COLUMNAR_JSON_MEDIA_TYPE,
+                                LEGACY_JSON_MEDIA_TYPE, make_chart_columns)
+from utils.get_finance import HoleGraphData, IndividualChartData
+
+YEARS = 10
+INSTRUMENT_COUNTS = [6, 100, 1000]
+REPEAT = 3
+
+
+def create_dummy_frame(n_instruments: int) -> pd.DataFrame:
+    """日付 x 銘柄 のダミーのclose. 2%の日はNaNにする"""
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range(end=datetime.date.today(), periods=252 * YEARS)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.01,
+                                               (len(dates), n_instruments)), axis=0))
+    closes[rng.random(closes.shape) < 0.02] = np.nan
+    return pd.DataFrame(closes, index=dates, columns=[f"index_{i:04d}" for i in range(n_instruments)])
+
+
+def legacy_encode(df: pd.DataFrame) -> bytes:
+    """以前の make_chart_data と /graph/ のエンコード"""
+    df = df.replace([np.nan], [None])
+    datasets = [IndividualChartData(label=col, data=df[col].values.tolist(),
+                                    borderColor=COLOR_PALETTE[i % len(COLOR_PALETTE)])
+                for i, col in enumerate(df.columns)]
+    chart = HoleGraphData(labels=df.index.strftime(
+        "%Y-%m-%d").to_list(), datasets=datasets)
+    return json.dumps(chart.to_json()).encode("utf-8")
+
+
+def measure(encode: Callable[[], bytes]) -> tuple:
+    """REPEAT 回エンコードして、1回あたりの秒数(中央値)とbytesを返す"""
+    times: List[float] = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        body = encode()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2], body
+
+
+def main():
+    print(f"{'instruments':>12} {'format':>32} {'encode[ms]':>11} {'size[KB]':>10} {'gzip[KB]':>10}")
+    for n_instruments in INSTRUMENT_COUNTS:
+        df = create_dummy_frame(n_instruments)
+        formats = [("legacy dataclasses_json", lambda: legacy_encode(df))]
+        for media_type in [LEGACY_JSON_MEDIA_TYPE, COLUMNAR_JSON_MEDIA_TYPE, BINARY_MEDIA_TYPE]:
+            formats.append((media_type, lambda media_type=media_type:
+                            CHART_ENCODERS[media_type](make_chart_columns(df))))
+        for label, encode in formats:
+            seconds, body = measure(encode)
+            print(f"{n_instruments:>12} {label:>32} {seconds * 1000:>11.1f} "
+                  f"{len(body) / 1024:>10.1f} {len(gzip.compress(body)) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
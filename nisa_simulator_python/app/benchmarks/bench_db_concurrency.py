@@ -0,0 +1,112 @@
+"""dbの同時読み込みと書き込みのベンチマーク
+
+一時的なsqliteにダミーデータを作り、READERS 個のスレッドが get_datas_from_db で直近1年を読み続ける間、
+1つのスレッドが _GraphData.upsert_close_data で直近の数日を書き続ける。
+    legacy: create_engine の既定のまま(journal_mode=DELETE)
+    tuned: db.engine.create_db_engine(WAL, pragma, コネクションプール)
+で、読み込みと書き込みの回数、読み込みの待ち時間、エラーの数を比較する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_db_concurrency
+"""
+import datetime
+import tempfile
+import threading
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from benchmarks.bench_get_datas_from_db import create_dummy_db
+from db import Model
+from db.db_config import DBConfig
+from db.engine import create_db_engine
+from db.Model import _GraphData
+from utils import get_finance
+
+N_INSTRUMENTS = 100
+YEARS = 5
+READERS = [1, 4, 8]
+WRITE_DAYS = 5
+DURATION_SECONDS = 5.0
+
+
+def run(engine, n_readers: int) -> dict:
+    """DURATION_SECONDS の間、読み込みと書き込みを同時に行って、回数と待ち時間を返す"""
+    Model.Session.configure(bind=engine)
+    get_finance.session = scoped_session(sessionmaker(bind=engine))
+    names = [f"index_{i:04d}" for i in range(N_INSTRUMENTS)]
+    start_time = datetime.datetime.now() - datetime.timedelta(days=365)
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies: List[float] = []
+    counts = {"reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0}
+
+    def reader() -> None:
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                get_finance.get_datas_from_db(start_time=start_time)
+            except Exception:
+                with lock:
+                    counts["read_errors"] += 1
+                get_finance.session.rollback()
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                counts["reads"] += 1
+        get_finance.session.remove()
+
+    def writer() -> None:
+        rng = np.random.default_rng(0)
+        dates = pd.bdate_range(end=datetime.date.today(), periods=WRITE_DAYS)
+        graph = _GraphData(db_config=DBConfig())
+        while not stop.is_set():
+            close_data = pd.DataFrame(100 + rng.random((WRITE_DAYS, N_INSTRUMENTS)),
+                                      index=dates, columns=names)
+            try:
+                graph.upsert_close_data(close_data)
+                counts["writes"] += 1
+            except Exception:
+                counts["write_errors"] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(n_readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION_SECONDS)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    counts["p50_ms"] = latencies[len(latencies) // 2] * \
+        1000 if latencies else float("nan")
+    counts["p95_ms"] = latencies[int(len(latencies) * 0.95)] * \
+        1000 if latencies else float("nan")
+    return counts
+
+
+def main():
+    print(f"{N_INSTRUMENTS} instruments x {YEARS} years, 1 writer upserting {WRITE_DAYS} days, {DURATION_SECONDS:.0f}s")
+    print(f"{'engine':>8} {'readers':>8} {'reads/s':>9} {'p50[ms]':>9} {'p95[ms]':>9} "
+          f"{'writes/s':>9} {'read_err':>9} {'write_err':>10}")
+    for label in ["legacy", "tuned"]:
+        for n_readers in READERS:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db_uri = f"sqlite:///{tmp_dir}/bench.db"
+                engine = create_engine(
+                    db_uri) if label == "legacy" else create_db_engine(db_uri)
+                create_dummy_db(engine, N_INSTRUMENTS, years=YEARS)
+                counts = run(engine, n_readers)
+                print(f"{label:>8} {n_readers:>8} {counts['reads'] / DURATION_SECONDS:>9.1f} "
+                      f"{counts['p50_ms']:>9.1f} {counts['p95_ms']:>9.1f} "
+                      f"{counts['writes'] / DURATION_SECONDS:>9.1f} {counts['read_errors']:>9} "
+                      f"{counts['write_errors']:>10}")
+                engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
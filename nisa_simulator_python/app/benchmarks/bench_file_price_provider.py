@@ -0,0 +1,65 @@
+"""FilePriceProvider を使った取り込みのベンチマーク
+
+一時ディレクトリに銘柄ごとのcsvを作り、_GraphData.create で一時的なsqliteに取り込む時間を測る。
+乱数のseedを固定しているので、何度実行しても同じデータを取り込む。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_file_price_provider
+"""
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from db import Model
+from db.db_config import DBConfig
+from db.Model import Base, NameBase, _GraphData
+from db.price_provider import FilePriceProvider
+
+YEARS = 30
+INSTRUMENT_COUNTS = [6, 60]
+
+
+def write_price_files(directory: str, names, years: int = YEARS) -> None:
+    """銘柄ごとに Date, Close の列を持つcsvを作る"""
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range(end=datetime.date.today(), periods=252 * years)
+    for name in names:
+        closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+        pd.DataFrame({"Date": dates.strftime("%Y-%m-%d"), "Close": closes}).to_csv(
+            os.path.join(directory, f"{name}.csv"), index=False)
+
+
+def main():
+    print(f"{YEARS} years of daily closes per instrument")
+    print(f"{'instruments':>12} {'rows':>10} {'seconds':>10} {'rows/s':>12}")
+    for n_instruments in INSTRUMENT_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            names = [f"index_{i:03d}" for i in range(n_instruments)]
+            write_price_files(tmp_dir, names)
+            engine = create_engine(f"sqlite:///{tmp_dir}/bench.db")
+            Base.metadata.create_all(engine)
+            Model.Session.configure(bind=engine)
+            with engine.begin() as conn:
+                conn.execute(NameBase.__table__.insert(), [
+                    {"name": name, "searchname": name, "searchkeyword": name} for name in names])
+
+            db_config = DBConfig()
+            db_config.history_years = YEARS
+            graph = _GraphData(db_config=db_config,
+                               price_provider=FilePriceProvider(directory=tmp_dir))
+            start = time.perf_counter()
+            with Model.update_lock:
+                result = graph.create()
+            elapsed = time.perf_counter() - start
+            print(
+                f"{n_instruments:>12} {result.inserted:>10} {elapsed:>10.3f} {result.inserted / elapsed:>12.0f}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""効率的フロンティアのベンチマーク
+
+N点のフロンティアを、目標リターンごとに pypfopt の EfficientFrontier を作って解く場合と、
+problem_cache の組み立て済みの問題で目標リターンだけを変えて解き直す calculate_frontier で比較する。
+calculate_frontier は problem_cache を空にしてから測り(cold)、問題の組み立ても時間に含める。
+warm は同じ銘柄の並びで2回目に呼んだ時の時間。pypfopt とのボラティリティの最大の差も表示する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_frontier
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.frontier import calculate_frontier
+from utils.lazy_import import import_optimizer
+from utils.portfolio_problem import problem_cache
+from utils.statistics_cache import Statistics, calculate_statistics
+
+N_INSTRUMENTS = 6
+POINT_COUNTS = [50, 200]
+
+
+def create_statistics(n_instruments: int = N_INSTRUMENTS) -> Statistics:
+    """10年分のダミーの日次データから平均と分散を作る"""
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0.0004, 0.01, (2520, n_instruments)) + \
+        rng.normal(0, 0.005, (2520, 1))
+    closes = pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)),
+                          index=pd.bdate_range("2012-01-02", periods=2520),
+                          columns=[f"index_{i}" for i in range(n_instruments)])
+    return calculate_statistics(closes)
+
+
+def pypfopt_frontier(statistics: Statistics, target_returns: np.ndarray) -> list:
+    """目標リターンごとに EfficientFrontier を作って解き、ボラティリティのリストを返す"""
+    from pypfopt.efficient_frontier import EfficientFrontier
+
+    volatilities = []
+    for target_return in target_returns:
+        ef = EfficientFrontier(statistics.mean, statistics.cov)
+        ef.efficient_return(target_return=float(target_return))
+        volatilities.append(ef.portfolio_performance()[1])
+    return volatilities
+
+
+def main():
+    import_optimizer()
+    statistics = create_statistics()
+    print(f"{N_INSTRUMENTS} instruments")
+    print(f"{'points':>8} {'pypfopt[s]':>11} {'cold[s]':>8} {'warm[s]':>8} {'speedup':>8} {'max_diff':>9}")
+    for points in POINT_COUNTS:
+        problem_cache.clear()
+        start = time.perf_counter()
+        frontier = calculate_frontier(statistics, points=points)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        calculate_frontier(statistics, points=points)
+        warm = time.perf_counter() - start
+
+        # 最大の期待リターンの点は pypfopt では解けないことがあるので、同じ目標リターンで比べる
+        target_returns = np.array([point.target_return for point in frontier.points[:-1]])
+        start = time.perf_counter()
+        expected = pypfopt_frontier(statistics, target_returns)
+        independent = time.perf_counter() - start
+        max_diff = max(abs(point.volatility - volatility)
+                       for point, volatility in zip(frontier.points, expected))
+        print(f"{points:>8} {independent:>11.2f} {cold:>8.2f} {warm:>8.2f} "
+              f"{independent / cold:>7.1f}x {max_diff:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
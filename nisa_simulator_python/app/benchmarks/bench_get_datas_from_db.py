@@ -0,0 +1,101 @@
+"""get_datas_from_db のベンチマーク
+
+一時的なsqliteに 10年分の日次データを作成し、
+銘柄ごとにqueryを投げる従来の読み込みと、1回のqueryでpivotする読み込みを比較する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_get_datas_from_db
+"""
+import datetime
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.Model import Base, GraphData, NameBase, dates_to_days, days_to_dates
+from utils import get_finance
+
+YEARS = 10
+INSTRUMENT_COUNTS = [10, 100, 1000]
+
+
+def create_dummy_db(engine, n_instruments: int, years: int = YEARS) -> None:
+    """ダミーのNameBase, GraphDataを作成する
+
+    Args:
+        engine: 書き込み先のengine
+        n_instruments (int): 銘柄数
+        years (int, optional): 何年分のデータを作るか. Defaults to YEARS.
+    """
+    Base.metadata.create_all(engine)
+    dates = pd.bdate_range(end=datetime.date.today(),
+                           periods=252 * years).to_pydatetime()
+    now = datetime.datetime.now()
+    rng = np.random.default_rng(0)
+    names = [f"index_{i:04d}" for i in range(n_instruments)]
+    days = dates_to_days(dates).tolist()
+    with engine.begin() as conn:
+        conn.execute(NameBase.__table__.insert(), [
+            {"id": i + 1, "name": name, "searchname": name, "searchkeyword": name} for i, name in enumerate(names)])
+        for i in range(len(names)):
+            closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+            conn.execute(GraphData.__table__.insert(), [
+                {"instrument_id": i + 1, "day": d, "close": float(c), "updatetime": now}
+                for d, c in zip(days, closes)])
+
+
+def legacy_get_datas_from_db(session) -> pd.DataFrame:
+    """変更前の get_datas_from_db と同じ読み込み方(銘柄ごとに2回query + join)"""
+    df = pd.Series(dtype="float64")
+    col_names = session.query(NameBase.name).all()
+    for i, col in enumerate(col_names):
+        col_name = col[0]
+        instrument_id = session.query(NameBase.id).filter_by(
+            name=col_name).scalar()
+        col_date = days_to_dates([d[0] for d in session.query(
+            GraphData.day).filter_by(instrument_id=instrument_id).all()])
+        col_close = [c[0] for c in session.query(
+            GraphData.close).filter_by(instrument_id=instrument_id).all()]
+        s = pd.Series(index=col_date, data=col_close, name=col_name)
+        if i == 0:
+            base = pd.DataFrame(s)
+        else:
+            df = base.join(s)
+            base = df
+    return df
+
+
+def measure(func, repeat: int = 3) -> float:
+    """funcを repeat 回実行して、最短の秒数を返す"""
+    times: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    print(f"{'instruments':>12} {'legacy[s]':>10} {'bulk[s]':>10} {'speedup':>8}")
+    for n_instruments in INSTRUMENT_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = create_engine(f"sqlite:///{tmp_dir}/bench.db")
+            create_dummy_db(engine, n_instruments)
+            session = sessionmaker(bind=engine)()
+            get_finance.session = session
+            repeat = 1 if n_instruments >= 1000 else 3
+            legacy = measure(
+                lambda: legacy_get_datas_from_db(session), repeat=repeat)
+            bulk = measure(get_finance.get_datas_from_db, repeat=repeat)
+            print(
+                f"{n_instruments:>12} {legacy:>10.3f} {bulk:>10.3f} {legacy / bulk:>7.1f}x")
+            session.close()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
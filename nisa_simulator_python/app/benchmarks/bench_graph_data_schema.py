@@ -0,0 +1,119 @@
+"""GraphDataのスキーマ変更(MigrateGraphData)のベンチマーク
+
+一時的なsqliteに (date, name) が主キーの古いGraphDataで 1,000銘柄 x 10年分のダミーデータを作り、
+    1銘柄の全期間の読み込み
+    直近1ヶ月の全銘柄の読み込み
+の時間とdbのサイズを測る。その後 MigrateGraphData で (instrument_id, day) が主キーの
+WITHOUT ROWID テーブルに移して、同じ読み込みを測る。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_graph_data_schema
+"""
+import datetime
+import os
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from db import Model
+from db.Model import dates_to_days
+
+YEARS = 10
+N_INSTRUMENTS = 1000
+SLICE_DAYS = 31
+REPEAT = 5
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE name_base (name VARCHAR NOT NULL, searchname VARCHAR, searchkeyword VARCHAR, PRIMARY KEY (name))",
+    "CREATE TABLE graph_data (date DATETIME NOT NULL, name VARCHAR NOT NULL, close FLOAT, updatetime DATETIME, "
+    "PRIMARY KEY (date, name))",
+    "CREATE INDEX ix_graph_data_updatetime ON graph_data (updatetime)",
+]
+LEGACY_QUERIES = {
+    "one instrument": "SELECT date, close FROM graph_data WHERE name = :name ORDER BY date",
+    "date slice": "SELECT date, name, close FROM graph_data WHERE date >= :start_date",
+}
+QUERIES = {
+    "one instrument": "SELECT graph_data.day, graph_data.close FROM graph_data "
+                      "JOIN name_base ON name_base.id = graph_data.instrument_id "
+                      "WHERE name_base.name = :name ORDER BY graph_data.day",
+    "date slice": "SELECT graph_data.day, name_base.name, graph_data.close FROM graph_data "
+                  "JOIN name_base ON name_base.id = graph_data.instrument_id WHERE graph_data.day >= :start_day",
+}
+
+
+def create_legacy_db(engine, dates: pd.DatetimeIndex) -> None:
+    """古いスキーマのNameBase, GraphDataにダミーデータを作る"""
+    rng = np.random.default_rng(0)
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+    date_strings = dates.strftime("%Y-%m-%d %H:%M:%S.%f").tolist()
+    names = [f"index_{i:04d}" for i in range(N_INSTRUMENTS)]
+    connection = engine.raw_connection()
+    try:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(statement)
+        connection.executemany("INSERT INTO name_base VALUES (?, ?, ?)",
+                               [(name, name, name) for name in names])
+        for name in names:
+            closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+            connection.executemany("INSERT INTO graph_data VALUES (?, ?, ?, ?)",
+                                   [(d, name, float(c), now) for d, c in zip(date_strings, closes)])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def measure(engine, sql: str, params: dict) -> tuple:
+    """REPEAT 回 sql を実行して、1回あたりの秒数(中央値)と行数を返す"""
+    times: List[float] = []
+    with engine.connect() as conn:
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            rows = conn.execute(text(sql), params).fetchall()
+            times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2], len(rows)
+
+
+def main():
+    dates = pd.bdate_range(end=datetime.date.today(), periods=252 * YEARS)
+    start_date = dates[-1] - pd.Timedelta(days=SLICE_DAYS)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f"{tmp_dir}/bench.db"
+        engine = create_engine(f"sqlite:///{path}")
+        create_legacy_db(engine, dates)
+        Model.engine = engine
+        legacy_size = os.path.getsize(path)
+        legacy_params = {"name": "index_0500",
+                         "start_date": start_date.strftime("%Y-%m-%d %H:%M:%S.%f")}
+        legacy = {label: measure(engine, sql, legacy_params)
+                  for label, sql in LEGACY_QUERIES.items()}
+
+        start = time.perf_counter()
+        Model.MigrateGraphData()
+        migrate_seconds = time.perf_counter() - start
+        with engine.connect() as conn:
+            conn.execute(text("VACUUM"))
+        size = os.path.getsize(path)
+        params = {"name": "index_0500",
+                  "start_day": int(dates_to_days([start_date])[0])}
+        migrated = {label: measure(engine, sql, params)
+                    for label, sql in QUERIES.items()}
+        engine.dispose()
+
+    print(f"{N_INSTRUMENTS} instruments x {YEARS} years, migration {migrate_seconds:.1f}s")
+    print(f"{'query':>16} {'rows':>8} {'legacy[ms]':>11} {'migrated[ms]':>13} {'speedup':>8}")
+    for label in QUERIES:
+        legacy_seconds, rows = legacy[label]
+        migrated_seconds, migrated_rows = migrated[label]
+        assert rows == migrated_rows
+        print(f"{label:>16} {rows:>8} {legacy_seconds * 1000:>11.2f} {migrated_seconds * 1000:>13.2f} "
+              f"{legacy_seconds / migrated_seconds:>7.1f}x")
+    print(f"{'db size[MB]':>16} {'':>8} {legacy_size / 2 ** 20:>11.1f} {size / 2 ** 20:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
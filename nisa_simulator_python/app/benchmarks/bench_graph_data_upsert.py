@@ -0,0 +1,90 @@
+"""_GraphData のupsertのベンチマーク
+
+一時的なsqliteに対して、1行ずつquery + merge + commit する従来の書き込みと
+_GraphData.upsert_close_data の rows/second を比較する。
+2回目の書き込みは同じデータなので、upsert_close_data では全行が変更なしになる。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_graph_data_upsert
+"""
+import datetime
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from db import Model
+from db.db_config import DBConfig
+from db.Model import Base, GraphData, NameBase, _GraphData, dates_to_days
+
+N_INSTRUMENTS = 6
+DAYS = 252
+
+
+def create_close_data(n_instruments: int = N_INSTRUMENTS, days: int = DAYS) -> pd.DataFrame:
+    """__pack_close_data と同じ形(index: 日付, cols: 銘柄名)のダミーデータを作る"""
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range(end=datetime.date.today(), periods=days).date
+    closes = 100 * np.exp(np.cumsum(
+        rng.normal(0, 0.01, (days, n_instruments)), axis=0))
+    return pd.DataFrame(closes, index=dates, columns=[f"index_{i}" for i in range(n_instruments)])
+
+
+def legacy_update(close_of_updating: pd.DataFrame, today: datetime.datetime) -> None:
+    """変更前の _GraphData.update と同じ書き込み方(1行ずつquery + add/merge + commit)"""
+    session = Model.Session()
+    instrument_ids = dict(session.query(NameBase.name, NameBase.id).all())
+    for col in close_of_updating.columns:
+        data = close_of_updating[col]
+        days = dates_to_days(data.index)
+        for i, close in enumerate(data):
+            try:
+                day = int(days[i])
+                new_close = GraphData(instrument_id=instrument_ids[col], day=day,
+                                      close=float(close), updatetime=today)
+                stored = session.query(GraphData).filter_by(
+                    instrument_id=instrument_ids[col], day=day).first()
+                if stored is None:
+                    session.add(new_close)
+                else:
+                    session.merge(new_close)
+                session.commit()
+            except Exception:
+                session.rollback()
+    session.close()
+
+
+def main():
+    close_data = create_close_data()
+    n_rows = close_data.size
+    print(f"{n_rows} rows ({N_INSTRUMENTS} instruments x {DAYS} days)")
+    print(f"{'path':>24} {'seconds':>10} {'rows/s':>12}")
+    for label, write in [("legacy (insert)", "legacy"), ("legacy (rewrite)", "legacy"),
+                         ("upsert (insert)", "upsert"), ("upsert (unchanged)", "upsert")]:
+        if label.endswith("(insert)"):
+            tmp_dir = tempfile.TemporaryDirectory()
+            engine = create_engine(f"sqlite:///{tmp_dir.name}/bench.db")
+            Base.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(NameBase.__table__.insert(), [
+                    {"name": name, "searchname": name, "searchkeyword": name} for name in close_data.columns])
+            Model.Session.configure(bind=engine)
+        start = time.perf_counter()
+        if write == "legacy":
+            legacy_update(close_data, datetime.datetime.now())
+        else:
+            result = _GraphData(db_config=DBConfig()
+                                ).upsert_close_data(close_data)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>24} {elapsed:>10.3f} {n_rows / elapsed:>12.0f}")
+        if write == "upsert":
+            print(f"{'':>24} {result}")
+        if not label.endswith("(insert)"):
+            engine.dispose()
+            tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""階層的リスクパリティ(HierarchicalRiskParity)と分散最小化(MinVolatility)の、銘柄数に対する計算時間のベンチマーク
+
+ダミーの共分散(ファクターモデル)で、銘柄数を増やしながら
+    hrp: HierarchicalRiskParity.calculate の時間
+    min_vol_first: 初めての MinVolatility.calculate の時間(問題の組み立てを含む)
+    min_vol: 2回目の MinVolatility.calculate の時間(組み立て済みの問題を解くだけ)
+と、2つのポートフォリオの分散を表示する。MinVolatility は MIN_VOLATILITY_MAX_INSTRUMENTS 銘柄までにする。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_hrp
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.calculate_methods import HierarchicalRiskParity, MinVolatility
+from utils.lazy_import import import_optimizer
+from utils.statistics_cache import Statistics
+
+INSTRUMENT_COUNTS = [6, 50, 200, 500, 1000, 2000]
+MIN_VOLATILITY_MAX_INSTRUMENTS = 1000
+
+
+def make_statistics(n_instruments: int) -> Statistics:
+    """ファクターモデルの共分散を作る"""
+    rng = np.random.default_rng(0)
+    names = [f"fund_{i:04d}" for i in range(n_instruments)]
+    loadings = rng.normal(0, 0.1, size=(n_instruments, 5))
+    cov = loadings @ loadings.T + np.diag(rng.uniform(0.01, 0.04, n_instruments))
+    return Statistics(mean=pd.Series(rng.normal(0.06, 0.03, n_instruments), index=names),
+                      cov=pd.DataFrame(cov, index=names, columns=names))
+
+
+def portfolio_variance(weights: dict, statistics: Statistics) -> float:
+    weight_array = np.array([weights[name] for name in statistics.cov.index])
+    return float(weight_array @ statistics.cov.to_numpy() @ weight_array)
+
+
+def main():
+    import_optimizer()
+    print(f"{'instruments':>12} {'hrp[ms]':>9} {'min_vol_first[ms]':>18} {'min_vol[ms]':>12} "
+          f"{'hrp_var':>9} {'min_vol_var':>12}")
+    for n_instruments in INSTRUMENT_COUNTS:
+        statistics = make_statistics(n_instruments)
+        start = time.perf_counter()
+        hrp = HierarchicalRiskParity(statistics=statistics).calculate()
+        hrp_seconds = time.perf_counter() - start
+        line = f"{n_instruments:>12} {hrp_seconds * 1000:>9.1f}"
+        if n_instruments <= MIN_VOLATILITY_MAX_INSTRUMENTS:
+            start = time.perf_counter()
+            MinVolatility(statistics=statistics).calculate()
+            first_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            min_volatility = MinVolatility(statistics=statistics).calculate()
+            min_volatility_seconds = time.perf_counter() - start
+            line += (f" {first_seconds * 1000:>18.1f} {min_volatility_seconds * 1000:>12.1f} "
+                     f"{portfolio_variance(hrp, statistics):>9.5f} {portfolio_variance(min_volatility, statistics):>12.5f}")
+        else:
+            line += f" {'-':>18} {'-':>12} {portfolio_variance(hrp, statistics):>9.5f} {'-':>12}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""main をimportする時間のベンチマーク
+
+別プロセスで python -X importtime -c "import main" を REPEAT 回実行し、
+main のimportにかかった時間(中央値)と、時間のかかったmoduleを表示する。
+起動時に読み込まないようにしている重いmodule(HEAVY_MODULES)が読み込まれていたら、それも表示する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_import_time
+"""
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+REPEAT = 5
+# main のimportにかける時間の目標(ms)
+TARGET_MS = 600
+TOP = 10
+# 最初に使う時まで読み込まないもの
+HEAVY_MODULES = ["pypfopt", "cvxpy", "scipy",
+                 "plotly", "gspread", "oauth2client"]
+
+
+def import_times() -> Dict[str, Tuple[int, int]]:
+    """-X importtime の出力を {module: (self[us], cumulative[us])} にする"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            capture_output=True, text=True, check=True)
+    times: Dict[str, Tuple[int, int]] = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    runs: List[Dict[str, Tuple[int, int]]] = [
+        import_times() for _ in range(REPEAT)]
+    totals = sorted(run["main"][1] for run in runs)
+    total_ms = totals[len(totals) // 2] / 1000
+    status = "OK" if total_ms <= TARGET_MS else "OVER"
+    print(f"import main: {total_ms:.0f} ms (target {TARGET_MS} ms) {status}")
+
+    last = runs[-1]
+    print(f"\n{'cumulative[ms]':>15} {'self[ms]':>9}  module")
+    for name, (self_us, cumulative_us) in sorted(last.items(), key=lambda item: -item[1][1])[:TOP]:
+        print(f"{cumulative_us / 1000:>15.1f} {self_us / 1000:>9.1f}  {name}")
+
+    loaded = [name for name in HEAVY_MODULES if name in last]
+    print(f"\nheavy modules loaded at import: {loaded if loaded else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
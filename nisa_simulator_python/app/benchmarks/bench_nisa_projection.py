@@ -0,0 +1,83 @@
+"""NISAの試算(utils.nisa_projection)のベンチマーク
+
+CalculateConfig.projection_* の組み合わせと、それより細かい組み合わせについて、
+project_nisa で全ての組み合わせを1回で計算する時間と、組み合わせごとに月ごとのループで計算する時間を比較し、
+結果が同じになることも確認する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_nisa_projection
+"""
+import time
+
+import numpy as np
+
+from utils.calculate_config import CalculateConfig
+from utils.nisa_projection import MONTHS_PER_YEAR, project_nisa
+
+# ループで計算する組み合わせの数の上限(超えたら一部だけ計算して全体の時間を見積もる)
+LOOP_SAMPLE = 2000
+
+
+def project_one(monthly_yen: int, years: int, annual_return: float, withdrawal_start: int):
+    """1つの組み合わせを、月ごとにNISAの枠を確認しながら計算する"""
+    growth = (1 + annual_return) ** (1 / MONTHS_PER_YEAR)
+    tsumitate_cap = CalculateConfig.nisa_tsumitate_annual_cap / MONTHS_PER_YEAR
+    growth_cap = CalculateConfig.nisa_growth_annual_cap / MONTHS_PER_YEAR
+    nisa = taxable = overflow = 0.0
+    nisa_cost = growth_cost = 0.0
+    for month in range(withdrawal_start * MONTHS_PER_YEAR):
+        if month < years * MONTHS_PER_YEAR:
+            tsumitate = min(monthly_yen, tsumitate_cap)
+            growth_part = min(monthly_yen - tsumitate, growth_cap,
+                              CalculateConfig.nisa_growth_lifetime_cap - growth_cost)
+            nisa_part = min(tsumitate + growth_part,
+                            CalculateConfig.nisa_lifetime_cap - nisa_cost)
+            growth_cost += growth_part
+            nisa_cost += nisa_part
+            nisa += nisa_part
+            overflow += monthly_yen - nisa_part
+            taxable += monthly_yen
+        nisa *= growth
+        overflow *= growth
+        taxable *= growth
+    contributed = monthly_yen * min(years, withdrawal_start) * MONTHS_PER_YEAR
+    rate = CalculateConfig.taxable_tax_rate
+    taxable_after = taxable - rate * max(taxable - contributed, 0)
+    nisa_after = nisa + overflow - rate * \
+        max(overflow - (contributed - nisa_cost), 0)
+    return nisa_after, taxable_after
+
+
+def run(label: str, monthly_yen, years, returns, withdrawal_start) -> None:
+    scenarios = [(c, y, r, w) for c in monthly_yen for y in years
+                 for r in returns for w in withdrawal_start]
+    start = time.perf_counter()
+    projection = project_nisa(monthly_yen, years, returns, withdrawal_start)
+    vectorized_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(scenarios), size=min(
+        LOOP_SAMPLE, len(scenarios)), replace=False)
+    nisa_balance = np.asarray(projection.nisa_balance).ravel()
+    taxable_balance = np.asarray(projection.taxable_balance).ravel()
+    start = time.perf_counter()
+    max_error = 0.0
+    for i in sample:
+        nisa_after, taxable_after = project_one(*scenarios[i])
+        max_error = max(max_error, abs(nisa_after - nisa_balance[i]),
+                        abs(taxable_after - taxable_balance[i]))
+    loop_seconds = (time.perf_counter() - start) * len(scenarios) / len(sample)
+    print(f"{label:>8} {len(scenarios):>10} {vectorized_seconds * 1000:>12.1f} {loop_seconds * 1000:>12.0f} "
+          f"{loop_seconds / vectorized_seconds:>8.0f} {max_error:>10.2f}")
+
+
+def main():
+    print(f"{'grid':>8} {'scenarios':>10} {'vector[ms]':>12} {'loop[ms]':>12} {'speedup':>8} {'max_err':>10}")
+    run("default", CalculateConfig.projection_monthly_yen, CalculateConfig.projection_years,
+        [0.0, 0.02, 0.04, 0.06, 0.08], CalculateConfig.projection_withdrawal_start)
+    run("fine", list(range(10000, 310000, 10000)), list(range(1, 41)),
+        np.round(np.linspace(-0.02, 0.1, 25), 4).tolist(), list(range(5, 51, 5)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""組み立て済みの最適化の問題(utils.portfolio_problem)のベンチマーク
+
+ダミーの平均と分散で、目標リターンと購入割合の上限を変えながらリターン制約付きの分散最小化を解き、
+    pypfopt: 毎回 EfficientFrontier を作って解く時間(変換 + 解く)
+    compile: 毎回 PortfolioProblem を作って解く時間(変換 + 解く)
+    update: 1つの PortfolioProblem の Parameter だけを変えて warm start で解く時間
+と、pypfopt との購入割合の最大の差を表示する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_portfolio_problem
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.lazy_import import import_optimizer
+from utils.portfolio_problem import PortfolioProblem
+from utils.statistics_cache import Statistics
+
+INSTRUMENT_COUNTS = [6, 50, 200]
+SOLVES = 20
+
+
+def make_statistics(n_instruments: int) -> Statistics:
+    """ファクターモデルの共分散と、ばらついた期待リターンを作る"""
+    rng = np.random.default_rng(0)
+    names = [f"index_{i:04d}" for i in range(n_instruments)]
+    loadings = rng.normal(0, 0.1, size=(n_instruments, 3))
+    cov = loadings @ loadings.T + np.diag(rng.uniform(0.01, 0.04, n_instruments))
+    return Statistics(mean=pd.Series(rng.normal(0.06, 0.03, n_instruments), index=names),
+                      cov=pd.DataFrame(cov, index=names, columns=names))
+
+
+def make_requests(statistics: Statistics):
+    """目標リターンと、1つの銘柄の購入割合の上限を変えたリクエストを作る"""
+    rng = np.random.default_rng(1)
+    names = list(statistics.mean.index)
+    targets = np.linspace(statistics.mean.quantile(0.5), statistics.mean.quantile(0.8), SOLVES)
+    return [(float(target), {names[i]: 0.1} if j % 2 else None)
+            for j, (target, i) in enumerate(zip(targets, rng.integers(0, len(names), SOLVES)))]
+
+
+def main():
+    import_optimizer()
+    from pypfopt.efficient_frontier import EfficientFrontier
+
+    print(f"{SOLVES} solves of efficient_return with varying target_return and max_weights")
+    print(f"{'instruments':>12} {'pypfopt[ms]':>12} {'compile[ms]':>12} {'first[ms]':>10} {'update[ms]':>11} "
+          f"{'speedup':>8} {'max_diff':>9}")
+    for n_instruments in INSTRUMENT_COUNTS:
+        statistics = make_statistics(n_instruments)
+        requests = make_requests(statistics)
+
+        start = time.perf_counter()
+        expected = []
+        for target_return, max_weights in requests:
+            ef = EfficientFrontier(statistics.mean, statistics.cov)
+            if max_weights is not None:
+                for name, weight in max_weights.items():
+                    ef.add_constraint(lambda w, i=list(statistics.mean.index).index(name), weight=weight:
+                                      w[i] <= weight)
+            expected.append(ef.efficient_return(target_return=target_return))
+        pypfopt_seconds = (time.perf_counter() - start) / SOLVES
+
+        start = time.perf_counter()
+        for target_return, max_weights in requests:
+            PortfolioProblem(names=list(statistics.mean.index)).efficient_return(
+                statistics, target_return=target_return, max_weights=max_weights)
+        compile_seconds = (time.perf_counter() - start) / SOLVES
+
+        problem = PortfolioProblem(names=list(statistics.mean.index))
+        start = time.perf_counter()
+        problem.efficient_return(statistics, target_return=requests[0][0])
+        first_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        solved = [problem.efficient_return(statistics, target_return=target_return, max_weights=max_weights)
+                  for target_return, max_weights in requests]
+        update_seconds = (time.perf_counter() - start) / SOLVES
+
+        max_diff = max(abs(weights[name] - expected_weights[name])
+                       for weights, expected_weights in zip(solved, expected) for name in weights)
+        print(f"{n_instruments:>12} {pypfopt_seconds * 1000:>12.1f} {compile_seconds * 1000:>12.1f} "
+              f"{first_seconds * 1000:>10.1f} {update_seconds * 1000:>11.2f} "
+              f"{pypfopt_seconds / update_seconds:>8.1f} {max_diff:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""price cube(db.price_cube)のベンチマーク
+
+一時的なsqliteに 10年分の日次データを作り、get_datas_from_db の読み込み時間を
+dbから読む時と、memmapしたprice cubeから読む時で比較する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_price_cube
+"""
+import tempfile
+import time
+from typing import List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from benchmarks.bench_get_datas_from_db import create_dummy_db
+from db.db_config import DBConfig
+from db.price_cube import PriceCubeReader, build_price_cube
+from utils import get_finance
+
+YEARS = 10
+INSTRUMENT_COUNTS = [10, 100, 1000]
+REPEAT = 5
+
+
+def measure(func) -> float:
+    """REPEAT 回実行して、1回あたりの秒数(中央値)を返す"""
+    times: List[float] = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    print(f"{'instruments':>12} {'rows':>10} {'build[s]':>9} {'db[ms]':>9} {'open[ms]':>9} {'cube[ms]':>9}")
+    for n_instruments in INSTRUMENT_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = create_engine(f"sqlite:///{tmp_dir}/bench.db")
+            create_dummy_db(engine, n_instruments, years=YEARS)
+            get_finance.session = scoped_session(sessionmaker(bind=engine))
+            cube_directory = f"{tmp_dir}/price_cube"
+
+            DBConfig.price_cube_enabled = False
+            db_seconds = measure(get_finance.get_datas_from_db)
+
+            start = time.perf_counter()
+            with engine.connect() as conn:
+                cube = build_price_cube(conn, directory=cube_directory)
+            build_seconds = time.perf_counter() - start
+
+            DBConfig.price_cube_enabled = True
+            # 初回はindex.jsonを読んでmemmapで開く
+            get_finance.price_cube_reader = PriceCubeReader(
+                directory=cube_directory)
+            start = time.perf_counter()
+            get_finance.get_datas_from_db()
+            open_seconds = time.perf_counter() - start
+            cube_seconds = measure(get_finance.get_datas_from_db)
+            print(f"{n_instruments:>12} {cube.closes.size:>10} {build_seconds:>9.2f} {db_seconds * 1000:>9.1f} "
+                  f"{open_seconds * 1000:>9.2f} {cube_seconds * 1000:>9.2f}")
+            get_finance.session.remove()
+            engine.dispose()
+    DBConfig.price_cube_enabled = False
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""積立のモンテカルロ法(utils.simulation)のベンチマーク
+
+ダミーの平均と分散で、PATHS 本の経路を YEARS 年分計算する速さ(経路/秒)を、プロセスプールのプロセス数を変えて比較する。
+同じseedなら、プロセス数によらず同じ結果になることも確認する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_simulation
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import executors
+from utils.calculate_config import CalculateConfig
+from utils.simulation import simulate
+from utils.statistics_cache import Statistics
+
+PATHS = 100000
+YEARS = 30
+MONTHLY_YEN = 33333
+INSTRUMENT_COUNTS = [6, 50]
+WORKERS = sorted({1, 2, 4, os.cpu_count() or 1})
+
+
+def make_statistics(n_instruments: int) -> Statistics:
+    """年率5%前後のリターンと、相関のある共分散を作る"""
+    rng = np.random.default_rng(0)
+    names = [f"index_{i:04d}" for i in range(n_instruments)]
+    loadings = rng.normal(0, 0.1, size=(n_instruments, 3))
+    cov = loadings @ loadings.T + np.diag(rng.uniform(0.01, 0.03, n_instruments))
+    return Statistics(mean=pd.Series(rng.normal(0.05, 0.02, n_instruments), index=names),
+                      cov=pd.DataFrame(cov, index=names, columns=names))
+
+
+def main():
+    print(f"{PATHS} paths x {YEARS} years, chunk {CalculateConfig.simulation_chunk_paths} paths")
+    print(f"{'instruments':>12} {'workers':>8} {'seconds':>8} {'paths/s':>10} {'p50[yen]':>12} {'same':>5}")
+    default_workers = CalculateConfig.process_pool_workers
+    for n_instruments in INSTRUMENT_COUNTS:
+        statistics = make_statistics(n_instruments)
+        weights = dict(zip(statistics.mean.index, np.full(
+            n_instruments, 1 / n_instruments)))
+        base = None
+        for workers in WORKERS:
+            executors.shutdown_pools()
+            CalculateConfig.process_pool_workers = workers
+            # プロセスの起動とimportを計測に含めない
+            simulate(weights, statistics, MONTHLY_YEN, years=1, paths=workers)
+            start = time.perf_counter()
+            result = simulate(weights, statistics, MONTHLY_YEN,
+                              years=YEARS, paths=PATHS, seed=0)
+            seconds = time.perf_counter() - start
+            base = base or result
+            print(f"{n_instruments:>12} {workers:>8} {seconds:>8.2f} {PATHS / seconds:>10.0f} "
+                  f"{result.final_balance['p50']:>12.0f} {str(result.bands == base.bands):>5}")
+    executors.shutdown_pools()
+    CalculateConfig.process_pool_workers = default_workers
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""平均と分散のキャッシュのベンチマーク
+
+一時的なsqliteにダミーデータを作り、/portfolio/{name} と同じ処理
+(get_statistics -> ICalculateMethod -> calculate)をキャッシュが空の時と効いている時で比較する。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_statistics_cache
+"""
+import tempfile
+import time
+from typing import List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.bench_get_datas_from_db import create_dummy_db
+from utils import get_finance
+from utils.calculate_methods import EfficientReturn, MaxSharpe, MinVolatility
+from utils.statistics_cache import statistics_cache
+
+YEARS = 10
+INSTRUMENT_COUNTS = [6, 50]
+REPEAT = 5
+
+
+def portfolio_request(method) -> None:
+    """/portfolio/{name} で行う計算"""
+    method(statistics=get_finance.get_statistics()).calculate()
+
+
+def measure(method, clear_cache: bool) -> float:
+    """REPEAT 回実行して、1回あたりの秒数(中央値)を返す"""
+    times: List[float] = []
+    for _ in range(REPEAT):
+        if clear_cache:
+            statistics_cache.clear()
+        start = time.perf_counter()
+        portfolio_request(method)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    print(f"{'instruments':>12} {'method':>16} {'cold[ms]':>10} {'warm[ms]':>10}")
+    for n_instruments in INSTRUMENT_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = create_engine(f"sqlite:///{tmp_dir}/bench.db")
+            create_dummy_db(engine, n_instruments, years=YEARS)
+            get_finance.session = sessionmaker(bind=engine)()
+            # EfficientReturn の目標リターンを満たせるように、低めにする
+            methods = [("EfficientReturn", lambda statistics: EfficientReturn(statistics=statistics, target_return=0.0)),
+                       ("MinVolatility", MinVolatility),
+                       ("MaxSharpe", MaxSharpe)]
+            for label, method in methods:
+                cold = measure(method, clear_cache=True)
+                warm = measure(method, clear_cache=False)
+                print(
+                    f"{n_instruments:>12} {label:>16} {cold * 1000:>10.1f} {warm * 1000:>10.1f}")
+            get_finance.session.close()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
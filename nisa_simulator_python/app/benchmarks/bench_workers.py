@@ -0,0 +1,109 @@
+"""gunicorn のworker数を変えた時の /portfolio/{name} のスループットのベンチマーク
+
+gunicorn_conf.py で WORKERS の各worker数のサーバーを起動し、/ready が返るまで待ってから、
+CLIENTS 個のプロセスが DURATION_SECONDS の間 /portfolio/{name} を呼び続けた回数と、
+workerのメモリ(Rss と、共有しているページを按分した Pss)を表示する。
+db/nisa.db にデータが入っている必要がある。1回目の計算結果はCalculateResultに保存されるので、計測は2回目以降の読み込み。
+
+appディレクトリで実行する:
+    python -m benchmarks.bench_workers
+"""
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+import urllib.parse
+
+PORT = 18080
+WORKERS = [n for n in [1, 2, 4, 8] if n <= (os.cpu_count() or 1)]
+CLIENTS = 2 * max(WORKERS)
+DURATION_SECONDS = 10.0
+METHOD_NAME = "分散最小化"
+READY_TIMEOUT_SECONDS = 120
+
+
+def request(conn: http.client.HTTPConnection, path: str) -> int:
+    """GETしてステータスコードを返す"""
+    conn.request("GET", path)
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def client(path: str, deadline: float) -> int:
+    """deadline まで path を呼び続けて、成功した回数を返す"""
+    conn = http.client.HTTPConnection("127.0.0.1", PORT)
+    count = 0
+    while time.time() < deadline:
+        if request(conn, path) == 200:
+            count += 1
+    conn.close()
+    return count
+
+
+def wait_ready(workers: int) -> None:
+    """どのworkerに当たっても /ready が200になるまで待つ"""
+    deadline = time.time() + READY_TIMEOUT_SECONDS
+    ok = 0
+    while ok < 4 * workers:
+        if time.time() > deadline:
+            raise Exception("In wait_ready. サーバーの準備ができない")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", PORT)
+            ok = ok + 1 if request(conn, "/ready") == 200 else 0
+            conn.close()
+        except OSError:
+            ok = 0
+        time.sleep(0.1)
+
+
+def memory_kib(pids: List[int]) -> Dict[str, int]:
+    """プロセスの Rss と Pss(kiB)を合計する"""
+    total = {"Rss": 0, "Pss": 0}
+    for pid in pids:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key = line.split(":")[0]
+                if key in total:
+                    total[key] += int(line.split()[1])
+    return total
+
+
+def worker_pids(master_pid: int) -> List[int]:
+    """gunicorn のmasterが起動したworkerのpid"""
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def main():
+    path = f"/portfolio/{urllib.parse.quote(METHOD_NAME)}"
+    print(f"{CLIENTS} clients, {DURATION_SECONDS:.0f}s, GET {METHOD_NAME}")
+    print(f"{'workers':>8} {'req/s':>9} {'speedup':>8} {'rss[MiB]':>9} {'pss[MiB]':>9}")
+    base = None
+    for workers in WORKERS:
+        env = dict(os.environ, NISA_WORKERS=str(workers), PORT=str(PORT))
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app"],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(workers)
+            conn = http.client.HTTPConnection("127.0.0.1", PORT)
+            request(conn, path)
+            conn.close()
+            deadline = time.time() + DURATION_SECONDS
+            with multiprocessing.Pool(CLIENTS) as pool:
+                counts = pool.starmap(client, [(path, deadline)] * CLIENTS)
+            throughput = sum(counts) / DURATION_SECONDS
+            base = base or throughput
+            memory = memory_kib(worker_pids(server.pid))
+            print(f"{workers:>8} {throughput:>9.1f} {throughput / base:>8.2f} "
+                  f"{memory['Rss'] / 1024:>9.1f} {memory['Pss'] / 1024:>9.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
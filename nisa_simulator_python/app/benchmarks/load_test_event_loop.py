@@ -0,0 +1,68 @@
+"""event loop が止まらないことを確かめる負荷試験
+
+起動しているAPIに対して、/graph/ を一定間隔で叩き続けながら、
+/update と /portfolios(最適化)を同時に投げ、/graph/ のレイテンシ(p50, p99)を比較する。
+
+appディレクトリでAPIを起動してから実行する:
+    uvicorn main:app --port 8080
+    python -m benchmarks.load_test_event_loop http://localhost:8080
+"""
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import time
+from typing import List
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+GRAPH_REQUESTS = 200
+GRAPH_CONCURRENCY = 4
+HEAVY_REQUESTS = 8
+
+
+def request(url: str, method: str = "GET") -> float:
+    """url を叩いて、レイテンシ(秒)を返す"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method=method), timeout=120) as response:
+            response.read()
+    except urllib.error.HTTPError:
+        pass
+    return time.perf_counter() - start
+
+
+def measure_graph(base_url: str) -> List[float]:
+    """/graph/ を GRAPH_CONCURRENCY 並列で GRAPH_REQUESTS 回叩く"""
+    with ThreadPoolExecutor(max_workers=GRAPH_CONCURRENCY) as executor:
+        return list(executor.map(lambda _: request(f"{base_url}/graph/"), range(GRAPH_REQUESTS)))
+
+
+def heavy_requests(base_url: str) -> None:
+    """/update と、毎回違うパラメータの /portfolios を投げ続ける"""
+    urls = [(f"{base_url}/update", "POST")]
+    for i in range(HEAVY_REQUESTS):
+        query = urllib.parse.urlencode({"risk_free_rate": 0.001 * i})
+        urls.append((f"{base_url}/portfolios?{query}", "GET"))
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        list(executor.map(lambda url: request(*url), urls))
+
+
+def report(label: str, latencies: List[float]) -> None:
+    print(f"{label:>24} p50={np.percentile(latencies, 50) * 1000:8.1f}ms p99={np.percentile(latencies, 99) * 1000:8.1f}ms")
+
+
+def main():
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8080"
+    request(f"{base_url}/graph/")
+    report("/graph/ alone", measure_graph(base_url))
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        heavy = executor.submit(heavy_requests, base_url)
+        latencies = measure_graph(base_url)
+        heavy.result()
+    report("/graph/ with heavy load", latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,118 @@
 import datetime
-import time
-from webbrowser import get
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List
 
-import gspread
+import numpy as np
 import pandas as pd
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+from sqlalchemy import func, inspect, text, Column, ForeignKey, Integer, String, Float, DateTime
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 
 from db.db_config import DBConfig
+from db.engine import create_db_engine
+from db.file_lock import FileLock
+from db.price_cube import build_price_cube, remove_price_cube
+from db.price_provider import IPriceProvider, get_price_provider
+from utils.chart_cache import chart_payload_cache
 
 
 Base = declarative_base()
-engine = create_engine(DBConfig.db_uri, echo=False)
+engine = create_db_engine(DBConfig.db_uri)
 Session = sessionmaker(bind=engine)
+# APIのスレッドプールから使うsession. スレッドごとに別のsessionになり、仕事が終わるたびに remove する
+ScopedSession = scoped_session(Session)
 DbConfig: DBConfig = DBConfig()
+# GraphDataの更新を全てのプロセスで1つずつ行うためのロック。
+# spread sheet の作業用のシート(ToDB, ToDB_1, ...)は全てのプロセスで共有なので、取得と書き込みの間ずっと持つ
+update_lock = FileLock(DBConfig.update_lock_file)
 
 
 class GraphData(Base):
     """[summary] グラフを描くためのモデル
-    date: 年月日
-    name:銘柄名
+    instrument_id: NameBase.id
+    day: 1970-01-01 からの日数(dates_to_days)
     close:値段
     Args:
         db ([type]): [description]
     """
     __tablename__ = "graph_data"
-    date = Column(DateTime, primary_key=True)
-    name = Column(String, primary_key=True)
+    # 1銘柄の全期間の読み込みが主キーの範囲scanになるように (instrument_id, day) の順にし、
+    # 行を主キー順に並べて持つ WITHOUT ROWID テーブルにする
+    __table_args__ = {"sqlite_with_rowid": False}
+    instrument_id = Column(Integer, ForeignKey(
+        "name_base.id"), primary_key=True)
+    # 期間を指定して全銘柄を読み込む時のためにindexを張る
+    day = Column(Integer, primary_key=True, index=True)
     close = Column(Float)
+    updatetime = Column(DateTime, index=True)
+
+
+class DataVersion(Base):
+    """[summary] GraphDataのバージョンを持つ1行だけのテーブル
+    id: 常に1
+    version: GraphDataに書き込んだ回数. upsert_close_data が書き込みと同じトランザクションで1つ増やす
+    updatetime: 最後に書き込んだ時刻
+    """
+    __tablename__ = "data_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
     updatetime = Column(DateTime)
 
 
+def dates_to_days(dates) -> np.ndarray:
+    """日付を GraphData.day(1970-01-01 からの日数)に変換する
+
+    Args:
+        dates: 日付のリスト, Series, DatetimeIndex など
+
+    Returns:
+        np.ndarray: int64 の日数
+    """
+    return pd.DatetimeIndex(pd.to_datetime(dates)).values.astype("datetime64[D]").astype("int64")
+
+
+def days_to_dates(days) -> pd.DatetimeIndex:
+    """GraphData.day(1970-01-01 からの日数)を日付に変換する
+
+    Args:
+        days: 日数のリスト, Series, np.ndarray など
+
+    Returns:
+        pd.DatetimeIndex: 日付
+    """
+    return pd.to_datetime(np.asarray(days, dtype="int64"), unit="D")
+
+
+@dataclass
+class UpsertResult:
+    """_GraphData.upsert_close_data の結果
+    inserted: 新しく追加した行数
+    updated: closeを書き換えた行数
+    unchanged: closeが同じだったので書き込まなかった行数
+    """
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+
 class _GraphData:
     """DBのGraphDataのcreate, updateを行うクラス
-    ただし、create, updateで登録するデータは呼び出された日(now) ~ nowから1年前までのデータ
+    ただし、create, updateで登録するデータは呼び出された日(now) ~ nowから DBConfig.history_years 年前までのデータ
     """
 
-    def __init__(self, db_config: DBConfig):
+    def __init__(self, db_config: DBConfig, price_provider: IPriceProvider = None):
+        """
+        Args:
+            db_config (DBConfig): 設定
+            price_provider (IPriceProvider, optional): closeの取得方法. Noneなら db_config.price_provider で指定したもの. Defaults to None.
+        """
         self.db_config = db_config
+        if price_provider is None:
+            price_provider = get_price_provider(db_config=db_config)
+        self.price_provider = price_provider
 
     def update_config(self, now: datetime.datetime) -> None:
         """self.db_config のstart_time, nowを更新する
@@ -48,167 +122,259 @@ class _GraphData:
         """
         self.db_config.cls_update_now_start_time(now=now)
 
-    def update(self):
-        """db_config.DBConfig の日付を使ってGraphDataをupdateする
+    def update(self, incremental: bool = True, progress: Callable[[str, str], None] = None) -> "UpsertResult":
+        """db_config.DBConfig の日付を使ってGraphDataをupdateする。update_lock を持っている時に呼ぶ
+
+        Args:
+            incremental (bool, optional): Trueなら、銘柄ごとにGraphDataの最新の日付
+                (から db_config.incremental_overlap_days 日前)以降だけを取得する. Defaults to True.
+            progress (Callable[[str, str], None], optional): 銘柄ごとの進み具合を受け取る関数.
+                progress(NameBase.name, "pending" | "fetching" | "fetched" | "failed" | "skipped") の形で呼ばれる. Defaults to None.
+
+        Raises:
+            Exception: update_lock を持っていない時
+
+        Returns:
+            UpsertResult: insert, update, 変更なしの行数. データの取得に失敗した時はNone
         """
-        session = Session()
+        self.check_update_lock()
         try:
-            close_of_updating = self.__pack_close_data()
+            close_of_updating = self.__pack_close_data(
+                incremental=incremental, progress=progress)
         except Exception as error_of_update_graph_data:
             print(f"get_data 失敗 {error_of_update_graph_data}")
             return
-        cols = list(close_of_updating.columns)
-        today = self.db_config.now
-
-        # GraphData にデータがあればupdate, なければinsert する
-        for col in cols:
-            data = close_of_updating[col]
-            for i, close in enumerate(data):
-                try:
-                    ind = data.index[i]
-                    new_close = GraphData(date=ind, name=col,
-                                          close=close, updatetime=today)
-                    close = session.query(GraphData).filter_by(
-                        date=ind, name=col).first()
-                    if close is None:
-                        session.add(new_close)
-                    else:
-                        session.merge(new_close)
-                    session.commit()
-
-                except Exception as error_of_update_graph_data:
-                    print(
-                        f"UpdateGraphData でエラーが発生。{error_of_update_graph_data}")
-                    session.rollback()
-        return
-
-    def create(self):
+        result = self.upsert_close_data(close_of_updating)
+        self.rebuild_price_cube()
+        return result
+
+    def create(self) -> "UpsertResult":
         """GraphDataにinsertする。
-        insertするデータは、NameBase.name からGoogleFinanceで集めた
-        self.db_config.start_time ~ self.db_config.now までの、Closeのデータ。
+        insertするデータは、NameBase.name からself.price_provider で集めた
+        self.db_config.start_time ~ self.db_config.now までの、Closeのデータ。update_lock を持っている時に呼ぶ
+
+        Raises:
+            Exception: update_lock を持っていない時
+
+        Returns:
+            UpsertResult: insert, update, 変更なしの行数. データの取得に失敗した時はNone
         """
+        self.check_update_lock()
         try:
             close_data: pd.DataFrame = self.__pack_close_data()
         except Exception:
             return
-        cols = list(close_data.columns)
-        today: datetime = self.db_config.now
+        result = self.upsert_close_data(close_data)
+        self.rebuild_price_cube()
+        return result
+
+    def check_update_lock(self) -> None:
+        """update_lock を持っているか確認する。他のプロセスの更新と、作業用のシートへの書き込みが重ならないようにする
+
+        Raises:
+            Exception: update_lock を持っていない時
+        """
+        if not update_lock.locked():
+            raise Exception(
+                f"In {self.check_update_lock.__name__}. GraphDataの更新は Model.update_lock を取ってから行う")
+
+    def rebuild_price_cube(self) -> None:
+        """db_config.price_cube_enabled なら、GraphData全体から db.price_cube のファイルを作り直す
+        """
+        if not self.db_config.price_cube_enabled:
+            return
+        session = Session()
+        try:
+            build_price_cube(
+                session, directory=self.db_config.price_cube_directory)
+        except Exception as error_of_build_price_cube:
+            # 作れなくても get_datas_from_db はdbから読むので、updateは失敗にしない
+            print(f"In {self.rebuild_price_cube.__name__} error occured :{error_of_build_price_cube}")
+        finally:
+            session.close()
+
+    def upsert_close_data(self, close_data: pd.DataFrame) -> "UpsertResult":
+        """closeのDataFrameをまとめてGraphDataにupsertする。
+        既存の値と同じcloseの行は書き込まず、残りを INSERT ... ON CONFLICT(instrument_id, day) DO UPDATE で
+        chunk_size 行ずつexecutemanyする。全体で1トランザクション。
+
+        Args:
+            close_data (pd.DataFrame): index: 日付, cols: NameBase.name のclose
+
+        Returns:
+            UpsertResult: insert, update, 変更なしの行数
+        """
+        result = UpsertResult()
+        if close_data is None or close_data.empty:
+            return result
+        close_data = close_data.copy()
+        close_data.index = pd.to_datetime(close_data.index)
+        rows = close_data.stack().dropna()
+        if rows.empty:
+            return result
+        rows.index.names = ["date", "name"]
+        rows = rows.astype("float64").rename("close").reset_index()
+        rows["day"] = dates_to_days(rows["date"])
+
+        session = Session()
         try:
-            session = Session()
-            for col in cols:
-                data = close_data[col]
-                for i, d in enumerate(data):
-                    ind = data.index[i]
-                    graph_data: GraphData = GraphData(
-                        date=ind, name=col, close=d, updatetime=today)
-                    session.add(graph_data)
+            names = rows["name"].unique().tolist()
+            instrument_ids = dict(session.query(NameBase.name, NameBase.id).filter(
+                NameBase.name.in_(names)).all())
+            unknown_names = sorted(set(names) - set(instrument_ids))
+            if len(unknown_names) > 0:
+                raise Exception(f"{unknown_names} は NameBase のリストに無い")
+            rows["instrument_id"] = rows["name"].map(instrument_ids)
+            # 書き込み範囲の既存データを1回のqueryで取得して、新規/更新/変更なしに振り分ける
+            existing = pd.DataFrame(session.query(GraphData.instrument_id, GraphData.day, GraphData.close).filter(
+                GraphData.instrument_id.in_(list(instrument_ids.values())),
+                GraphData.day >= int(rows["day"].min()),
+                GraphData.day <= int(rows["day"].max())).all(),
+                columns=["instrument_id", "day", "stored_close"])
+            merged = rows.merge(
+                existing, on=["instrument_id", "day"], how="left", indicator=True)
+            is_new = merged["_merge"] == "left_only"
+            is_unchanged = merged["close"] == merged["stored_close"]
+            result.inserted = int(is_new.sum())
+            result.unchanged = int(is_unchanged.sum())
+            result.updated = len(merged) - result.inserted - result.unchanged
+
+            changed = merged.loc[~is_unchanged, ["instrument_id", "day", "close"]]
+            changed["updatetime"] = self.db_config.now
+            records = changed.to_dict("records")
+
+            insert = postgresql_insert if session.bind.dialect.name == "postgresql" else sqlite_insert
+            statement = insert(GraphData.__table__)
+            statement = statement.on_conflict_do_update(
+                index_elements=[GraphData.instrument_id, GraphData.day],
+                set_={"close": statement.excluded.close,
+                      "updatetime": statement.excluded.updatetime})
+            chunk_size = self.db_config.upsert_chunk_size
+            for start in range(0, len(records), chunk_size):
+                session.execute(statement, records[start:start + chunk_size])
+            if len(records) > 0:
+                # 読む側が get_data_version で1行を引くだけで変更に気づけるように、バージョンを増やす
+                version_statement = insert(DataVersion.__table__).values(
+                    id=1, version=1, updatetime=self.db_config.now)
+                version_statement = version_statement.on_conflict_do_update(
+                    index_elements=[DataVersion.id],
+                    set_={"version": DataVersion.__table__.c.version + 1,
+                          "updatetime": version_statement.excluded.updatetime})
+                session.execute(version_statement)
             session.commit()
-        except Exception:
+            if len(records) > 0:
+                # 古いグラフのレスポンスと、古いcloseの配列を使わないように捨てる
+                chart_payload_cache.clear()
+                remove_price_cube(self.db_config.price_cube_directory)
+        except Exception as error_of_upsert_graph_data:
+            print(f"UpsertGraphData でエラーが発生。{error_of_upsert_graph_data}")
             session.rollback()
-        return
+            raise
+        finally:
+            session.close()
+        return result
+
+    def get_last_dates(self) -> Dict[str, datetime.datetime]:
+        """GraphDataに保存されている、銘柄ごとの最新の日付を1回のqueryで取得する
 
-    def __pack_close_data(self) -> pd.DataFrame:
+        Returns:
+            Dict[str, datetime.datetime]: {NameBase.name: MAX(GraphData.day) の日付}
+        """
+        session = Session()
+        try:
+            last_days = session.query(NameBase.name, func.max(GraphData.day)).join(
+                NameBase, NameBase.id == GraphData.instrument_id).filter(
+                GraphData.close.isnot(None)).group_by(NameBase.name).all()
+        finally:
+            session.close()
+        return {name: days_to_dates([last_day])[0].to_pydatetime() for name, last_day in last_days}
+
+    def __pack_close_data(self, incremental: bool = False, progress: Callable[[str, str], None] = None) -> pd.DataFrame:
         """[summary]
         db_config.DBConfig.starttimeからdb_config.DBConfig.nowまでのデータを収集し、DataFrameにまとめる。
+        incremental がTrueなら、GraphDataに保存済みの銘柄は最新の日付の
+        db_config.incremental_overlap_days 日前からのデータだけを収集する。
         DataFrameの列名はNameBase.name
+
+        Args:
+            incremental (bool, optional): 差分だけ収集するかどうか. Defaults to False.
+            progress (Callable[[str, str], None], optional): 銘柄ごとの進み具合を受け取る関数. Defaults to None.
+
         Returns:
             [type pandas.DataFrame]: [description] 取得したデータをまとめたdataframe。 col はNameBase.name
         """
+        # self.db_configの更新
+        self.update_config(now=datetime.datetime.now())
         session = Session()
         names = session.query(
             NameBase.searchname, NameBase.name).all()
-        close = pd.Series()
-        for i, name_information in enumerate(names):
+        session.close()
+        last_dates = self.get_last_dates() if incremental else dict()
+        overlap = datetime.timedelta(
+            days=self.db_config.incremental_overlap_days)
+        if progress is None:
+            def progress(name: str, state: str) -> None:
+                return None
+        for _, display_name in names:
+            progress(display_name, "pending")
+
+        def fetch(name: str, display_name: str, start: datetime.datetime) -> pd.Series:
+            progress(display_name, "fetching")
             try:
-                name = name_information[0]
-                display_name = name_information[1]
-                if i == 0:
-                    base = pd.DataFrame(self.__fetch_close_from_spread_sheet(
-                        name=name, display_name=display_name))
-                else:
-                    close_series = self.__fetch_close_from_spread_sheet(
-                        name=name, display_name=display_name)
-                    close = base.join(close_series)
-                    base = close
+                close_series = self.price_provider.fetch_close(
+                    name=name, display_name=display_name, start=start, end=self.db_config.now)
             except Exception:
-                continue
-        return close
-
-    def __fetch_close_from_spread_sheet(self, name, display_name) -> pd.Series:
-        """[summary] spread sheet で、インデックスのデータを取得し、pd.series を返す。本日(この関数が呼ばれた時)から一年前までのデータを取得する。
-
-        Args:
-            name(str) : [description] GoogleFinanceで検索に使う名前
-            display_name(str): [description] Series のname
-
-        Returns:
-            [type]pandas.Series: [description] index,name付きのpandas.Series. indexは株価の日付、nameはdisplay_name
-        """
-
-        # self.db_configの更新
-        now_time: datetime.datetime = datetime.datetime.now()
-        self.update_config(now=now_time)
-        # データ作成
+                progress(display_name, "failed")
+                raise
+            progress(display_name, "failed" if close_series.empty else "fetched")
+            return close_series
+
+        # 銘柄ごとの取得は並列に行い、全部終わってからまとめる
+        closes: List[pd.Series] = []
+        self.price_provider.open()
         try:
-            gspread_client = gspread.authorize(self.db_config.credentials)
-            spread_sheet = gspread_client.open(self.db_config.file_name)
-            start = self.db_config.starttime
-            start_year = start.year
-            start_month = start.month
-            start_day = start.day
-            if start_day < 1:
-                start_day = 1
-            start_string = f"DATE({start_year},{start_month},{start_day})"
-            end = self.db_config.now
-            end_year = end.year
-            end_month = end.month
-            end_day = end.day
-            end_string = f"DATE({end_year},{end_month},{end_day})"
-            # spread sheetで株価データを取得するコマンド
-            command = f'=GoogleFinance("{name}","close",{start_string},{end_string},"DAILY")'
-            work_sheet = spread_sheet.worksheet(DBConfig.sheet_name)
-            # セルの初期化
-            work_sheet.update_acell("A1", "")
-            # コマンドの設定
-            work_sheet.update_acell("A1", command)
-            # データの更新待ち,5秒経ったら諦める
-            timer = time.time()
-            while work_sheet.acell('A1').value != "Date":
-                timer_end = time.time()
-                if timer_end - timer > 5:
-                    df = pd.Series(name='Error_Series')
-                    work_sheet.update_acell("A1", "")
-                    return df
-                continue
-            df = pd.DataFrame(work_sheet.get_all_values())
-            df.columns = list(df.loc[0, :])
-            df.drop(0, inplace=True)
-            df.reset_index(inplace=True)
-            df.drop('index', axis=1, inplace=True)
-            # dfの型を変更
-            df["Date"] = pd.to_datetime(df["Date"])
-            df["Close"] = pd.to_numeric(df["Close"], downcast='float')
-            df = df.rename(columns={"Close": display_name})
-            s = pd.Series(data=df[display_name])
-            s.index = df["Date"].dt.date
-            df = s
-
-        except Exception as error_of_make_series:
-            print(f"{make_series.__name__}: throws exception {error_of_make_series}")
-            df = pd.Series(name='Error_Series')
-
-        return df
+            with ThreadPoolExecutor(max_workers=self.db_config.fetch_max_workers) as executor:
+                futures = []
+                for name, display_name in names:
+                    start = self.db_config.starttime
+                    if display_name in last_dates:
+                        # 値の修正を拾うため、最新の日付より少し前から取り直す
+                        start = max(
+                            start, last_dates[display_name] - overlap)
+                    if start > self.db_config.now:
+                        progress(display_name, "skipped")
+                        continue
+                    futures.append(executor.submit(
+                        fetch, name=name, display_name=display_name, start=start))
+                for future in futures:
+                    try:
+                        close_series = future.result()
+                    except Exception:
+                        continue
+                    if close_series.empty:
+                        continue
+                    closes.append(close_series)
+        finally:
+            self.price_provider.close()
+        for stat in self.price_provider.get_fetch_stats():
+            print(
+                f"fetch {stat.name}: {stat.seconds:.2f}s polls={stat.polls} succeeded={stat.succeeded}")
+        if len(closes) == 0:
+            return pd.DataFrame()
+        return pd.concat(closes, axis=1)
 
 
 class NameBase(Base):
     """[summary]
+    id: GraphData.instrument_id
     name: Graph のname
     namedisplay: SBIキーワードで表示する名前
     searchkeyword : pandas で検索するのにつかう第一引数
     """
 
     __tablename__ = "name_base"
-    name = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
     searchname = Column(String)
     searchkeyword = Column(String)
 
@@ -220,6 +386,8 @@ class CalculateResult(Base):
     resultpercent:パーセント形式の結果
     resultint:数値形式の結果
     method_name: 計算方式
+    data_version: 計算に使ったGraphDataのバージョン(get_finance.get_data_version)
+    parameters: 計算方式に渡したパラメータのjson
     """
     __tablename__ = "calculate_result"
     date = Column(DateTime, primary_key=True)
@@ -227,6 +395,26 @@ class CalculateResult(Base):
     resultpercent = Column(Float)
     resultint = Column(Integer)
     method_name = Column(Integer, default=0, primary_key=True)
+    data_version = Column(String, index=True)
+    parameters = Column(String, default="{}")
+
+
+class UpdateJob(Base):
+    """[summary] GraphDataの更新ジョブの状態(utils.update_job.UpdateJobStatus)
+    gunicorn のどのworkerがリクエストを受けても同じ状態を返せるように、dbに持つ
+    instruments: {NameBase.name: 進み具合} のjson
+    """
+    __tablename__ = "update_job"
+    job_id = Column(String, primary_key=True)
+    state = Column(String, nullable=False, index=True)
+    started_at = Column(String, index=True)
+    finished_at = Column(String)
+    duration_seconds = Column(Float, default=0.0)
+    instruments = Column(String, default="{}")
+    inserted = Column(Integer, default=0)
+    updated = Column(Integer, default=0)
+    unchanged = Column(Integer, default=0)
+    error = Column(String)
 
 
 def CreateTables():
@@ -237,6 +425,71 @@ def CreateTables():
     return
 
 
+def RecreateCalculateResult():
+    """[summary]
+    CalculateResultテーブルを作り直す。data_version, parameters 列が無い古いdbで使う。
+    CalculateResultは計算結果のキャッシュなので、消しても次の計算で作り直される。
+    """
+    CalculateResult.__table__.drop(engine, checkfirst=True)
+    CalculateResult.__table__.create(engine)
+    return
+
+
+def MigrateGraphData():
+    """[summary]
+    (date, name) が主キーの古いGraphDataを、(instrument_id, day) が主キーの WITHOUT ROWID テーブルに移す。
+    NameBaseに id 列が無ければ、先に作り直して id を振る。全体で1トランザクションで、移した後は古いテーブルを消す。
+    日付の変換に julianday を使うので、sqlite のdbのみ。
+    """
+    inspector = inspect(engine)
+    table_names = inspector.get_table_names()
+
+    def column_names(table_name: str) -> List[str]:
+        return [column["name"] for column in inspector.get_columns(table_name)]
+
+    with engine.begin() as conn:
+        if "name_base" in table_names and "id" not in column_names("name_base"):
+            conn.execute(text("ALTER TABLE name_base RENAME TO name_base_old"))
+            NameBase.__table__.create(conn)
+            conn.execute(text("""
+                INSERT INTO name_base (name, searchname, searchkeyword)
+                SELECT name, searchname, searchkeyword FROM name_base_old ORDER BY rowid"""))
+            conn.execute(text("DROP TABLE name_base_old"))
+        if "graph_data" in table_names and "date" in column_names("graph_data"):
+            conn.execute(text("ALTER TABLE graph_data RENAME TO graph_data_old"))
+            # indexはテーブル名を変えても元の名前のままなので、新しいテーブルと被らないように消す
+            conn.execute(text("DROP INDEX IF EXISTS ix_graph_data_updatetime"))
+            GraphData.__table__.create(conn)
+            # date は "2021-09-15 00:00:00.000000" の文字列なので、日付部分をユリウス日にして 1970-01-01 を引く
+            conn.execute(text("""
+                INSERT INTO graph_data (instrument_id, day, close, updatetime)
+                SELECT name_base.id, CAST(julianday(substr(graph_data_old.date, 1, 10)) - 2440587.5 AS INTEGER),
+                       graph_data_old.close, graph_data_old.updatetime
+                FROM graph_data_old JOIN name_base ON name_base.name = graph_data_old.name"""))
+            conn.execute(text("DROP TABLE graph_data_old"))
+    return
+
+
+def MigrateDatabase():
+    """[summary]
+    起動時に呼ぶ。古いスキーマのテーブルを今のスキーマに移し、無いテーブルを作る。
+    スキーマが今のものなら、テーブルと列を確認するだけで何もしない。
+    gunicorn のworkerなどが同時に呼んでも1つずつ行うように、DBConfig.migration_lock_file のロックを取る。
+    """
+    with FileLock(DBConfig.migration_lock_file):
+        inspector = inspect(engine)
+        table_names = inspector.get_table_names()
+        if engine.dialect.name == "sqlite":
+            MigrateGraphData()
+        if "calculate_result" in table_names:
+            column_names = {column["name"]
+                            for column in inspector.get_columns("calculate_result")}
+            if not {"data_version", "parameters"} <= column_names:
+                RecreateCalculateResult()
+        CreateTables()
+    return
+
+
 def CreateNameBase():
     """[summary]
     NameBaseテーブルにデータを登録する.GoogleFinance を使用
@@ -0,0 +1,55 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+from db.db_config import DBConfig
+
+
+def create_db_engine(db_uri: str = None, db_config: DBConfig = None) -> Engine:
+    """db_uri のengineを作る。
+    sqliteのファイルなら、読み込みが書き込みを待たないように WAL にして、DBConfig.sqlite_* のpragmaを設定し、
+    スレッド間で使い回せるコネクションプールを使う。
+    それ以外(postgresql:// など)は、DBConfig.db_pool_size のコネクションプールを使う。
+
+    Args:
+        db_uri (str, optional): dbのuri. Noneなら DBConfig.db_uri. Defaults to None.
+        db_config (DBConfig, optional): 設定. Noneなら DBConfig(). Defaults to None.
+
+    Returns:
+        Engine: engine
+    """
+    if db_config is None:
+        db_config = DBConfig()
+    if db_uri is None:
+        db_uri = db_config.db_uri
+    url = make_url(db_uri)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(db_uri, echo=False, pool_size=db_config.db_pool_size,
+                             max_overflow=db_config.db_max_overflow, pool_pre_ping=True)
+    if url.database in (None, "", ":memory:"):
+        # メモリ上のdbはコネクションごとに別のdbになるので、sqlalchemy の既定のままにする
+        return create_engine(db_uri, echo=False)
+
+    engine = create_engine(db_uri, echo=False, poolclass=QueuePool,
+                           pool_size=db_config.db_pool_size, max_overflow=db_config.db_max_overflow,
+                           connect_args={"check_same_thread": False,
+                                         "timeout": db_config.sqlite_busy_timeout_seconds})
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(
+                f"PRAGMA journal_mode={db_config.sqlite_journal_mode}")
+            cursor.execute(
+                f"PRAGMA synchronous={db_config.sqlite_synchronous}")
+            # 負の値はKiB単位
+            cursor.execute(
+                f"PRAGMA cache_size=-{int(db_config.sqlite_cache_size_kib)}")
+            cursor.execute(
+                f"PRAGMA mmap_size={int(db_config.sqlite_mmap_size)}")
+        finally:
+            cursor.close()
+
+    return engine
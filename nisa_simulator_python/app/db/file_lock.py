@@ -0,0 +1,75 @@
+import fcntl
+import os
+import threading
+
+
+class FileLock:
+    """fcntl.flock で、同じdbを使う全てのプロセス(gunicorn のworkerなど)の間で1つだけが持てるロック。
+    同じプロセスのスレッドの間でも1つだけが持てるように、threading.Lock も合わせて取る。
+    プロセスが終わるとOSがロックを外すので、途中で落ちても残らない
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): ロックに使うファイル. 無ければ作る
+        """
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """ロックを取る
+
+        Args:
+            blocking (bool, optional): Trueなら取れるまで待つ. Falseなら取れなければすぐにFalseを返す. Defaults to True.
+
+        Returns:
+            bool: ロックを取れたか
+        """
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            lock_file = open(self.path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BaseException:
+                # 取れなかった時は、どのエラーでもファイルを閉じてから返す
+                lock_file.close()
+                raise
+        except BlockingIOError:
+            self._thread_lock.release()
+            return False
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._file = lock_file
+        return True
+
+    def locked(self) -> bool:
+        """このプロセスがロックを持っているかを返す
+
+        Returns:
+            bool: acquire してから release していなければTrue
+        """
+        return self._file is not None
+
+    def release(self) -> None:
+        """ロックを外す。acquire したスレッドと別のスレッドから呼んでもよい
+        """
+        lock_file, self._file = self._file, None
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+            self._thread_lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+INDEX_FILE = "index.json"
+
+
+@dataclass
+class PriceCube:
+    """GraphDataのcloseを 日付 x 銘柄 のfloat64の配列にしてファイルに置いたもの。
+    配列はmemmapで読むので、読み込みはデータの量によらずほぼ一定の時間で、
+    同じファイルを読む複数のプロセスはOSのページキャッシュを共有する。
+    names: 列の NameBase.name(名前順)
+    days: 行の GraphData.day(日付順)
+    closes: shape (日付数, 銘柄数) のclose. 無い日はNaN
+    """
+    names: List[str]
+    days: np.ndarray
+    closes: np.ndarray
+
+    def frame(self, start_day: int = None, end_day: int = None) -> pd.DataFrame:
+        """start_day ~ end_day の行を、コピーせずに get_datas_from_db と同じ形の表にする
+
+        Args:
+            start_day (int, optional): この日以降の行. Defaults to None.
+            end_day (int, optional): この日以前の行. Defaults to None.
+
+        Returns:
+            pd.DataFrame: index: 日付, cols: NameBase.name のclose
+        """
+        start = 0 if start_day is None else int(
+            np.searchsorted(self.days, start_day, side="left"))
+        end = len(self.days) if end_day is None else int(
+            np.searchsorted(self.days, end_day, side="right"))
+        dates = pd.to_datetime(np.asarray(
+            self.days[start:end], dtype="int64"), unit="D")
+        return pd.DataFrame(self.closes[start:end], index=dates, columns=self.names, copy=False)
+
+
+def build_price_cube(connection, directory: str) -> PriceCube:
+    """GraphDataを全て読み込んで PriceCube のファイルを作り直す。
+    新しいファイルを書いてから index.json を置き換えるので、読み込み中のプロセスは古いファイルをそのまま読める
+
+    Args:
+        connection: GraphData, NameBase を読むsessionかconnection
+        directory (str): ファイルを置くディレクトリ
+
+    Returns:
+        PriceCube: 作ったPriceCube
+    """
+    rows = pd.DataFrame(connection.execute(text("""
+        SELECT graph_data.day, name_base.name, graph_data.close
+        FROM graph_data JOIN name_base ON name_base.id = graph_data.instrument_id
+    """)).fetchall(), columns=["day", "name", "close"])
+    days, row_index = np.unique(
+        rows["day"].to_numpy(dtype="int64"), return_inverse=True)
+    names, col_index = np.unique(
+        rows["name"].to_numpy(dtype=str), return_inverse=True)
+    closes = np.full((len(days), len(names)), np.nan, dtype="float64")
+    closes[row_index, col_index] = rows["close"].astype("float64").to_numpy()
+
+    os.makedirs(directory, exist_ok=True)
+    token = uuid.uuid4().hex
+    days_file = f"days-{token}.npy"
+    closes_file = f"closes-{token}.npy"
+    np.save(os.path.join(directory, days_file), days)
+    np.save(os.path.join(directory, closes_file), closes)
+    index_path = os.path.join(directory, INDEX_FILE)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"names": names.tolist(), "days_file": days_file,
+                   "closes_file": closes_file}, f, ensure_ascii=False)
+    os.replace(index_path + ".tmp", index_path)
+    # 古いファイルを消す. memmapで開いているプロセスは、閉じるまで読み続けられる
+    for file_name in os.listdir(directory):
+        if file_name.endswith(".npy") and file_name not in (days_file, closes_file):
+            os.remove(os.path.join(directory, file_name))
+    return PriceCube(names=names.tolist(), days=days, closes=closes)
+
+
+def remove_price_cube(directory: str) -> None:
+    """index.json を消して、PriceCube を使われないようにする。GraphDataに書き込んだ時に呼ぶ
+
+    Args:
+        directory (str): ファイルを置くディレクトリ
+    """
+    try:
+        os.remove(os.path.join(directory, INDEX_FILE))
+    except FileNotFoundError:
+        pass
+
+
+class PriceCubeReader:
+    """directory の PriceCube をmemmapで開いて覚えておくクラス。
+    index.json が置き換わったら開き直し、消えていたら None を返す。
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        Args:
+            directory (str): ファイルを置くディレクトリ
+        """
+        self.directory = directory
+        self._cube: PriceCube = None
+        self._stat = None
+        self._lock = threading.Lock()
+
+    def get(self) -> PriceCube:
+        """PriceCube を返す
+
+        Returns:
+            PriceCube: memmapで開いたPriceCube. ファイルが無ければNone
+        """
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            stat = os.stat(index_path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if self._stat == key:
+                return self._cube
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+                cube = PriceCube(names=index["names"],
+                                 days=np.load(os.path.join(
+                                     self.directory, index["days_file"])),
+                                 closes=np.load(os.path.join(self.directory, index["closes_file"]), mmap_mode="r"))
+            except (FileNotFoundError, ValueError) as error_of_open:
+                # 作り直しの途中で古いファイルが消えた時など
+                print(f"In {self.get.__name__} error occured :{error_of_open}")
+                return None
+            self._cube = cube
+            self._stat = key
+            return cube
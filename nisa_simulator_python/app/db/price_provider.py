@@ -0,0 +1,367 @@
+import datetime
+import os
+import queue
+import random
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+import pandas as pd
+
+from db.db_config import DBConfig
+
+if TYPE_CHECKING:
+    import gspread
+
+
+class RateLimiter:
+    """APIを呼ぶ間隔を 1 / requests_per_second 秒以上あける。複数のスレッドから呼ばれてもよい
+    """
+
+    def __init__(self, requests_per_second: float) -> None:
+        """
+        Args:
+            requests_per_second (float): 1秒間に呼んでよい回数. 0以下なら制限しない
+        """
+        self.interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self) -> None:
+        """前回の呼び出しから interval 秒経つまで待つ
+        """
+        if self.interval == 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            call_time = max(now, self._next_time)
+            self._next_time = call_time + self.interval
+        time.sleep(call_time - now)
+
+
+@dataclass
+class FetchStat:
+    """1銘柄分の取得の記録
+    name: 取得した銘柄(NameBase.name)
+    seconds: 取得にかかった秒数
+    polls: 結果が出るのを待つ間にセルを確認した回数
+    succeeded: 取得できたかどうか
+    """
+    name: str
+    seconds: float
+    polls: int = 0
+    succeeded: bool = True
+
+
+class IPriceProvider(metaclass=ABCMeta):
+    """GraphDataに登録するcloseのデータを取得するクラスのインターフェイス。
+    _GraphData は1回の更新の最初に open, 最後に close を呼ぶ。
+
+    Args:
+        metaclass (_type_, optional): _description_. Defaults to ABCMeta.
+    """
+    @abstractmethod
+    def fetch_close(self, name: str, display_name: str, start: datetime.datetime, end: datetime.datetime) -> pd.Series:
+        """start から end までのcloseを取得する
+
+        Args:
+            name (str): データの検索に使う名前(NameBase.searchname)
+            display_name (str): Series のname(NameBase.name)
+            start (datetime.datetime): 取得する最初の日
+            end (datetime.datetime): 取得する最後の日
+
+        Returns:
+            pd.Series: indexは株価の日付(datetime.date)、nameはdisplay_name. 取得できなければ空のSeries
+        """
+        pass
+
+    def open(self) -> None:
+        """更新の最初に呼ばれる。接続などの準備が必要なら実装する
+        """
+        pass
+
+    def close(self) -> None:
+        """更新の最後に呼ばれる。openで準備したものを片付ける
+        """
+        pass
+
+    def get_fetch_stats(self) -> List[FetchStat]:
+        """直近の open から記録した、銘柄ごとの取得の記録を返す
+
+        Returns:
+            List[FetchStat]: 取得の記録. 記録しないproviderなら空のリスト
+        """
+        return []
+
+
+class SpreadSheetFetchSession:
+    """1回の更新の間、認証済みのclient, 開いたspread sheet, 作業用シートを使い回すためのクラス
+    """
+
+    def __init__(self, db_config: DBConfig, rate_limiter: RateLimiter) -> None:
+        """認証してspread sheetを開く
+
+        Args:
+            db_config (DBConfig): 認証情報やspread sheetの名前を持つ設定
+            rate_limiter (RateLimiter): APIを呼ぶ間隔の制限
+        """
+        # gspread は読み込みが遅いので、spread sheet を使う時にimportする
+        import gspread
+
+        self.db_config = db_config
+        self.rate_limiter = rate_limiter
+        self.client = gspread.authorize(db_config.get_credentials())
+        self.rate_limiter.wait()
+        self.spread_sheet = self.client.open(db_config.file_name)
+        self._work_sheets: Dict[str, "gspread.Worksheet"] = dict()
+        self._lock = threading.Lock()
+
+    def get_work_sheet(self, sheet_name: str) -> "gspread.Worksheet":
+        """作業用のシートを返す。無ければ作る。一度取得したシートは使い回す
+
+        Args:
+            sheet_name (str): シート名
+
+        Returns:
+            gspread.Worksheet: 作業用のシート
+        """
+        from gspread import WorksheetNotFound
+
+        with self._lock:
+            if sheet_name in self._work_sheets:
+                return self._work_sheets[sheet_name]
+        try:
+            self.rate_limiter.wait()
+            work_sheet = self.spread_sheet.worksheet(sheet_name)
+        except WorksheetNotFound:
+            self.rate_limiter.wait()
+            # 1年で約250行なので、余裕を持たせた行数にする
+            work_sheet = self.spread_sheet.add_worksheet(
+                title=sheet_name, rows=400 * self.db_config.history_years, cols=2)
+        with self._lock:
+            self._work_sheets[sheet_name] = work_sheet
+        return work_sheet
+
+    def wait_for_result(self, work_sheet: "gspread.Worksheet") -> Tuple[bool, int]:
+        """A1セルに結果の見出し("Date")が出るまで、間隔を指数的に伸ばしながら確認する。
+        間隔には揺らぎを入れ、db_config.spread_sheet_poll_deadline 秒経ったら諦める
+
+        Args:
+            work_sheet (gspread.Worksheet): 関数を書き込んだシート
+
+        Returns:
+            Tuple[bool, int]: 結果が出たかどうか, 確認した回数
+        """
+        deadline = time.monotonic() + self.db_config.spread_sheet_poll_deadline
+        interval = self.db_config.spread_sheet_poll_initial_interval
+        polls = 0
+        while True:
+            self.rate_limiter.wait()
+            polls += 1
+            if work_sheet.acell('A1').value == "Date":
+                return True, polls
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, polls
+            time.sleep(min(remaining, interval * random.uniform(0.5, 1.0)))
+            interval = min(interval * 2,
+                           self.db_config.spread_sheet_poll_max_interval)
+
+
+class SpreadSheetPriceProvider(IPriceProvider):
+    """spread sheet のGoogleFinance関数でcloseを取得するクラス
+    A1セルに書いた関数の結果をシート全体から読むので、同時に取得する銘柄ごとに別のシートを使う。
+    シートは db_config.fetch_max_workers 枚用意し、取得のたびに空いているものを借りる。
+    認証とspread sheetを開くのは、open から close までの間に1回だけ行う。
+    """
+
+    def __init__(self, db_config: DBConfig) -> None:
+        """
+        Args:
+            db_config (DBConfig): 認証情報やspread sheetの名前を持つ設定
+        """
+        self.db_config = db_config
+        self.rate_limiter = RateLimiter(
+            requests_per_second=db_config.spread_sheet_requests_per_second)
+        self._work_sheet_names = queue.Queue()
+        for i in range(max(1, db_config.fetch_max_workers)):
+            self._work_sheet_names.put(
+                db_config.sheet_name if i == 0 else f"{db_config.sheet_name}_{i}")
+        self._session: SpreadSheetFetchSession = None
+        self._session_lock = threading.Lock()
+        self._fetch_stats: List[FetchStat] = []
+
+    def open(self) -> None:
+        """取得の記録を空にする。認証は最初の fetch_close で行う
+        """
+        self._fetch_stats = []
+
+    def close(self) -> None:
+        """認証済みのclientを捨てる。次の更新では認証し直す
+        """
+        self._session = None
+
+    def get_fetch_stats(self) -> List[FetchStat]:
+        """直近の open から記録した、銘柄ごとの取得の記録を返す
+
+        Returns:
+            List[FetchStat]: 取得の記録
+        """
+        return list(self._fetch_stats)
+
+    def _get_session(self) -> SpreadSheetFetchSession:
+        """使い回しているsessionを返す。まだ無ければ作る
+
+        Returns:
+            SpreadSheetFetchSession: session
+        """
+        with self._session_lock:
+            if self._session is None:
+                self._session = SpreadSheetFetchSession(
+                    db_config=self.db_config, rate_limiter=self.rate_limiter)
+            return self._session
+
+    def fetch_close(self, name: str, display_name: str, start: datetime.datetime, end: datetime.datetime) -> pd.Series:
+        """[summary] spread sheet で、インデックスのデータを取得し、pd.series を返す。start から end までのデータを取得する。
+
+        Args:
+            name(str) : [description] GoogleFinanceで検索に使う名前
+            display_name(str): [description] Series のname
+            start(datetime.datetime): [description] 取得する最初の日
+            end(datetime.datetime): [description] 取得する最後の日
+
+        Returns:
+            [type]pandas.Series: [description] index,name付きのpandas.Series. indexは株価の日付、nameはdisplay_name
+        """
+
+        # データ作成
+        timer = time.perf_counter()
+        polls = 0
+        succeeded = False
+        sheet_name = self._work_sheet_names.get()
+        try:
+            fetch_session = self._get_session()
+            start_year = start.year
+            start_month = start.month
+            start_day = start.day
+            if start_day < 1:
+                start_day = 1
+            start_string = f"DATE({start_year},{start_month},{start_day})"
+            end_year = end.year
+            end_month = end.month
+            end_day = end.day
+            end_string = f"DATE({end_year},{end_month},{end_day})"
+            # spread sheetで株価データを取得するコマンド
+            command = f'=GoogleFinance("{name}","close",{start_string},{end_string},"DAILY")'
+            work_sheet = fetch_session.get_work_sheet(sheet_name)
+            # セルの初期化
+            self.rate_limiter.wait()
+            work_sheet.update_acell("A1", "")
+            # コマンドの設定
+            self.rate_limiter.wait()
+            work_sheet.update_acell("A1", command)
+            # データの更新待ち
+            is_ready, polls = fetch_session.wait_for_result(work_sheet)
+            if not is_ready:
+                df = pd.Series(name='Error_Series')
+                self.rate_limiter.wait()
+                work_sheet.update_acell("A1", "")
+                return df
+            self.rate_limiter.wait()
+            df = pd.DataFrame(work_sheet.get_all_values())
+            df.columns = list(df.loc[0, :])
+            df.drop(0, inplace=True)
+            df.reset_index(inplace=True)
+            df.drop('index', axis=1, inplace=True)
+            # dfの型を変更
+            df["Date"] = pd.to_datetime(df["Date"])
+            df["Close"] = pd.to_numeric(df["Close"], downcast='float')
+            df = df.rename(columns={"Close": display_name})
+            s = pd.Series(data=df[display_name])
+            s.index = df["Date"].dt.date
+            df = s
+            succeeded = True
+
+        except Exception as error_of_make_series:
+            print(f"{self.fetch_close.__name__}: throws exception {error_of_make_series}")
+            df = pd.Series(name='Error_Series')
+        finally:
+            self._work_sheet_names.put(sheet_name)
+            self._fetch_stats.append(FetchStat(
+                name=display_name, seconds=time.perf_counter() - timer, polls=polls, succeeded=succeeded))
+
+        return df
+
+
+class FilePriceProvider(IPriceProvider):
+    """ローカルのcsv, parquet ファイルからcloseを読み込むクラス。
+    ファイルは NameBase.searchname ごとに1つ({directory}/{searchname}.csv など)で、
+    spread sheet と同じ Date, Close の列を持つ。
+    """
+
+    def __init__(self, directory: str, file_format: str = "csv") -> None:
+        """
+        Args:
+            directory (str): ファイルを置いているディレクトリ
+            file_format (str, optional): "csv" か "parquet". Defaults to "csv".
+
+        Raises:
+            Exception: 対応していないfile_formatが指定された時
+        """
+        if file_format not in ("csv", "parquet"):
+            raise Exception(
+                f"In {FilePriceProvider.__name__}. 対応していないファイル形式が指定された. file_format= {file_format}")
+        self.directory = directory
+        self.file_format = file_format
+
+    def fetch_close(self, name: str, display_name: str, start: datetime.datetime, end: datetime.datetime) -> pd.Series:
+        """{directory}/{name}.{file_format} から start ~ end のcloseを読み込む
+
+        Args:
+            name (str): ファイル名(NameBase.searchname)
+            display_name (str): Series のname
+            start (datetime.datetime): 読み込む最初の日
+            end (datetime.datetime): 読み込む最後の日
+
+        Returns:
+            pd.Series: indexは株価の日付、nameはdisplay_name. ファイルが無ければ空のSeries
+        """
+        path = os.path.join(self.directory, f"{name}.{self.file_format}")
+        if not os.path.exists(path):
+            print(f"{self.fetch_close.__name__}: {path} がありません")
+            return pd.Series(name=display_name, dtype="float64")
+        if self.file_format == "csv":
+            df = pd.read_csv(path, usecols=["Date", "Close"])
+        else:
+            # parquet の読み込みには pyarrow を使う(requirements.txt)
+            df = pd.read_parquet(path, columns=["Date", "Close"])
+        dates = pd.to_datetime(df["Date"])
+        in_range = (dates >= pd.Timestamp(start).normalize()) & (
+            dates <= pd.Timestamp(end))
+        s = pd.Series(data=pd.to_numeric(df.loc[in_range, "Close"]).to_numpy(dtype="float64"),
+                      index=dates[in_range].dt.date, name=display_name)
+        return s
+
+
+def get_price_provider(db_config: DBConfig) -> IPriceProvider:
+    """db_config.price_provider で指定したcloseの取得方法を返す
+
+    Args:
+        db_config (DBConfig): 設定
+
+    Raises:
+        Exception: 変な名前が指定されたときに排出される
+
+    Returns:
+        IPriceProvider: closeを取得するクラス
+    """
+    if db_config.price_provider == "spread_sheet":
+        return SpreadSheetPriceProvider(db_config=db_config)
+    elif db_config.price_provider == "file":
+        return FilePriceProvider(directory=db_config.price_file_directory,
+                                 file_format=db_config.price_file_format)
+    else:
+        raise Exception(
+            f"リストに無いデータの取得方法が指定された. price_provider= {db_config.price_provider}")
@@ -0,0 +1,46 @@
+"""本番用に gunicorn で起動する時の設定
+
+masterで main:app と重いデータ(utils.warmup.preload)を読み込んでから DBConfig.server_workers 個のworkerをforkし、
+各workerは uvicorn のworkerとしてリクエストを受ける。読み込んだものはworker間でcopy-on-writeで共有する。
+
+appディレクトリで実行する:
+    gunicorn -c gunicorn_conf.py main:app
+"""
+import fcntl
+import os
+
+from db.db_config import DBConfig
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = DBConfig.server_workers
+worker_class = "uvicorn.workers.UvicornWorker"
+# workerをforkする前にmasterで main:app をimportする
+preload_app = True
+
+# post_fork で取ったロックのファイル. workerが終わるまで開いておく
+scheduler_lock = None
+
+
+def on_starting(server) -> None:
+    """masterで、workerをforkする前に平均と分散などを読み込んでおく
+    """
+    from utils.warmup import preload
+    preload()
+
+
+def post_fork(server, worker) -> None:
+    """forkしたworkerで、masterから引き継いだものを整える。
+    毎日の更新はロックを取れた1つのworkerだけが行い、そのworkerが終わったら次に起動したworkerが引き継ぐ
+    """
+    global scheduler_lock
+    from utils.warmup import after_fork
+    after_fork(workers=server.cfg.workers)
+    if not DBConfig.scheduled_update_enabled:
+        return
+    scheduler_lock = open(DBConfig.scheduler_lock_file, "w")
+    try:
+        fcntl.flock(scheduler_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        scheduler_lock.close()
+        scheduler_lock = None
+        DBConfig.scheduled_update_enabled = False
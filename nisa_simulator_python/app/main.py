@@ -1,57 +1,143 @@
-from datetime import datetime
+from datetime import date
 import json
 from http import HTTPStatus
 from typing import List
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Query, Request
+from fastapi.responses import JSONResponse, Response
 
 
+from db import Model
 from db.db_config import DBConfig
-from db.Model import _GraphData
-from utils.calculate_methods import ICalculateMethod, convert_method_names, get_calculate_methods, get_method, get_method_names
+from utils.calculate_config import CalculateConfig
+from utils.calculate_methods import convert_method_names, get_method_names
 from utils.chart import create_header
-from utils.get_finance import calculate_portfolio, make_chart_data, make_graph, get_datas_from_db
+from utils.chart_format import negotiate_media_type
+from utils.executors import PoolSaturatedError, run_in_process_pool, run_in_thread_pool, shutdown_pools
+from utils.frontier import calculate_frontier
+from utils.get_finance import MONTHLY_PURCHASE_YEN, BatchPortfolios, backtest_methods, get_chart_payload, load_or_calculate_portfolio, load_or_calculate_portfolios, get_statistics, project_portfolio, simulate_portfolio
+from utils.portfolio_problem import parse_weight_bounds
+from utils.update_job import update_job_manager, update_scheduler
+from utils.warmup import warmup
 app = FastAPI()
 
 
+@app.exception_handler(PoolSaturatedError)
+async def pool_saturated_handler(request: Request, error: PoolSaturatedError) -> JSONResponse:
+    """スレッドプールかプロセスプールが埋まっている時は、503を返す
+    """
+    return JSONResponse(status_code=HTTPStatus.SERVICE_UNAVAILABLE, content={"message": str(error)})
+
+
+@app.on_event("startup")
+async def migrate_database() -> None:
+    """古いスキーマのdbを今のスキーマに移し、無いテーブルを作る。他の起動時の処理より先に行う
+    """
+    Model.MigrateDatabase()
+
+
+@app.on_event("startup")
+async def start_update_scheduler() -> None:
+    """DBConfig.scheduled_update_enabled なら、毎日決まった時刻にデータを更新する
+    """
+    if DBConfig.scheduled_update_enabled:
+        update_scheduler.start()
+
+
+@app.on_event("startup")
+async def start_warmup() -> None:
+    """DBConfig.warmup_on_startup なら、重い部品をバックグラウンドで準備する
+    """
+    if DBConfig.warmup_on_startup:
+        warmup.start()
+
+
+@app.on_event("shutdown")
+async def stop_pools() -> None:
+    """プロセスプールとスレッドプールを閉じる
+    """
+    shutdown_pools()
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/ready")
+async def get_readiness() -> JSONResponse:
+    """重い部品(dbのコネクション、最適化のライブラリ、平均と分散)の準備ができているかを返す。
+    全て準備できていればOk, まだならServiceUnavailable
+
+    Returns:
+        JSONResponse: {"ready": false, "components": {"database": "ready", "optimizer": "warming", "statistics": "pending"},
+                       "seconds": {"database": 0.01}, "errors": {}}
+                      のようなjson
+    """
+    readiness = warmup.get_readiness()
+    status_code = HTTPStatus.OK if readiness.ready else HTTPStatus.SERVICE_UNAVAILABLE
+    return JSONResponse(status_code=status_code, content=readiness.to_dict())
+
+
 @app.get("/graph/")
-async def get_graph(start_time: str = None, end_time: str = None):
+async def get_graph(start_time: date = None, end_time: date = None, max_points: int = Query(None, ge=2),
+                    accept: str = Header(None), if_none_match: str = Header(None)) -> Response:
     """ vue-chartjs でグラフを描くためのjsonを返す
         {Labels:["2021-09-15", ...], datasets:[
             {"label": "nikkei", "data":[123.124, Nan, 100.11, ...]},
             ...
         ]}
+        start_time ~ end_time ("2021-09-15" など)の期間だけを返し、
+        max_points を指定したら1銘柄あたりの点がそれ以下になるように間引く。
+        Accept に application/vnd.nisa.chart+json(列ごとのjson) か
+        application/vnd.nisa.chart(列ごとのバイナリ) があれば、その形式で返す(utils.chart_format)。
+        レスポンスはデータのバージョンごとに作り置きしたものを返す。
+        If-None-Match がETagと同じなら、中身を返さずに NotModified を返す。
     """
-    if start_time is None or end_time is None:
-        db_config = DBConfig()
-        db_config.cls_update_now_start_time(now=datetime.now())
-        chart = make_chart_data()
-        return chart.to_json()
-    else:
-        # todo: make_graphで、グラフ描画の範囲を指定できるようにする
-        chart = make_chart_data()
-        return chart.to_json()
+    payload = await run_in_thread_pool(get_chart_payload, start_time=start_time, end_time=end_time,
+                                       max_points=max_points, media_type=negotiate_media_type(accept))
+    headers = {"ETag": payload.etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if if_none_match is not None and payload.etag in [etag.strip() for etag in if_none_match.split(",")]:
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    return Response(content=payload.body, media_type=payload.media_type, headers=headers)
 
 
 @app.post("/update")
-async def update_date() -> HTTPStatus:
-    """データのアップデートをする。成功ならOk, 失敗ならInternalServerError
+async def update_date() -> json or JSONResponse:
+    """データのアップデートをバックグラウンドで開始して、すぐにジョブの状態を返す。
+    既にどこかのworkerでアップデート中なら、新しく開始せずに実行中のジョブの状態を返す
 
     Returns:
-        HTTPStatus: hhtpステータスコード
+        json: {"job_id": "...", "state": "running", "started_at": "2021-09-15T07:00:00", "finished_at": null,
+               "duration_seconds": 0.0, "instruments": {}, "inserted": 0, "updated": 0, "unchanged": 0, "error": null}
+              のようなjson. ジョブ以外の更新(_GraphData.create など)の実行中はConflict
     """
-    db_config = DBConfig()
-    graph = _GraphData(db_config=db_config)
     try:
-        graph.update()
-        return HTTPStatus.OK
-    except:
-        return HTTPStatus.INTERNAL_SERVER_ERROR
+        job = await run_in_thread_pool(update_job_manager.start)
+    except PoolSaturatedError:
+        raise
+    except Exception as e:
+        print(e)
+        return JSONResponse(status_code=HTTPStatus.CONFLICT, content={"message": str(e)})
+    return job.to_json(ensure_ascii=False)
+
+
+@app.get("/update/{job_id}")
+async def get_update_status(job_id: str) -> json or JSONResponse:
+    """アップデートのジョブの状態を返す
+
+    Args:
+        job_id (str): POST /update で返したジョブのid
+
+    Returns:
+        json or JSONResponse: POST /update と同じ形のjson.
+                              instruments は {"sp500": "fetched", "topix": "fetching", ...} のような銘柄ごとの進み具合.
+                              知らないidならNotFound
+    """
+    job = await run_in_thread_pool(update_job_manager.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=HTTPStatus.NOT_FOUND, content={"message": f"{job_id} はジョブのリストに無い"})
+    return job.to_json(ensure_ascii=False)
 
 
 @app.get("/methods")
@@ -66,22 +152,222 @@ async def calculate_methods() -> List[str]:
 
 
 @app.get("/portfolio/{name}")
-async def get_portfolio(name: str) -> json or HTTPStatus:
+async def get_portfolio(name: str, target_return: float = None, risk_free_rate: float = None,
+                        min_weight: List[str] = Query(None), max_weight: List[str] = Query(None)) -> json or HTTPStatus:
     """ポートフォリオを計算して、jsonを返す
 
     Args:
         method_name (str): 計算方法
+        target_return (float, optional): 分散最小化(リターン制約あり)のリターン制約. Defaults to None.
+        risk_free_rate (float, optional): シャープ・レシオ最大化の無リスク金利. Defaults to None.
+        min_weight (List[str], optional): ["sp500:0.1"] のような銘柄ごとの購入割合の下限. Defaults to None.
+        max_weight (List[str], optional): ["topix:0.3"] のような銘柄ごとの購入割合の上限. Defaults to None.
 
     Returns:
-        str or HTTPStatus: 計算に成功したらjson, 失敗か、変な計算方法名が来たらBadRequest
+        str or HTTPStatus: 計算に成功したらjson, 失敗か、変な計算方法名か、満たせない購入割合の下限、上限が来たらBadRequest
     """
     try:
         method_name = convert_method_names(name=name)
-        method: ICalculateMethod = get_method(method_name=method_name)
-        data = get_datas_from_db()
-        buy_list = calculate_portfolio(method(data=data))
+        buy_list = await run_in_thread_pool(load_or_calculate_portfolio, method_name=method_name,
+                                            parameters={"target_return": target_return,
+                                                        "risk_free_rate": risk_free_rate,
+                                                        "min_weights": parse_weight_bounds(min_weight),
+                                                        "max_weights": parse_weight_bounds(max_weight)})
         buy_list_json = buy_list.to_json(ensure_ascii=False)
         return buy_list_json
+    except PoolSaturatedError:
+        raise
+    except Exception as e:
+        print(e)
+        return HTTPStatus.BAD_REQUEST
+
+
+@app.get("/portfolios")
+async def get_portfolios(names: List[str] = Query(None), target_return: float = None, risk_free_rate: float = None,
+                         min_weight: List[str] = Query(None), max_weight: List[str] = Query(None)) -> json or HTTPStatus:
+    """複数の計算方法のポートフォリオをまとめて計算して、jsonを返す。
+    データの読み込みと平均、分散の計算は1回だけ行い、計算方法ごとの最適化は並列に行う。
+
+    Args:
+        names (List[str], optional): 計算方法(/methods の名前). 指定しなければ全部. Defaults to None.
+        target_return (float, optional): 分散最小化(リターン制約あり)のリターン制約. Defaults to None.
+        risk_free_rate (float, optional): シャープ・レシオ最大化の無リスク金利. Defaults to None.
+        min_weight (List[str], optional): ["sp500:0.1"] のような銘柄ごとの購入割合の下限. Defaults to None.
+        max_weight (List[str], optional): ["topix:0.3"] のような銘柄ごとの購入割合の上限. Defaults to None.
+
+    Returns:
+        json or HTTPStatus: {"portfolios": {"分散最小化": {"portfolio": [...]}, ...}} のようなjson.
+                            計算に失敗したか、変な計算方法名が来たらBadRequest
+    """
+    try:
+        if names is None:
+            names = get_method_names()
+        method_names = {convert_method_names(name=name): name for name in names}
+        portfolios = await run_in_thread_pool(load_or_calculate_portfolios,
+                                              method_names=list(method_names.keys()),
+                                              parameters={"target_return": target_return,
+                                                          "risk_free_rate": risk_free_rate,
+                                                          "min_weights": parse_weight_bounds(min_weight),
+                                                          "max_weights": parse_weight_bounds(max_weight)})
+        batch = BatchPortfolios(portfolios={method_names[method_name]: portfolio
+                                            for method_name, portfolio in portfolios.items()})
+        return batch.to_json(ensure_ascii=False)
+    except PoolSaturatedError:
+        raise
+    except Exception as e:
+        print(e)
+        return HTTPStatus.BAD_REQUEST
+
+
+@app.get("/backtest")
+async def get_backtest(names: List[str] = Query(None), lookback_days: int = Query(None, ge=20),
+                       rebalance_days: int = Query(None, ge=1), target_return: float = None,
+                       risk_free_rate: float = None) -> json or HTTPStatus:
+    """GraphDataの全期間で、lookback_days 日の平均と分散から計算したポートフォリオに
+    rebalance_days 日ごとに買い直した時の評価額、下落率、turnover を計算方法ごとに計算して、jsonを返す
+
+    Args:
+        names (List[str], optional): 計算方法(/methods の名前). 指定しなければ全部. Defaults to None.
+        lookback_days (int, optional): 平均と分散の計算に使う営業日数.
+            Defaults to CalculateConfig.backtest_lookback_days. データが足りなければ1回以上買い直せる長さまで短くする.
+        rebalance_days (int, optional): 買い直す間隔(営業日数). Defaults to CalculateConfig.backtest_rebalance_days.
+        target_return (float, optional): 分散最小化(リターン制約あり)のリターン制約. Defaults to None.
+        risk_free_rate (float, optional): シャープ・レシオ最大化の無リスク金利. Defaults to None.
+
+    Returns:
+        json or HTTPStatus: {"lookback_days": 756, "rebalance_days": 21, "names": [...], "dates": [...],
+                             "methods": {"分散最小化": {"equity": [...], "drawdown": [...], "turnover": [...],
+                                                    "cagr": 0.05, "max_drawdown": -0.2, ...}, ...}}
+                            のようなjson. データが足りないか、変な計算方法名が来たらBadRequest
+    """
+    try:
+        if names is None:
+            names = get_method_names()
+        method_names = {convert_method_names(name=name): name for name in names}
+        result = await run_in_thread_pool(backtest_methods, method_names=list(method_names.keys()),
+                                          lookback_days=lookback_days, rebalance_days=rebalance_days,
+                                          parameters={"target_return": target_return,
+                                                      "risk_free_rate": risk_free_rate})
+        result.methods = {method_names[method_name]: method_backtest
+                          for method_name, method_backtest in result.methods.items()}
+        return result.to_json(ensure_ascii=False)
+    except PoolSaturatedError:
+        raise
+    except Exception as e:
+        print(e)
+        return HTTPStatus.BAD_REQUEST
+
+
+@app.get("/frontier")
+async def get_frontier(points: int = Query(50, ge=2, le=CalculateConfig.frontier_max_points)) -> json or HTTPStatus:
+    """効率的フロンティアを計算して、jsonを返す
+
+    Args:
+        points (int, optional): 分散最小から最大リターンまでの間で計算する点の数.
+            2 以上 CalculateConfig.frontier_max_points 以下. Defaults to 50.
+
+    Returns:
+        json or HTTPStatus: {"points": [{"target_return": 0.05, "expected_return": 0.05, "volatility": 0.12,
+                                         "weights": {"sp500": 0.2, ...}}, ...]}
+                            のようなjson. 計算に失敗したらBadRequest
+    """
+    try:
+        statistics = await run_in_thread_pool(get_statistics)
+        frontier = await run_in_process_pool(calculate_frontier, statistics=statistics, points=points)
+        return frontier.to_json(ensure_ascii=False)
+    except PoolSaturatedError:
+        raise
+    except Exception as e:
+        print(e)
+        return HTTPStatus.BAD_REQUEST
+
+
+@app.get("/simulation/{name}")
+async def get_simulation(name: str, monthly_yen: int = Query(MONTHLY_PURCHASE_YEN, ge=1),
+                         years: int = Query(20, ge=1, le=CalculateConfig.simulation_max_years),
+                         paths: int = Query(None, ge=1, le=CalculateConfig.simulation_max_paths), seed: int = 0,
+                         target_return: float = None, risk_free_rate: float = None) -> json or HTTPStatus:
+    """name の計算方法のポートフォリオに毎月 monthly_yen 円を years 年積み立てた時の残高を、
+    paths 本の経路のモンテカルロ法で計算して、jsonを返す。同じ seed なら同じ結果になる
+
+    Args:
+        name (str): 計算方法(分散最小化 など)
+        monthly_yen (int, optional): 毎月の購入額(円). Defaults to MONTHLY_PURCHASE_YEN.
+        years (int, optional): 積み立てる年数. Defaults to 20.
+        paths (int, optional): 経路の数. Defaults to CalculateConfig.simulation_paths.
+        seed (int, optional): 乱数のseed. Defaults to 0.
+        target_return (float, optional): 分散最小化(リターン制約あり)の目標リターン. Defaults to None.
+        risk_free_rate (float, optional): シャープ・レシオ最大化の安全資産の利子率. Defaults to None.
+
+    Returns:
+        json or HTTPStatus: {"paths": 100000, "years": 20, ..., "year": [1, 2, ...], "contributed": [399996.0, ...],
+                             "bands": {"p5": [...], "p50": [...], ...}, "final_balance": {"p5": ..., "mean": ...}}
+                            のようなjson. 変な計算方法名が来たり、計算に失敗したらBadRequest
+    """
+    try:
+        method_name = convert_method_names(name=name)
+        result = await run_in_thread_pool(simulate_portfolio, method_name=method_name,
+                                          parameters={"target_return": target_return,
+                                                      "risk_free_rate": risk_free_rate},
+                                          monthly_yen=monthly_yen, years=years, paths=paths, seed=seed)
+        return result.to_json(ensure_ascii=False)
+    except PoolSaturatedError:
+        raise
+    except Exception as e:
+        print(e)
+        return HTTPStatus.BAD_REQUEST
+
+
+@app.get("/projection/{name}")
+async def get_projection(name: str, monthly_yen: List[int] = Query(None), years: List[int] = Query(None),
+                         returns: List[float] = Query(None), withdrawal_start: List[int] = Query(None),
+                         target_return: float = None, risk_free_rate: float = None) -> json or HTTPStatus:
+    """name の計算方法のポートフォリオを積み立てた時の、NISAと課税口座の税引き後の残高を
+    購入額 x 年数 x リターン x 取り崩し開始 の全ての組み合わせで計算して、jsonを返す。
+    ?monthly_yen=10000&monthly_yen=33333&years=20 のように、各軸は複数指定できる。
+    指定が無い軸は CalculateConfig.projection_* を使い、リターンはポートフォリオの期待リターンと標準偏差から作る
+
+    Args:
+        name (str): 計算方法(分散最小化 など)
+        monthly_yen (List[int], optional): 毎月の購入額(円). Defaults to None.
+        years (List[int], optional): 積み立てる年数. Defaults to None.
+        returns (List[float], optional): 年率のリターン. Defaults to None.
+        withdrawal_start (List[int], optional): 積み立て始めてから全て売るまでの年数. Defaults to None.
+        target_return (float, optional): 分散最小化(リターン制約あり)の目標リターン. Defaults to None.
+        risk_free_rate (float, optional): シャープ・レシオ最大化の安全資産の利子率. Defaults to None.
+
+    Returns:
+        json or HTTPStatus: {"expected_return": 0.05, "volatility": 0.12, "monthly_yen": [...], "years": [...],
+                             "returns": [...], "withdrawal_start": [...], "nisa_balance": [[[[...]]]], ...}
+                            のようなjson. 4次元の値は [monthly_yen][years][returns][withdrawal_start] の順.
+                            各軸の値が CalculateConfig.projection_max_values 個より多いか、
+                            年数, 取り崩し開始が CalculateConfig.projection_max_years より大きければUnprocessableEntity.
+                            変な計算方法名や値が来たり、計算に失敗したらBadRequest
+    """
+    axes = {"monthly_yen": monthly_yen, "years": years,
+            "returns": returns, "withdrawal_start": withdrawal_start}
+    too_many_values = [axis for axis, values in axes.items()
+                       if values is not None and len(values) > CalculateConfig.projection_max_values]
+    if too_many_values:
+        return JSONResponse(status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                            content={"message": f"{', '.join(too_many_values)} は{CalculateConfig.projection_max_values}個まで"})
+    if any(value > CalculateConfig.projection_max_years for value in (years or []) + (withdrawal_start or [])):
+        return JSONResponse(status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                            content={"message": f"years, withdrawal_start は{CalculateConfig.projection_max_years}年まで"})
+    try:
+        method_name = convert_method_names(name=name)
+        if any(value <= 0 for value in (monthly_yen or []) + (years or []) + (withdrawal_start or [])) \
+                or any(value <= -1 for value in returns or []):
+            raise Exception(
+                f"In {get_projection.__name__}. 購入額, 年数, 取り崩し開始は正, リターンは-1より大きい値にする")
+        projection = await run_in_thread_pool(project_portfolio, method_name=method_name,
+                                              parameters={"target_return": target_return,
+                                                          "risk_free_rate": risk_free_rate},
+                                              monthly_yen=monthly_yen, years=years, returns=returns,
+                                              withdrawal_start=withdrawal_start)
+        return projection.to_json(ensure_ascii=False)
+    except PoolSaturatedError:
+        raise
     except Exception as e:
         print(e)
         return HTTPStatus.BAD_REQUEST
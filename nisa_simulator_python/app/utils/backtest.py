@@ -0,0 +1,252 @@
+from dataclasses import dataclass
+from typing import Dict, List, OrderedDict
+
+import numpy as np
+import pandas as pd
+from dataclasses_json import dataclass_json
+
+from utils.calculate_config import CalculateConfig
+from utils.calculate_methods import calculate_weights, get_method_parameters
+from utils.executors import map_in_process_pool
+from utils.statistics_cache import Statistics
+
+# pypfopt の mean_historical_return, sample_cov と同じ、1年の営業日数
+TRADING_DAYS = 252
+
+
+@dataclass_json
+@dataclass
+class MethodBacktest:
+    """1つの計算方法で、過去のデータを使って定期的に買い直した時の結果
+    equity: 最初の買い付けを1とした、dates の各日の評価額
+    drawdown: dates の各日の、それまでの最大の評価額からの下落率(0以下)
+    rebalance_dates: 買い直した日
+    turnover: rebalance_dates の各日に買い直した割合(売買した額の片側 / 評価額)
+    cagr: 年率の複利リターン
+    volatility: 日次リターンの標準偏差(年率)
+    max_drawdown: 最大の下落率(0以下)
+    average_turnover: 1年あたりの turnover の合計
+    failed: 最適化に失敗して、前の購入割合のままにした回数
+    """
+    equity: List[float]
+    drawdown: List[float]
+    rebalance_dates: List[str]
+    turnover: List[float]
+    cagr: float
+    volatility: float
+    max_drawdown: float
+    average_turnover: float
+    failed: int
+
+
+@dataclass_json
+@dataclass
+class Backtest:
+    """計算方法ごとのバックテストの結果をまとめるためのクラス
+    lookback_days: 平均と分散の計算に使った営業日数
+    rebalance_days: 買い直す間隔(営業日数)
+    names: 購入対象の銘柄(NameBase.name)
+    dates: 評価額の日付
+    methods: {計算方法の名前: MethodBacktest}
+    """
+    lookback_days: int
+    rebalance_days: int
+    names: List[str]
+    dates: List[str]
+    methods: Dict[str, MethodBacktest]
+
+
+class RollingStatistics:
+    """窓の中の日次リターンの和、対数リターンの和、積和を持っておき、窓をずらす時は
+    入ってきた日と出ていった日の分だけ足し引きして、平均と分散を窓ごとに計算し直さずに作るクラス。
+    平均は mean_historical_return と同じ年率の複利リターン、分散は sample_cov と同じ年率の標本共分散にする
+    """
+
+    def __init__(self, returns: np.ndarray, names: List[str]) -> None:
+        """
+        Args:
+            returns (np.ndarray): shape (日数, 銘柄数) のNaNの無い日次リターン
+            names (List[str]): 銘柄の名前
+        """
+        self.returns = returns
+        self.log_returns = np.log1p(returns)
+        self.names = names
+        self.start = 0
+        self.end = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        n_assets = self.returns.shape[1]
+        self.sum = np.zeros(n_assets)
+        self.log_sum = np.zeros(n_assets)
+        self.cross = np.zeros((n_assets, n_assets))
+
+    def _add(self, start: int, end: int, sign: float) -> None:
+        rows = self.returns[start:end]
+        self.sum += sign * rows.sum(axis=0)
+        self.log_sum += sign * self.log_returns[start:end].sum(axis=0)
+        self.cross += sign * (rows.T @ rows)
+
+    def move_to(self, start: int, end: int) -> None:
+        """窓を returns[start:end] にする。前の窓と重ならなければ作り直す
+
+        Args:
+            start (int): 窓の最初の行
+            end (int): 窓の最後の行の次
+        """
+        if start >= self.end or end <= self.start:
+            self._reset()
+            self._add(start, end, 1.0)
+        else:
+            self._add(self.start, start, -1.0)
+            self._add(self.end, end, 1.0)
+        self.start = start
+        self.end = end
+
+    def get_statistics(self) -> Statistics:
+        """今の窓の平均と分散を返す
+
+        Returns:
+            Statistics: 期待リターンと共分散(年率)
+        """
+        n_days = self.end - self.start
+        mean = np.expm1(self.log_sum * TRADING_DAYS / n_days)
+        cov = (self.cross - np.outer(self.sum, self.sum) / n_days) / \
+            (n_days - 1) * TRADING_DAYS
+        return Statistics(mean=pd.Series(mean, index=self.names),
+                          cov=pd.DataFrame(cov, index=self.names, columns=self.names))
+
+
+def solve_weights(method_name: str, statistics: Statistics, parameters: dict) -> OrderedDict:
+    """calculate_weights を実行し、失敗したらNoneを返す。プロセスプールから呼ばれる
+
+    Args:
+        method_name (str): 計算方法の名前(EfficientReturn など)
+        statistics (Statistics): 計算済みの平均と分散
+        parameters (dict): 計算方法に渡すパラメータ
+
+    Returns:
+        OrderedDict: {sp500: 0.2, topix: 0.13}のような購入割合. 失敗したらNone
+    """
+    try:
+        return calculate_weights(method_name, statistics, parameters)
+    except Exception as error_of_solve:
+        print(f"In {solve_weights.__name__} error occured :{error_of_solve}")
+        return None
+
+
+def make_method_backtest(prices: np.ndarray, rebalance_rows: List[int], weights: List[np.ndarray]) -> MethodBacktest:
+    """rebalance_rows の各日に weights の割合で買い直し、その間は買ったまま持っていた時の評価額などを計算する
+
+    Args:
+        prices (np.ndarray): shape (日数, 銘柄数) のclose
+        rebalance_rows (List[int]): 買い直す日の行
+        weights (List[np.ndarray]): 各日の購入割合. Noneなら買い直さない
+
+    Returns:
+        MethodBacktest: 評価額、下落率、turnover など
+    """
+    first = rebalance_rows[0]
+    equity = np.empty(len(prices) - first)
+    value = 1.0
+    holdings = None
+    turnover: List[float] = []
+    failed = 0
+    ends = rebalance_rows[1:] + [len(prices)]
+    for row, end, target in zip(rebalance_rows, ends, weights):
+        if target is None:
+            failed += 1
+            if holdings is None:
+                # 最初の最適化に失敗したら、等分に買う
+                target = np.full(prices.shape[1], 1 / prices.shape[1])
+        if holdings is not None:
+            value = float(prices[row] @ holdings)
+        if target is not None:
+            current = np.zeros(prices.shape[1]) if holdings is None else holdings * prices[row] / value
+            traded = np.abs(target - current).sum()
+            turnover.append(float(traded / 2))
+            value *= 1 - CalculateConfig.backtest_transaction_cost * traded
+            holdings = value * target / prices[row]
+        else:
+            turnover.append(0.0)
+        equity[row - first:end - first] = prices[row:end] @ holdings
+
+    daily_returns = equity[1:] / equity[:-1] - 1
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    years = max(len(equity) - 1, 1) / TRADING_DAYS
+    return MethodBacktest(equity=equity.tolist(), drawdown=drawdown.tolist(), rebalance_dates=[],
+                          turnover=turnover,
+                          cagr=float(equity[-1] ** (1 / years) - 1),
+                          volatility=float(daily_returns.std(ddof=1) * np.sqrt(TRADING_DAYS))
+                          if len(daily_returns) > 1 else 0.0,
+                          max_drawdown=float(drawdown.min()),
+                          # 最初の買い付けは turnover に含めない
+                          average_turnover=float(sum(turnover[1:]) / years),
+                          failed=failed)
+
+
+def backtest(data: pd.DataFrame, method_names: List[str], lookback_days: int = None, rebalance_days: int = None,
+             parameters: dict = None) -> Backtest:
+    """data の期間で、lookback_days 日の平均と分散から購入割合を計算し、rebalance_days 日ごとに買い直した時の結果を計算する。
+    平均と分散は RollingStatistics で窓をずらしながら作り、全ての買い直す日と計算方法の最適化は
+    互いに独立なので map_in_process_pool で並列に解く
+
+    Args:
+        data (pd.DataFrame): index: 日付, cols: NameBase.name のclose
+        method_names (List[str]): 計算方法の名前(EfficientReturn など)のリスト
+        lookback_days (int, optional): 平均と分散の計算に使う営業日数.
+            Defaults to CalculateConfig.backtest_lookback_days と、データの日数 - 1 - rebalance_days の小さい方.
+        rebalance_days (int, optional): 買い直す間隔(営業日数). Defaults to CalculateConfig.backtest_rebalance_days.
+        parameters (dict, optional): {"target_return": 0.1, "risk_free_rate": 0.02} のようなパラメータ.
+            各計算方法には、受け取るものだけを渡す. Defaults to None.
+
+    Raises:
+        Exception: lookback_days より短いデータしか無い時と、
+            lookback_days を指定しない時に CalculateConfig.backtest_min_lookback_days を取れるデータが無い時
+
+    Returns:
+        Backtest: 計算方法ごとの結果
+    """
+    if rebalance_days is None:
+        rebalance_days = CalculateConfig.backtest_rebalance_days
+    if parameters is None:
+        parameters = dict()
+    # 休場日は前の日のcloseのままとし、全ての銘柄のcloseが揃った日から始める
+    data = data.sort_index().ffill().dropna()
+    if lookback_days is None:
+        # DBConfig.history_years 分しか取得していない時も、1回以上買い直せるように既定の営業日数を短くする
+        lookback_days = min(CalculateConfig.backtest_lookback_days,
+                            len(data) - 1 - rebalance_days)
+        if lookback_days < CalculateConfig.backtest_min_lookback_days:
+            raise Exception(
+                f"In {backtest.__name__}. データが短すぎる. rows= {len(data)}, rebalance_days= {rebalance_days}")
+    if len(data) <= lookback_days + 1:
+        raise Exception(
+            f"In {backtest.__name__}. データが lookback_days より短い. rows= {len(data)}")
+    names = list(data.columns)
+    prices = data.to_numpy(dtype="float64")
+    # returns[i] は prices[i] から prices[i + 1] へのリターン
+    returns = prices[1:] / prices[:-1] - 1
+    rebalance_rows = list(range(lookback_days, len(prices) - 1, rebalance_days))
+
+    rolling = RollingStatistics(returns=returns, names=names)
+    statistics: List[Statistics] = []
+    for row in rebalance_rows:
+        rolling.move_to(row - lookback_days, row)
+        statistics.append(rolling.get_statistics())
+
+    tasks = [(method_name, statistics_of_row, get_method_parameters(method_name=method_name, parameters=parameters))
+             for method_name in method_names for statistics_of_row in statistics]
+    solved = map_in_process_pool(solve_weights, tasks)
+
+    dates = data.index[rebalance_rows[0]:].strftime("%Y-%m-%d").tolist()
+    rebalance_dates = data.index[rebalance_rows].strftime("%Y-%m-%d").tolist()
+    methods: Dict[str, MethodBacktest] = dict()
+    for i, method_name in enumerate(method_names):
+        weights = [None if buy is None else np.array([buy.get(name, 0.0) for name in names], dtype="float64")
+                   for buy in solved[i * len(rebalance_rows):(i + 1) * len(rebalance_rows)]]
+        result = make_method_backtest(prices=prices, rebalance_rows=rebalance_rows, weights=weights)
+        result.rebalance_dates = rebalance_dates
+        methods[method_name] = result
+    return Backtest(lookback_days=lookback_days, rebalance_days=rebalance_days, names=names,
+                    dates=dates, methods=methods)
@@ -2,14 +2,77 @@ class CalculateConfig():
     """計算に使う設定クラス
     """
     # method <-> 名前対応辞書 key = index, value= name
+    # parameters: 計算方式のクラスが受け取るパラメータ名
     methods = [
         {
-            "method_name": "EfficientReturn", "informations": {"index": 0, "name": "分散最小化(リターン制約あり)"}
+            "method_name": "EfficientReturn", "informations": {"index": 0, "name": "分散最小化(リターン制約あり)"},
+            "parameters": ["target_return", "min_weights", "max_weights"]
         },
         {
-            "method_name": "MinVolatility", "informations": {"index": 1, "name": "分散最小化"}
+            "method_name": "MinVolatility", "informations": {"index": 1, "name": "分散最小化"},
+            "parameters": ["min_weights", "max_weights"]
         },
         {
-            "method_name": "MaxSharpe", "informations": {"index": 2, "name": "シャープ・レシオ最大化"}
+            "method_name": "MaxSharpe", "informations": {"index": 2, "name": "シャープ・レシオ最大化"},
+            "parameters": ["risk_free_rate", "min_weights", "max_weights"]
+        },
+        {
+            "method_name": "HierarchicalRiskParity", "informations": {"index": 3, "name": "階層的リスクパリティ"},
+            "parameters": []
         },
     ]
+    # ポートフォリオの最適化に使うプロセス数と、実行待ちにできる数(超えたら503)
+    process_pool_workers = 3
+    process_pool_queue_size = 8
+    # プロセスプールのプロセスの作り方. "forkserver" なら、APIのスレッドがlockを持ったままforkしないように、
+    # process_pool_preload をimportしただけのプロセスからforkする. 使えない環境では既定の作り方にする
+    process_pool_start_method = "forkserver"
+    process_pool_preload = ["cvxpy", "pypfopt.efficient_frontier", "pypfopt.expected_returns",
+                            "pypfopt.risk_models", "scipy.cluster.hierarchy", "utils.calculate_methods"]
+    # /frontier で計算できる点の最大の数
+    frontier_max_points = 200
+    # 階層的リスクパリティで、銘柄の相関の距離から木を作る時の scipy.cluster.hierarchy.linkage の方法
+    hrp_linkage_method = "single"
+    # 銘柄の並びごとに組み立てた最適化の問題(utils.portfolio_problem)を、1つのプロセスで覚えておく数
+    problem_cache_size = 4
+    # ソルバーの誤差で、購入割合の下限、上限からこれ以内の値は、下限、上限ちょうどにする
+    weight_bound_tolerance = 1e-6
+    # 積立のモンテカルロ法(utils.simulation)の既定の経路の数と、1回のリクエストで計算できる最大の経路の数
+    simulation_paths = 100000
+    simulation_max_paths = 1000000
+    simulation_max_years = 50
+    # 1つのchunk(プロセスプールの1回の仕事)で計算する経路の数と、chunkが1年分の乱数に使う最大のメモリ(byte)
+    simulation_chunk_paths = 10000
+    simulation_chunk_bytes = 64 * 1024 * 1024
+    # 結果に含める残高のパーセンタイル
+    simulation_percentiles = [5, 25, 50, 75, 95]
+    # chunkごとに残高を 積み立てた額との比の対数 のヒストグラムにまとめる時のビンの数と、範囲(-range から range)
+    simulation_histogram_bins = 8192
+    simulation_histogram_log_range = 8.0
+
+    # NISAの年間の枠(円)と、生涯の枠(簿価, 円). 成長投資枠は生涯の枠のうち nisa_growth_lifetime_cap まで
+    nisa_tsumitate_annual_cap = 1200000
+    nisa_growth_annual_cap = 2400000
+    nisa_lifetime_cap = 18000000
+    nisa_growth_lifetime_cap = 12000000
+    # 課税口座の譲渡益にかかる税率(所得税15% + 復興特別所得税0.315% + 住民税5%)
+    taxable_tax_rate = 0.20315
+    # NISAの試算(utils.nisa_projection)で、指定が無い時に使う 毎月の購入額(円), 積み立てる年数, 取り崩し開始(年)
+    projection_monthly_yen = [10000, 33333, 50000, 100000, 200000, 300000]
+    projection_years = [5, 10, 15, 20, 25, 30, 35, 40]
+    projection_withdrawal_start = [10, 15, 20, 25, 30, 35, 40, 45, 50]
+    # リターンは、ポートフォリオの期待リターンから標準偏差のこの倍数だけずらしたものを使う
+    projection_volatility_steps = [-1.0, -0.5, 0.0, 0.5, 1.0]
+    # 1回のリクエストで計算できる組み合わせの最大の数と、各軸に指定できる値の最大の数
+    projection_max_scenarios = 1000000
+    projection_max_values = 100
+    # 積み立てる年数と取り崩し開始(年)に指定できる最大の年数
+    projection_max_years = 100
+
+    # バックテスト(utils.backtest)で、平均と分散の計算に使う営業日数と、買い直す間隔(営業日数)。
+    # 営業日数を指定しない時は、データが足りなければ 1回以上買い直せる長さまで短くする。ただし backtest_min_lookback_days 以上
+    backtest_lookback_days = 756
+    backtest_min_lookback_days = 20
+    backtest_rebalance_days = 21
+    # 買い直す時に、売買した額にかかる手数料の割合
+    backtest_transaction_cost = 0.0
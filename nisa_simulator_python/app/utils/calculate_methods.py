@@ -1,11 +1,11 @@
 from abc import ABCMeta, abstractclassmethod
+import numpy as np
 from pandas import DataFrame
-from typing import OrderedDict, List
-
-from pypfopt import expected_returns, risk_models
-from pypfopt.efficient_frontier import EfficientFrontier
+from typing import Dict, OrderedDict, List, Tuple
 
 from utils.calculate_config import CalculateConfig
+from utils.portfolio_problem import PortfolioProblem, check_weight_bounds, problem_cache
+from utils.statistics_cache import Statistics, calculate_statistics
 
 
 class ICalculateMethod(metaclass=ABCMeta):
@@ -17,7 +17,7 @@ class ICalculateMethod(metaclass=ABCMeta):
     @abstractclassmethod
     def calculate(self, data: DataFrame) -> OrderedDict:
         """
-            pypfopt.efficient_frontier.EfficientFrontier のmethodを使用して計算する。
+            utils.portfolio_problem.PortfolioProblem のmethodを使用して計算する。
         Args:
             data (DataFrame, optional): dbから取得したデータをpandas.DataFrameに格納して渡す。 Defaults to None.
 
@@ -54,30 +54,34 @@ min_volatility = min_volatility_dict["informations"]
 max_sharpe_dict = next(
     method for method in CalculateConfig.methods if method["method_name"] == "MaxSharpe")
 max_sharpe = max_sharpe_dict["informations"]
+hierarchical_risk_parity_dict = next(
+    method for method in CalculateConfig.methods if method["method_name"] == "HierarchicalRiskParity")
+hierarchical_risk_parity = hierarchical_risk_parity_dict["informations"]
 
 
-class EfficientReturn(ICalculateMethod):
-    """分散最小化(リターン制約あり)でポートフォリオを計算するクラス
+class CalculateMethod(ICalculateMethod):
+    """計算方法のクラスに共通する、名前、index、平均と分散の扱いをまとめたクラス。
+    各計算方法は calculate だけを書く
 
     Args:
         ICalculateMethod (_type_): _description_
     """
 
-    def __init__(self, data: DataFrame, name: str = efficient_return["name"], index: int = efficient_return["index"], target_return: float = 0.1) -> None:
-        """初期化時、データから平均や分散を計算する。
+    def __init__(self, data: DataFrame = None, name: str = None, index: int = None, statistics: Statistics = None) -> None:
+        """初期化時、データから平均や分散を計算する。statistics が渡されたらそれを使う。
 
         Args:
-            data (DataFrame): 計算に使用するデータ
-            name (str, optional): method名 Defaults to "分散最小化(リターン制約あり)".
-            index (int, optional): methodのindex Defaults to 0.
-            target_return (float, optional): リターン制約 Defaults to 0.1.
+            data (DataFrame, optional): 計算に使用するデータ Defaults to None.
+            name (str, optional): method名 Defaults to None.
+            index (int, optional): methodのindex Defaults to None.
+            statistics (Statistics, optional): 計算済みの平均と分散 Defaults to None.
         """
         self._name = name
         self._index = index
-        self._target_return = target_return
         self.data = data
-        self.mean = expected_returns.mean_historical_return(self.data)
-        self.cov = risk_models.sample_cov(self.data)
+        if statistics is None:
+            statistics = calculate_statistics(self.data)
+        self._set_statistics(statistics)
 
     def get_name(self) -> str:
         """method名を返す
@@ -95,135 +99,247 @@ class EfficientReturn(ICalculateMethod):
         """
         return self._index
 
-    def calculate(self, data: DataFrame = None) -> OrderedDict:
+    def _set_statistics(self, statistics: Statistics) -> None:
+        """計算に使う平均と分散を入れる"""
+        self.statistics = statistics
+        self.mean = statistics.mean
+        self.cov = statistics.cov
+
+    def _get_statistics(self, data: DataFrame = None) -> Statistics:
+        """data が渡されたら平均と分散を計算し直して返す
+
+        Args:
+            data (DataFrame, optional): 必要なら再設定する。 Defaults to None.
+
+        Returns:
+            Statistics: 計算に使う平均と分散
         """
-            pypfopt.efficient_frontier.EfficientFrontier.efficient_returnで計算する
+        if data is not None:
+            self._set_statistics(calculate_statistics(data))
+        return self.statistics
+
+    def _get_problem(self, data: DataFrame = None) -> PortfolioProblem:
+        """data が渡されたら平均と分散を計算し直し、銘柄の並びの組み立て済みの問題を返す
+
         Args:
             data (DataFrame, optional): 必要なら再設定する。 Defaults to None.
 
         Returns:
-            OrderedDict: {sp500: 20000, topix: 13333}のようなデータ
+            PortfolioProblem: problem_cache の問題
         """
-        if data != None:
-            self.mean = expected_returns.mean_historical_return(data)
-            self.cov = risk_models.sample_cov(data)
-        ef = EfficientFrontier(self.mean, self.cov)
-        return ef.efficient_return(target_return=self._target_return)
+        return problem_cache.get(names=list(self._get_statistics(data).mean.index))
 
 
-class MinVolatility(ICalculateMethod):
-    """分散最小化でポートフォリオを計算するクラス
+class EfficientReturn(CalculateMethod):
+    """分散最小化(リターン制約あり)でポートフォリオを計算するクラス
 
     Args:
-        ICalculateMethod (_type_): _description_
+        CalculateMethod (_type_): _description_
     """
 
-    def __init__(self, data: DataFrame, name: str = min_volatility["name"], index: int = min_volatility["index"]) -> None:
-        """初期化時、データから平均や分散を計算する。
+    def __init__(self, data: DataFrame = None, name: str = efficient_return["name"], index: int = efficient_return["index"], target_return: float = 0.1, statistics: Statistics = None, min_weights: Dict[str, float] = None, max_weights: Dict[str, float] = None) -> None:
+        """初期化時、データから平均や分散を計算する。statistics が渡されたらそれを使う。
 
         Args:
-            data (DataFrame): 計算に使用するデータ
-            name (str, optional): method名 Defaults to "分散最小化".
-            index (int, optional): methodのindex Defaults to 1.
+            data (DataFrame, optional): 計算に使用するデータ Defaults to None.
+            name (str, optional): method名 Defaults to "分散最小化(リターン制約あり)".
+            index (int, optional): methodのindex Defaults to 0.
+            target_return (float, optional): リターン制約 Defaults to 0.1.
+            statistics (Statistics, optional): 計算済みの平均と分散 Defaults to None.
+            min_weights (Dict[str, float], optional): {sp500: 0.1} のような購入割合の下限 Defaults to None.
+            max_weights (Dict[str, float], optional): {topix: 0.3} のような購入割合の上限 Defaults to None.
         """
-        self._name = name
-        self._index = index
-        self.data = data
-        self.mean = expected_returns.mean_historical_return(self.data)
-        self.cov = risk_models.sample_cov(self.data)
+        super().__init__(data=data, name=name, index=index, statistics=statistics)
+        self._target_return = target_return
+        self._min_weights = min_weights
+        self._max_weights = max_weights
 
-    def get_name(self) -> str:
-        """method名を返す
+    def calculate(self, data: DataFrame = None) -> OrderedDict:
+        """
+            PortfolioProblem.efficient_return で計算する
+        Args:
+            data (DataFrame, optional): 必要なら再設定する。 Defaults to None.
 
         Returns:
-            str: method名
+            OrderedDict: {sp500: 20000, topix: 13333}のようなデータ
         """
-        return self._name
+        problem = self._get_problem(data)
+        return problem.efficient_return(self.statistics, target_return=self._target_return,
+                                        min_weights=self._min_weights, max_weights=self._max_weights)
 
-    def get_index(self) -> int:
-        """method に割り振ったindexを返す
 
-        Returns:
-            int:index
+class MinVolatility(CalculateMethod):
+    """分散最小化でポートフォリオを計算するクラス
+
+    Args:
+        CalculateMethod (_type_): _description_
+    """
+
+    def __init__(self, data: DataFrame = None, name: str = min_volatility["name"], index: int = min_volatility["index"], statistics: Statistics = None, min_weights: Dict[str, float] = None, max_weights: Dict[str, float] = None) -> None:
+        """初期化時、データから平均や分散を計算する。statistics が渡されたらそれを使う。
+
+        Args:
+            data (DataFrame, optional): 計算に使用するデータ Defaults to None.
+            name (str, optional): method名 Defaults to "分散最小化".
+            index (int, optional): methodのindex Defaults to 1.
+            statistics (Statistics, optional): 計算済みの平均と分散 Defaults to None.
+            min_weights (Dict[str, float], optional): {sp500: 0.1} のような購入割合の下限 Defaults to None.
+            max_weights (Dict[str, float], optional): {topix: 0.3} のような購入割合の上限 Defaults to None.
         """
-        return self._index
+        super().__init__(data=data, name=name, index=index, statistics=statistics)
+        self._min_weights = min_weights
+        self._max_weights = max_weights
 
     def calculate(self, data: DataFrame = None) -> OrderedDict:
         """
-            pypfopt.efficient_frontier.EfficientFrontier.efficient_returnで計算する
+            PortfolioProblem.min_volatility で計算する
         Args:
             data (DataFrame, optional): 必要なら再設定する。 Defaults to None.
 
         Returns:
             OrderedDict: {sp500: 20000, topix: 13333}のようなデータ
         """
-        if data != None:
-            self.mean = expected_returns.mean_historical_return(data)
-            self.cov = risk_models.sample_cov(data)
-        ef = EfficientFrontier(self.mean, self.cov)
-        return ef.min_volatility()
+        problem = self._get_problem(data)
+        return problem.min_volatility(self.statistics, min_weights=self._min_weights, max_weights=self._max_weights)
 
 
-class MaxSharpe(ICalculateMethod):
+class MaxSharpe(CalculateMethod):
     """シャープ・レシオ最大化でポートフォリオを計算するクラス
 
     Args:
-        ICalculateMethod (_type_): _description_
+        CalculateMethod (_type_): _description_
     """
 
-    def __init__(self, data: DataFrame, name: str = max_sharpe["name"], index: int = max_sharpe["index"], risk_free_rate: float = 0.02) -> None:
-        """初期化時、データから平均や分散を計算する。
+    def __init__(self, data: DataFrame = None, name: str = max_sharpe["name"], index: int = max_sharpe["index"], risk_free_rate: float = 0.02, statistics: Statistics = None, min_weights: Dict[str, float] = None, max_weights: Dict[str, float] = None) -> None:
+        """初期化時、データから平均や分散を計算する。statistics が渡されたらそれを使う。
 
         Args:
-            data (DataFrame): 計算に使用するデータ
+            data (DataFrame, optional): 計算に使用するデータ Defaults to None.
             name (str, optional): method名 Defaults to "分散最小化".
             index (int, optional): methodのindex Defaults to 1.
             risk_free_rate (float, optional):risk-free rate of borrowing/lending  Defaults to 0.02.
+            statistics (Statistics, optional): 計算済みの平均と分散 Defaults to None.
+            min_weights (Dict[str, float], optional): {sp500: 0.1} のような購入割合の下限 Defaults to None.
+            max_weights (Dict[str, float], optional): {topix: 0.3} のような購入割合の上限 Defaults to None.
         """
-        self._name = name
-        self._index = index
+        super().__init__(data=data, name=name, index=index, statistics=statistics)
         self._risk_free_rate = risk_free_rate
-        self.data = data
-        self.mean = expected_returns.mean_historical_return(self.data)
-        self.cov = risk_models.sample_cov(self.data)
+        self._min_weights = min_weights
+        self._max_weights = max_weights
 
-    def get_name(self) -> str:
-        """method名を返す
+    def calculate(self, data: DataFrame = None) -> OrderedDict:
+        """
+            PortfolioProblem.max_sharpe で計算する. 解けなければ min_volatility で計算する
+        Args:
+            data (DataFrame, optional): 必要なら再設定する。 Defaults to None.
 
         Returns:
-            str: method名
+            OrderedDict: {sp500: 20000, topix: 13333}のようなデータ
         """
-        return self._name
+        problem = self._get_problem(data)
+        try:
+            return problem.max_sharpe(self.statistics, risk_free_rate=self._risk_free_rate,
+                                      min_weights=self._min_weights, max_weights=self._max_weights)
+        except Exception as error_of_calculate_by_max_sharpe:
+            print(
+                f"In {self.calculate.__name__} error occured :{error_of_calculate_by_max_sharpe}")
+            print("Calculate portfolio by MinVolatility")
+            return problem.min_volatility(self.statistics, min_weights=self._min_weights, max_weights=self._max_weights)
 
-    def get_index(self) -> int:
-        """method に割り振ったindexを返す
 
-        Returns:
-            int:index
+class HierarchicalRiskParity(CalculateMethod):
+    """階層的リスクパリティ(HRP)でポートフォリオを計算するクラス。
+    最適化の問題を解かないので、銘柄が数千あっても速く、共分散が正定値でなくても計算できる
+
+    Args:
+        CalculateMethod (_type_): _description_
+    """
+
+    def __init__(self, data: DataFrame = None, name: str = hierarchical_risk_parity["name"], index: int = hierarchical_risk_parity["index"], statistics: Statistics = None) -> None:
+        """初期化時、データから平均や分散を計算する。statistics が渡されたらそれを使う。
+
+        Args:
+            data (DataFrame, optional): 計算に使用するデータ Defaults to None.
+            name (str, optional): method名 Defaults to "階層的リスクパリティ".
+            index (int, optional): methodのindex Defaults to 3.
+            statistics (Statistics, optional): 計算済みの平均と分散 Defaults to None.
         """
-        return self._index
+        super().__init__(data=data, name=name, index=index, statistics=statistics)
 
     def calculate(self, data: DataFrame = None) -> OrderedDict:
         """
-            pypfopt.efficient_frontier.EfficientFrontier.efficient_returnで計算する
+            hrp_weights で計算する
         Args:
             data (DataFrame, optional): 必要なら再設定する。 Defaults to None.
 
         Returns:
             OrderedDict: {sp500: 20000, topix: 13333}のようなデータ
         """
-        try:
-            if data is not None:
-                self.mean = expected_returns.mean_historical_return(data)
-                self.cov = risk_models.sample_cov(data)
-            ef = EfficientFrontier(self.mean, self.cov)
-            return ef.max_sharpe(risk_free_rate=0.02)
-        except Exception as error_of_calculate_by_max_sharpe:
-            print(
-                f"In {self.calculate.__name__} error occured :{error_of_calculate_by_max_sharpe}")
-            print("Calculate portfolio by MinVolatility")
-            ef = EfficientFrontier(self.mean, self.cov)
-            return ef.min_volatility()
+        cov = self._get_statistics(data).cov
+        weights = hrp_weights(cov.to_numpy(dtype="float64"))
+        return OrderedDict(zip(cov.index, weights.tolist()))
+
+
+def hrp_weights(cov: np.ndarray, linkage_method: str = None) -> np.ndarray:
+    """共分散から階層的リスクパリティの購入割合を計算する。
+    相関から作った距離で銘柄の木を作って近い銘柄が隣り合うように並べ替え、並びを半分ずつに分けながら、
+    分けた2つの塊の分散(塊の中は分散の逆数の割合で買う)の逆比で購入割合を配分する。
+    距離と並べ替えは行列のまま計算し、半分に分ける処理は同じ深さの塊をまとめて1段ずつ進めるので、
+    計算量は銘柄数の2乗程度になる
+
+    Args:
+        cov (np.ndarray): shape (銘柄数, 銘柄数) の共分散
+        linkage_method (str, optional): scipy.cluster.hierarchy.linkage の方法. Defaults to CalculateConfig.hrp_linkage_method.
+
+    Returns:
+        np.ndarray: cov の並びの購入割合
+    """
+    # scipy は読み込みが遅いので、計算する時にimportする
+    from scipy.cluster.hierarchy import leaves_list, linkage
+    from scipy.spatial.distance import squareform
+
+    if linkage_method is None:
+        linkage_method = CalculateConfig.hrp_linkage_method
+    n_assets = len(cov)
+    if n_assets == 1:
+        return np.ones(1)
+    # 値動きの無い銘柄があっても0で割らないようにする
+    variances = np.clip(np.diag(cov), np.finfo("float64").tiny, None)
+    std = np.sqrt(variances)
+    corr = np.clip(cov / np.outer(std, std), -1, 1)
+    distance = np.sqrt((1 - corr) / 2)
+    np.fill_diagonal(distance, 0)
+    order = leaves_list(linkage(squareform(distance, checks=False), method=linkage_method))
+
+    ordered_cov = cov[np.ix_(order, order)]
+    inverse_variances = 1 / variances[order]
+    weights = np.ones(n_assets)
+    clusters = [(0, n_assets)]
+    while len(clusters) > 0:
+        halves = [(start, (start + end) // 2, end) for start, end in clusters]
+        # 2つに分けた塊の分散. 塊の中は分散の逆数の割合で買う
+        cluster_variances = np.array([[_cluster_variance(ordered_cov, inverse_variances, left, right)
+                                       for left, right in ((start, middle), (middle, end))]
+                                      for start, middle, end in halves])
+        totals = cluster_variances.sum(axis=1)
+        alphas = np.where(totals > 0, 1 - cluster_variances[:, 0] / np.where(totals > 0, totals, 1), 0.5)
+        for (start, middle, end), alpha in zip(halves, alphas):
+            weights[start:middle] *= alpha
+            weights[middle:end] *= 1 - alpha
+        clusters = [(left, right) for start, middle, end in halves
+                    for left, right in ((start, middle), (middle, end)) if right - left > 1]
+
+    result = np.empty(n_assets)
+    result[order] = weights
+    return result
+
+
+def _cluster_variance(ordered_cov: np.ndarray, inverse_variances: np.ndarray, start: int, end: int) -> float:
+    """並べ替えた共分散の start から end の前までの塊を、分散の逆数の割合で買った時の分散を返す"""
+    if end - start == 1:
+        return float(ordered_cov[start, start])
+    weights = inverse_variances[start:end] / inverse_variances[start:end].sum()
+    return float(weights @ ordered_cov[start:end, start:end] @ weights)
 
 
 def get_method(method_name: str) -> ICalculateMethod or Exception:
@@ -244,10 +360,91 @@ def get_method(method_name: str) -> ICalculateMethod or Exception:
         return MinVolatility
     elif method_name == "MaxSharpe":
         return MaxSharpe
+    elif method_name == "HierarchicalRiskParity":
+        return HierarchicalRiskParity
     else:
         raise Exception("リストに無い計算方法が指定された")
 
 
+def get_method_index(method_name: str) -> int:
+    """method_name で指定した計算方法に割り振ったindexを返す
+
+    Args:
+        method_name (str): 計算方法の名前(EfficientReturn など)
+
+    Raises:
+        Exception: 変な名前が指定されたときに排出される
+
+    Returns:
+        int: CalculateConfig.methods のinformations.index
+    """
+    try:
+        method_dict = next(
+            method for method in CalculateConfig.methods if method["method_name"] == method_name)
+    except StopIteration:
+        raise Exception(
+            f"In {get_method_index.__name__}. リストに無い計算方法が指定された. method_name= {method_name}")
+    return method_dict["informations"]["index"]
+
+
+def get_method_parameters(method_name: str, parameters: dict) -> dict:
+    """parameters から、method_name の計算方法が受け取るものだけを取り出す
+
+    Args:
+        method_name (str): 計算方法の名前(EfficientReturn など)
+        parameters (dict): {"target_return": 0.1, "risk_free_rate": 0.02} のようなパラメータ
+
+    Returns:
+        dict: CalculateConfig.methods の parameters に含まれ、値がNoneでないパラメータ
+    """
+    method_dict = next(
+        method for method in CalculateConfig.methods if method["method_name"] == method_name)
+    return {key: value for key, value in parameters.items()
+            if key in method_dict["parameters"] and value is not None}
+
+
+def calculate_weights(method_name: str, statistics: Statistics, parameters: dict) -> OrderedDict:
+    """method_name の計算方法でポートフォリオの購入割合を計算する。プロセスプールから呼ばれる。
+    購入割合の下限、上限が指定されていたら、計算した購入割合がそれをちょうど守っているかを確かめる
+
+    Args:
+        method_name (str): 計算方法の名前(EfficientReturn など)
+        statistics (Statistics): 計算済みの平均と分散
+        parameters (dict): 計算方法に渡すパラメータ
+
+    Raises:
+        Exception: 計算した購入割合が下限か上限を守っていない時
+
+    Returns:
+        OrderedDict: {sp500: 0.2, topix: 0.13}のような購入割合
+    """
+    method = get_method(method_name=method_name)(
+        statistics=statistics, **parameters)
+    weights = method.calculate()
+    check_weight_bounds(weights, min_weights=parameters.get("min_weights"),
+                        max_weights=parameters.get("max_weights"))
+    return weights
+
+
+def portfolio_performance(weights: dict, statistics: Statistics) -> Tuple[float, float]:
+    """購入割合のポートフォリオの期待リターンと標準偏差を、計算方法のクラスと同じ平均と分散から計算する
+
+    Args:
+        weights (dict): {sp500: 0.2, topix: 0.13}のような購入割合
+        statistics (Statistics): 計算済みの平均と分散
+
+    Returns:
+        Tuple[float, float]: 期待リターン(年率)と標準偏差(年率)
+    """
+    names = list(weights.keys())
+    weight_array = np.array([weights[name] for name in names], dtype="float64")
+    expected_return = float(
+        statistics.mean.loc[names].to_numpy(dtype="float64") @ weight_array)
+    cov = statistics.cov.loc[names, names].to_numpy(dtype="float64")
+    volatility = float(np.sqrt(max(weight_array @ cov @ weight_array, 0)))
+    return expected_return, volatility
+
+
 def get_calculate_methods() -> List[str]:
     """計算時に使うcalculate_methodの名前を返す
 
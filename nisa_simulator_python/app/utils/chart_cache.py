@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import threading
+from typing import Callable, Hashable
+
+
+@dataclass
+class ChartPayload:
+    """/graph/ でそのまま返す、エンコード済みのレスポンス
+    body: レスポンスのbytes
+    etag: body から作ったETag
+    media_type: Content-Type
+    """
+    body: bytes
+    etag: str
+    media_type: str = "application/json"
+
+
+def make_chart_payload(body: bytes, media_type: str = "application/json") -> ChartPayload:
+    """body からETagを計算して ChartPayload を作る
+
+    Args:
+        body (bytes): レスポンスのbytes
+        media_type (str, optional): Content-Type. Defaults to "application/json".
+
+    Returns:
+        ChartPayload: エンコード済みのレスポンス
+    """
+    return ChartPayload(body=body, etag=f'"{hashlib.sha1(body).hexdigest()}"', media_type=media_type)
+
+
+class ChartPayloadCache:
+    """ChartPayload を (データのバージョン, scale, 期間) などのkeyごとに覚えておくクラス。
+    max_size を超えたら古い順に捨て、GraphDataが更新されたら clear で全て捨てる。
+    """
+
+    def __init__(self, max_size: int = 16) -> None:
+        """
+        Args:
+            max_size (int, optional): 覚えておくChartPayloadの数. Defaults to 16.
+        """
+        self.max_size = max_size
+        self._payloads: "OrderedDict[Hashable, ChartPayload]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[[], ChartPayload]) -> ChartPayload:
+        """key のChartPayloadを返す。無ければ build で作って覚えておく
+
+        Args:
+            key (Hashable): データのバージョンとscale, 期間など
+            build (Callable[[], ChartPayload]): ChartPayloadを作る関数. keyが無い時だけ呼ばれる
+
+        Returns:
+            ChartPayload: エンコード済みのレスポンス
+        """
+        with self._lock:
+            if key in self._payloads:
+                self._payloads.move_to_end(key)
+                return self._payloads[key]
+        payload = build()
+        with self._lock:
+            self._payloads[key] = payload
+            while len(self._payloads) > self.max_size:
+                self._payloads.popitem(last=False)
+        return payload
+
+    def clear(self) -> None:
+        """覚えているChartPayloadを全て捨てる
+        """
+        with self._lock:
+            self._payloads.clear()
+
+
+chart_payload_cache = ChartPayloadCache()
@@ -0,0 +1,144 @@
+from dataclasses import dataclass
+import struct
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import orjson
+import pandas as pd
+
+# 今までの形式. HoleGraphData.to_json() の文字列をさらにjsonにしたもの
+LEGACY_JSON_MEDIA_TYPE = "application/json"
+# 列ごとにまとめたjson
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.nisa.chart+json"
+# 列ごとにまとめたバイナリ. ブラウザでは Int32Array, Float32Array でコピーせずに読める
+BINARY_MEDIA_TYPE = "application/vnd.nisa.chart"
+BINARY_MAGIC = b"NCH1"
+# vue-chartjs で描画に使う色たち. 銘柄の方が多い時は繰り返す
+COLOR_PALETTE = ["red", "green", "blue", "yellow", "orange", "gray", "purple"]
+
+
+@dataclass
+class ChartColumns:
+    """グラフのデータを列ごとにまとめたもの
+    dates: closeを取得している日付(datetime64[D])
+    names: インデックス名
+    colors: 描画に使う色
+    closes: shape (銘柄数, 日付数) のclose. 無い日はNaN
+    """
+    dates: np.ndarray
+    names: List[str]
+    colors: List[str]
+    closes: np.ndarray
+
+
+def make_chart_columns(df: pd.DataFrame) -> ChartColumns:
+    """日付 x 銘柄 の表から ChartColumns を作る
+
+    Args:
+        df (pd.DataFrame): index: 日付, cols: NameBase.name のclose
+
+    Returns:
+        ChartColumns: 列ごとにまとめたグラフのデータ
+    """
+    names = [str(col) for col in df.columns]
+    return ChartColumns(dates=pd.DatetimeIndex(df.index).to_numpy(dtype="datetime64[D]"),
+                        names=names,
+                        colors=[COLOR_PALETTE[i % len(COLOR_PALETTE)]
+                                for i in range(len(names))],
+                        closes=np.ascontiguousarray(df.to_numpy(dtype="float64").T))
+
+
+def encode_legacy_json(columns: ChartColumns) -> bytes:
+    """今までの /graph/ と同じ形
+    "{\"labels\": [\"2021-09-15\", ...], \"datasets\": [{\"label\": \"nikkei\", \"data\": [123.124, null, ...], \"borderColor\": \"red\"}, ...]}"
+    のbytesにする。front は JSON.parse(レスポンス) しているので、jsonの文字列をさらにjsonにする
+
+    Args:
+        columns (ChartColumns): 列ごとにまとめたグラフのデータ
+
+    Returns:
+        bytes: レスポンスのbytes
+    """
+    chart = {"labels": np.datetime_as_string(columns.dates).tolist(),
+             "datasets": [{"label": name, "data": closes, "borderColor": color}
+                          for name, color, closes in zip(columns.names, columns.colors, columns.closes)]}
+    return orjson.dumps(orjson.dumps(chart, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8"))
+
+
+def encode_columnar_json(columns: ChartColumns) -> bytes:
+    """列ごとにまとめた
+    {"epoch": "2021-09-15", "offsets": [0, 1, 4, ...], "names": ["nikkei", ...], "colors": ["red", ...],
+     "closes": [[123.124, null, ...], ...]}
+    のbytesにする。日付は epoch からの日数, closeは float32 の精度にする
+
+    Args:
+        columns (ChartColumns): 列ごとにまとめたグラフのデータ
+
+    Returns:
+        bytes: レスポンスのbytes
+    """
+    epoch, offsets = _to_offsets(columns.dates)
+    return orjson.dumps({"epoch": epoch, "offsets": offsets, "names": columns.names, "colors": columns.colors,
+                         "closes": columns.closes.astype("float32")}, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def encode_binary(columns: ChartColumns) -> bytes:
+    """列ごとにまとめたバイナリにする。全てリトルエンディアンで
+        magic: b"NCH1"
+        uint32: header の長さ
+        header: {"epoch": "2021-09-15", "rows": 日付数, "names": [...], "colors": [...]} のjson. 4byte境界まで空白で埋める
+        int32[rows]: epoch からの日数
+        float32[rows] x 銘柄数: close. 無い日はNaN
+
+    Args:
+        columns (ChartColumns): 列ごとにまとめたグラフのデータ
+
+    Returns:
+        bytes: レスポンスのbytes
+    """
+    epoch, offsets = _to_offsets(columns.dates)
+    header = orjson.dumps({"epoch": epoch, "rows": len(offsets),
+                           "names": columns.names, "colors": columns.colors})
+    header += b" " * (-len(header) % 4)
+    return b"".join([BINARY_MAGIC, struct.pack("<I", len(header)), header,
+                     np.asarray(offsets, dtype="<i4").tobytes(),
+                     columns.closes.astype("<f4").tobytes()])
+
+
+def _to_offsets(dates: np.ndarray) -> Tuple[str, List[int]]:
+    """日付を 最初の日付 と そこからの日数 に分ける
+
+    Args:
+        dates (np.ndarray): datetime64[D] の日付
+
+    Returns:
+        Tuple[str, List[int]]: ("2021-09-15", [0, 1, 4, ...])
+    """
+    if len(dates) == 0:
+        return None, []
+    return str(dates[0]), (dates - dates[0]).astype("int64").tolist()
+
+
+CHART_ENCODERS: Dict[str, Callable[[ChartColumns], bytes]] = {
+    LEGACY_JSON_MEDIA_TYPE: encode_legacy_json,
+    COLUMNAR_JSON_MEDIA_TYPE: encode_columnar_json,
+    BINARY_MEDIA_TYPE: encode_binary,
+}
+
+
+def negotiate_media_type(accept: str = None) -> str:
+    """Acceptヘッダーから返す形式を選ぶ。q値は見ずに、書かれている順で最初に対応しているものにする
+
+    Args:
+        accept (str, optional): Acceptヘッダー. Defaults to None.
+
+    Returns:
+        str: CHART_ENCODERS にある media type. 対応しているものが無ければ今までの形式
+    """
+    if accept is None:
+        return LEGACY_JSON_MEDIA_TYPE
+    for media_range in accept.split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in CHART_ENCODERS:
+            return media_type
+    return LEGACY_JSON_MEDIA_TYPE
@@ -0,0 +1,211 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import threading
+from typing import Dict, Iterator, List
+
+from db.db_config import DBConfig
+from db.Model import ScopedSession
+from utils.calculate_config import CalculateConfig
+
+
+class PoolSaturatedError(Exception):
+    """プールの実行中と待ちの仕事が上限に達していて、新しい仕事を受け付けられない時のエラー
+    """
+    pass
+
+
+class BoundedExecutor:
+    """実行中と待ちの仕事の数に上限を付けたExecutor。上限を超えた submit は待たずに PoolSaturatedError にする
+    """
+
+    def __init__(self, executor: Executor, max_pending: int) -> None:
+        """
+        Args:
+            executor (Executor): 実際に仕事を実行するExecutor
+            max_pending (int): 実行中と待ちの仕事の数の上限
+        """
+        self.executor = executor
+        self._semaphore = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """fn(*args, **kwargs) を実行する
+
+        Raises:
+            PoolSaturatedError: 実行中と待ちの仕事が上限に達している時
+
+        Returns:
+            Future: fnの結果
+        """
+        if not self._semaphore.acquire(blocking=False):
+            raise PoolSaturatedError(
+                f"In {self.submit.__name__}. 実行待ちの仕事が上限に達している")
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(lambda _: self._semaphore.release())
+        return future
+
+
+process_pool: BoundedExecutor = None
+thread_pool: BoundedExecutor = None
+pool_lock = threading.Lock()
+
+
+def get_process_pool_context():
+    """CalculateConfig.process_pool_start_method のプロセスの作り方を返す。
+    fork はforkした時に他のスレッドが持っていたlock(importのlockなど)を持ったままのプロセスを作り、
+    そのプロセスが止まってしまうことがあるので、使える環境では forkserver を使う
+
+    Returns:
+        multiprocessing.context.BaseContext: プロセスの作り方. 使えない時はNone(既定の作り方)
+    """
+    start_method = CalculateConfig.process_pool_start_method
+    if start_method not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        context.set_forkserver_preload(CalculateConfig.process_pool_preload)
+    return context
+
+
+def get_process_pool() -> BoundedExecutor:
+    """ポートフォリオの最適化など、CPUを使う計算に使うプロセスプールを返す。最初に呼ばれた時に作る
+
+    Returns:
+        BoundedExecutor: CalculateConfig.process_pool_workers 個のプロセスを持ち、
+            CalculateConfig.process_pool_queue_size 個まで実行待ちにできるプール
+    """
+    global process_pool
+    with pool_lock:
+        if process_pool is None:
+            process_pool = BoundedExecutor(
+                ProcessPoolExecutor(
+                    max_workers=CalculateConfig.process_pool_workers, mp_context=get_process_pool_context()),
+                max_pending=CalculateConfig.process_pool_workers + CalculateConfig.process_pool_queue_size)
+        return process_pool
+
+
+def get_thread_pool() -> BoundedExecutor:
+    """dbの読み書きや、spread sheetからの取得などに使うスレッドプールを返す。最初に呼ばれた時に作る
+
+    Returns:
+        BoundedExecutor: DBConfig.thread_pool_workers 個のスレッドを持ち、
+            DBConfig.thread_pool_queue_size 個まで実行待ちにできるプール
+    """
+    global thread_pool
+    with pool_lock:
+        if thread_pool is None:
+            thread_pool = BoundedExecutor(
+                ThreadPoolExecutor(max_workers=DBConfig.thread_pool_workers),
+                max_pending=DBConfig.thread_pool_workers + DBConfig.thread_pool_queue_size)
+        return thread_pool
+
+
+def imap_in_process_pool(fn, args_list: List[tuple]) -> Iterator:
+    """args_list の各引数で fn(*args) をプロセスプールで実行し、結果を同じ順番で1つずつ返す。
+    1回の呼び出しでプールを埋めないように、同時に投げる仕事は CalculateConfig.process_pool_workers 個までにする。
+    返すまで持っておく結果も、先に終わった仕事の分(process_pool_workers 個まで)だけになる。
+    途中でエラーになったり、呼び出し側が最後まで読まずに止めた時は、実行待ちの仕事を取り消す。
+    fnと引数はpickleできる必要がある
+
+    Args:
+        fn: module直下の関数
+        args_list (List[tuple]): fn に渡す引数のリスト
+
+    Raises:
+        PoolSaturatedError: 他の仕事でプロセスプールが埋まっている時
+
+    Yields:
+        fnの結果
+    """
+    process_pool = get_process_pool()
+    finished = dict()
+    running: Dict[Future, int] = dict()
+    next_index = 0
+    yield_index = 0
+    try:
+        while yield_index < len(args_list):
+            while next_index < len(args_list) and len(running) + len(finished) < CalculateConfig.process_pool_workers:
+                running[process_pool.submit(fn, *args_list[next_index])] = next_index
+                next_index += 1
+            if yield_index not in finished:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[running.pop(future)] = future.result()
+                continue
+            yield finished.pop(yield_index)
+            yield_index += 1
+    finally:
+        # 失敗したリクエストの仕事でプールの枠を使い続けないようにする。実行中の仕事は取り消せないので終わるまで走る
+        for future in running:
+            future.cancel()
+
+
+def map_in_process_pool(fn, args_list: List[tuple]) -> list:
+    """args_list の各引数で fn(*args) をプロセスプールで実行し、結果を同じ順番で返す。
+    同時に投げる仕事の数は imap_in_process_pool と同じ
+
+    Args:
+        fn: module直下の関数
+        args_list (List[tuple]): fn に渡す引数のリスト
+
+    Raises:
+        PoolSaturatedError: 他の仕事でプロセスプールが埋まっている時
+
+    Returns:
+        list: fnの結果のリスト
+    """
+    return list(imap_in_process_pool(fn, args_list))
+
+
+def shutdown_pools() -> None:
+    """プロセスプールとスレッドプールを閉じる。終了時に呼び、プロセスプールのプロセスを残さないようにする
+    """
+    global process_pool, thread_pool
+    with pool_lock:
+        for pool in (process_pool, thread_pool):
+            if pool is not None:
+                pool.executor.shutdown(wait=True, cancel_futures=True)
+        process_pool = None
+        thread_pool = None
+
+
+def run_with_scoped_session(fn, *args, **kwargs):
+    """fn(*args, **kwargs) を実行し、終わったらこのスレッドの ScopedSession を閉じてコネクションをプールに返す
+
+    Returns:
+        fnの結果
+    """
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        ScopedSession.remove()
+
+
+async def run_in_thread_pool(fn, *args, **kwargs):
+    """fn(*args, **kwargs) をスレッドプールで実行し、event loop を止めずに結果を待つ。
+    リクエストごとにsessionを使い捨てるように、fnが使った ScopedSession は終わったら閉じる
+
+    Raises:
+        PoolSaturatedError: スレッドプールが埋まっている時
+
+    Returns:
+        fnの結果
+    """
+    return await asyncio.wrap_future(get_thread_pool().submit(run_with_scoped_session, fn, *args, **kwargs))
+
+
+async def run_in_process_pool(fn, *args, **kwargs):
+    """fn(*args, **kwargs) をプロセスプールで実行し、event loop を止めずに結果を待つ。
+    fnと引数はpickleできる必要がある
+
+    Raises:
+        PoolSaturatedError: プロセスプールが埋まっている時
+
+    Returns:
+        fnの結果
+    """
+    return await asyncio.wrap_future(get_process_pool().submit(fn, *args, **kwargs))
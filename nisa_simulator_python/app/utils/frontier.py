@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+from dataclasses_json import dataclass_json
+
+from utils.portfolio_problem import problem_cache
+from utils.statistics_cache import Statistics
+
+
+@dataclass_json
+@dataclass
+class FrontierPoint:
+    """効率的フロンティア上の1点
+    target_return: 目標にしたリターン
+    expected_return: ポートフォリオの期待リターン(年率)
+    volatility: ポートフォリオの標準偏差(年率)
+    weights: {sp500: 0.2, topix: 0.13}のような購入割合
+    """
+    target_return: float
+    expected_return: float
+    volatility: float
+    weights: Dict[str, float]
+
+
+@dataclass_json
+@dataclass
+class Frontier:
+    """効率的フロンティアをまとめるためのクラス
+    """
+    points: List[FrontierPoint]
+
+
+def make_point(names: List[str], mean: np.ndarray, cov: np.ndarray, target_return: float,
+               weights: Dict[str, float]) -> FrontierPoint:
+    """購入割合から FrontierPoint を作る
+
+    Args:
+        names (List[str]): 銘柄の名前. mean と cov の並び
+        mean (np.ndarray): 期待リターン
+        cov (np.ndarray): 共分散
+        target_return (float): 目標にしたリターン
+        weights (Dict[str, float]): {sp500: 0.2, topix: 0.13}のような購入割合
+
+    Returns:
+        FrontierPoint: フロンティア上の1点
+    """
+    weight_array = np.array([weights[name] for name in names], dtype="float64")
+    return FrontierPoint(target_return=float(target_return),
+                         expected_return=float(mean @ weight_array),
+                         volatility=float(
+                             np.sqrt(weight_array @ cov @ weight_array)),
+                         weights=dict(weights))
+
+
+def calculate_frontier(statistics: Statistics, points: int = 50) -> Frontier:
+    """分散最小のポートフォリオのリターンから、最大の期待リターンまでを points 等分して、効率的フロンティアを計算する。
+    problem_cache の組み立て済みの問題に平均と分散を1回だけ入れ、PortfolioProblem.efficient_returns で
+    目標リターンだけを変えて解き直す
+
+    Args:
+        statistics (Statistics): 期待リターンと共分散
+        points (int, optional): 計算する点の数. Defaults to 50.
+
+    Returns:
+        Frontier: 目標リターンの小さい順に並んだフロンティア上の点
+    """
+    problem = problem_cache.get(names=list(statistics.mean.index))
+    names = problem.names
+    mean = statistics.mean.loc[names].to_numpy(dtype="float64")
+    cov = statistics.cov.loc[names, names].to_numpy(dtype="float64")
+    min_volatility_weights = problem.min_volatility(statistics)
+    min_return = float(mean @ np.array([min_volatility_weights[name] for name in names]))
+    max_return = float(mean.max())
+    target_returns = np.linspace(min_return, max_return, points).tolist()
+    frontier_points = [make_point(names, mean, cov, target_return, weights)
+                       for target_return, weights in zip(target_returns, problem.efficient_returns(statistics, target_returns))
+                       if weights is not None]
+    return Frontier(points=frontier_points)
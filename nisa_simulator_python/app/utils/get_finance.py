@@ -1,18 +1,33 @@
 from dataclasses import dataclass
-from typing import List
+from datetime import datetime
+import json
+from typing import Dict, List, OrderedDict
 import pandas as pd
 import numpy as np
 
 from dataclasses_json import dataclass_json
-
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-
-from utils.calculate_methods import ICalculateMethod
-from db.Model import GraphData, NameBase, CalculateResult, Session
-
-
-session = Session()
+from sqlalchemy import and_, func, text
+
+from utils.backtest import Backtest, backtest
+from utils.calculate_config import CalculateConfig
+from utils.calculate_methods import ICalculateMethod, calculate_weights, get_method_index, get_method_parameters, portfolio_performance
+from utils.chart_cache import ChartPayload, chart_payload_cache, make_chart_payload
+from utils.chart_format import CHART_ENCODERS, COLOR_PALETTE, LEGACY_JSON_MEDIA_TYPE, make_chart_columns
+from utils.executors import get_process_pool
+from utils.nisa_projection import NisaProjection, make_return_scenarios, project_nisa
+from utils.simulation import SimulationResult, simulate
+from utils.statistics_cache import Statistics, statistics_cache
+from db.db_config import DBConfig
+from db.price_cube import PriceCubeReader
+from db.Model import GraphData, NameBase, CalculateResult, ScopedSession, dates_to_days, days_to_dates
+
+
+# APIのスレッドプールから呼ばれるので、スレッドごとに別のsessionを使う
+session = ScopedSession
+# DBConfig.price_cube_enabled の時に get_datas_from_db が読む、closeの配列
+price_cube_reader = PriceCubeReader(directory=DBConfig.price_cube_directory)
+# 毎月の購入額(円)
+MONTHLY_PURCHASE_YEN = 33333
 
 
 def scalling(X: pd.Series) -> pd.Series:
@@ -27,6 +42,26 @@ def scalling(X: pd.Series) -> pd.Series:
     return (X - X.mean()) / X.mean()
 
 
+def downsample(df: pd.DataFrame, max_points: int) -> pd.DataFrame:
+    """日付を先頭から max_points 個以下の区間に分け、区間ごとに最後のcloseだけを残す(週足、月足のcloseと同じ考え方)。
+    銘柄ごとに休場日が違うので、区間の中でNaNでない最後の値を使う。
+
+    Args:
+        df (pd.DataFrame): index: 日付, cols: NameBase.name のclose
+        max_points (int): 残す日付の最大数
+
+    Returns:
+        pd.DataFrame: index: 区間の最後の日付, cols: NameBase.name のclose
+    """
+    if max_points is None or len(df) <= max_points:
+        return df
+    bucket_size = -(-len(df) // max_points)
+    buckets = np.arange(len(df)) // bucket_size
+    sampled = df.groupby(buckets).last()
+    sampled.index = df.index[np.r_[np.flatnonzero(np.diff(buckets)), len(df) - 1]]
+    return sampled
+
+
 def get_series_from_db(col_name: str) -> pd.Series:
     """[summary]与えられた名前のデータから、pd.Seriesを作る
 
@@ -34,69 +69,127 @@ def get_series_from_db(col_name: str) -> pd.Series:
         col_name (str): [description] 欲しいデータの名前( NameBase.name )
 
     Returns:
-        pd.Series: [description] index: GraphData.date, name: GraphData.name, value GraphData.close
+        pd.Series: [description] index: 日付, name: NameBase.name, value GraphData.close
     """
-    col_date = session.query(
-        GraphData.date).filter_by(name=col_name).all()
-    col_date = [d[0] for d in col_date]
-    col_close = session.query(
-        GraphData.close).filter_by(name=col_name).all()
-    col_close = [c[0] for c in col_close]
-    data = pd.Series(index=col_date, data=col_close, name=col_name)
+    # (instrument_id, day) が主キーなので、1銘柄の全期間は主キーの範囲scanになる
+    rows = session.query(GraphData.day, GraphData.close).join(
+        NameBase, NameBase.id == GraphData.instrument_id).filter(
+        NameBase.name == col_name).order_by(GraphData.day).all()
+    data = pd.Series(index=days_to_dates([r[0] for r in rows]), data=[r[1] for r in rows],
+                     name=col_name, dtype="float64")
     return data
 
 
-def get_datas_from_db() -> pd.DataFrame:
-    """[summary] dbからGraphDataを読み込む
+def get_datas_from_db(start_time: datetime = None, end_time: datetime = None) -> pd.DataFrame:
+    """[summary] dbからGraphDataを1回のqueryで読み込み、日付 x NameBase.name の表に変換する
+
+    Args:
+        start_time (datetime, optional): この日付以降のデータを読み込む. Defaults to None.
+        end_time (datetime, optional): この日付以前のデータを読み込む. Defaults to None.
 
     Returns:
         [type]pd.DataFrame: index: datetime64[ns] closeを取得した日付('2021-09-15'など), cols: インデックスの名前(NameBase.name全体)
+            DBConfig.price_cube_enabled の時は読み込み専用のmemmapを使っているので、書き換えずに新しい表を作ること
     """
-    df = pd.Series()
-    col_names = session.query(NameBase.name).all()
-    for i, col in enumerate(col_names):
-        col_name = col[0]
-        if i == 0:
-            base = pd.DataFrame(get_series_from_db(col_name=col_name))
-        else:
-            s = get_series_from_db(col_name=col_name)
-            df = base.join(s)
-            base = df
+    start_day = None if start_time is None else int(
+        dates_to_days([start_time])[0])
+    end_day = None if end_time is None else int(dates_to_days([end_time])[0])
+    if DBConfig.price_cube_enabled:
+        cube = price_cube_reader.get()
+        if cube is not None:
+            # memmapしたファイルをコピーせずに使う
+            return cube.frame(start_day=start_day, end_day=end_day)
+    # ORMの型変換を通すと行数に比例して遅くなるので、生の値をそのまま受け取る
+    sql = """
+        SELECT graph_data.day, name_base.name, graph_data.close
+        FROM graph_data JOIN name_base ON name_base.id = graph_data.instrument_id
+        WHERE 1 = 1
+    """
+    params = dict()
+    # day にはindexがあるので、範囲指定はindexで絞り込まれる
+    if start_day is not None:
+        sql += " AND graph_data.day >= :start_day"
+        params["start_day"] = start_day
+    if end_day is not None:
+        sql += " AND graph_data.day <= :end_day"
+        params["end_day"] = end_day
+    rows = pd.DataFrame(session.execute(text(sql), params).fetchall(),
+                        columns=["day", "name", "close"])
+    if rows.empty:
+        return pd.DataFrame(dtype="float64")
+    rows["date"] = days_to_dates(rows["day"])
+    # 行の順番に依存しないように、(date, name) で表に変換する
+    df = rows.pivot(index="date", columns="name",
+                    values="close").astype("float64")
+    df.index.name = None
+    df.columns.name = None
     return df
 
 
-def get_result_from_db(method=0) -> list(dict()):
-    """[summary] dbのCalculateResultからデータを取得し、整形する
+def get_data_version() -> str:
+    """GraphDataのバージョンを返す。GraphDataに書き込みがあると変わる。
+    upsert_close_data が書き込みと同じトランザクションで増やす DataVersion の1行を引くだけなので、GraphDataの大きさによらず速い
+
+    Returns:
+        str: DataVersion.version の文字列. まだ書き込みが無ければ "0"
+    """
+    version = session.execute(
+        text("SELECT version FROM data_version WHERE id = 1")).scalar()
+    return str(version or 0)
+
+
+def get_statistics(start_time: datetime = None, end_time: datetime = None, data_version: str = None) -> Statistics:
+    """ポートフォリオの計算に使う平均と分散を返す。
+    GraphDataのバージョンと期間が同じ間は、前に計算したものを使い回す。
+
+    Args:
+        start_time (datetime, optional): この日付以降のデータを使う. Defaults to None.
+        end_time (datetime, optional): この日付以前のデータを使う. Defaults to None.
+        data_version (str, optional): 取得済みのGraphDataのバージョン. Noneならdbから取得する. Defaults to None.
+
+    Returns:
+        Statistics: 期待リターンと共分散
+    """
+    if data_version is None:
+        data_version = get_data_version()
+    key = (data_version, start_time, end_time)
+    return statistics_cache.get(key, lambda: get_datas_from_db(start_time=start_time, end_time=end_time))
+
+
+def get_result_from_db(method=0, data_version: str = None, parameters: str = None) -> list(dict()):
+    """[summary] dbのCalculateResultから、名前ごとの最新の結果を1回のqueryで取得し、整形する
+
+    Args:
+        method (int, optional): 計算方式のindex. Defaults to 0.
+        data_version (str, optional): 指定したら、このGraphDataのバージョンで計算した結果だけを使う. Defaults to None.
+        parameters (str, optional): 指定したら、このパラメータ(json)で計算した結果だけを使う. Defaults to None.
 
     Returns:
         [type]list(dict) d: [description]d[0]:string"yyyy/mm/dd/",d[1]:string"name" d[2]:float calculateresultpercent, d[3]: int calculateresultint
     """
+    conditions = [CalculateResult.method_name == method]
+    if data_version is not None:
+        conditions.append(CalculateResult.data_version == data_version)
+    if parameters is not None:
+        conditions.append(CalculateResult.parameters == parameters)
+    latest = session.query(CalculateResult.name, func.max(CalculateResult.date).label("date")).filter(
+        *conditions).group_by(CalculateResult.name).subquery()
+    results = session.query(CalculateResult, NameBase.searchkeyword).join(
+        latest, and_(CalculateResult.name == latest.c.name, CalculateResult.date == latest.c.date)).join(
+        NameBase, NameBase.name == CalculateResult.name).filter(*conditions).all()
     result_list = list(dict())
-    names = session.query(
-        NameBase.name, NameBase.searchkeyword).all()
-    for n in names:
-        try:
-            result = session.query(CalculateResult).filter(
-                CalculateResult.name == n[0]).filter(CalculateResult.method_name == method).order_by(CalculateResult.date.desc()).first()
-            day = result.date
-            day_str = day.strftime('%Y/%m/%d')
-            result_dict = {
-                "date": day_str,
-                "name": n[0],
-                "method_name": result.method_name,
-                "searchkeyword": n[1],
-                "resultpercent": result.resultpercent,
-                "resultint": result.resultint}
-            result_list.append(result_dict)
-        except Exception:
-            # logger.error(f"{n[1]} がありません。")
-            pass
+    for result, searchkeyword in results:
+        result_dict = {
+            "date": result.date.strftime('%Y/%m/%d'),
+            "name": result.name,
+            "method_name": result.method_name,
+            "searchkeyword": searchkeyword,
+            "resultpercent": result.resultpercent,
+            "resultint": result.resultint}
+        result_list.append(result_dict)
     result_list.sort(key=lambda x: x["resultint"], reverse=True)
     return result_list
 
-# todo: いつからいつまでのグラフを作成するのか選べるようにする。
-# min = datetime.now()から1年前, max = now
-
 
 def make_graph(scale=True) -> str:
     """[summary]dbからデータを読み込んでhtmlで表示する為のグラフを描く
@@ -107,11 +200,14 @@ def make_graph(scale=True) -> str:
     Returns:
         [type]: [description]
     """
+    # plotly は読み込みが遅く、このグラフはあまり使わないので、使う時にimportする
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
     df = get_datas_from_db()
     cols = list(df.columns)
     if (scale is True):
-        for col in cols:
-            df[col] = scalling(df[col])
+        df = df.apply(scalling)
 
     fig = make_subplots()
     for col in cols:
@@ -143,33 +239,77 @@ class HoleGraphData():
     datasets: List[IndividualChartData]
 
 
-def make_chart_data(scale=True) -> HoleGraphData:
+def make_chart_frame(scale=True, start_time: datetime = None, end_time: datetime = None, max_points: int = None) -> pd.DataFrame:
+    """dbからデータを読み込んで、グラフに描くcloseの表を作る
+
+    Args:
+        scale (bool, optional): closeをスケーリングするか. Defaults to True.
+        start_time (datetime, optional): この日付以降のデータを描く. Defaults to None.
+        end_time (datetime, optional): この日付以前のデータを描く. Defaults to None.
+        max_points (int, optional): 1銘柄あたりの点の最大数. 超えたら downsample する. Defaults to None.
+
+    Returns:
+        pd.DataFrame: index: 日付, cols: NameBase.name のclose
+    """
+    df = get_datas_from_db(start_time=start_time, end_time=end_time)
+    if scale is True:
+        # price cube から読んだ表は書き込めないので、新しい表にする
+        df = df.apply(scalling)
+    # 期間全体でスケーリングしてから間引く
+    return downsample(df, max_points=max_points)
+
+
+def make_chart_data(scale=True, start_time: datetime = None, end_time: datetime = None, max_points: int = None) -> HoleGraphData:
     """[summary]dbからデータを読み込んでvue-chartjsでグラフを表示する為のデータを作成して返す
 
     Args:
         minimax (bool, optional): [description]. Defaults to True.
+        start_time (datetime, optional): この日付以降のデータを描く. Defaults to None.
+        end_time (datetime, optional): この日付以前のデータを描く. Defaults to None.
+        max_points (int, optional): 1銘柄あたりの点の最大数. 超えたら downsample する. Defaults to None.
 
     Returns:
         [type]: [description]
     """
-    df = get_datas_from_db()
+    df = make_chart_frame(scale=scale, start_time=start_time,
+                          end_time=end_time, max_points=max_points)
     cols = list(df.columns)
     hole_data: List[IndividualChartData] = []
-    if scale is True:
-        for col in cols:
-            df[col] = scalling(df[col])
     # json でNAN部分はnullにしたいので、変換
-    df = df.replace([np.nan], [None])
-    # vue-chartjs で描画に使う色たち
-    color_parret = ["red", "green", "blue",
-                    "yellow", "orange", "gray", "purple"]
+    df = df.astype(object).where(df.notna(), None)
     for i, col in enumerate(cols):
         individual_data = IndividualChartData(
-            label=col, data=df[col].values.tolist(), borderColor=color_parret[i])
+            label=col, data=df[col].values.tolist(), borderColor=COLOR_PALETTE[i % len(COLOR_PALETTE)])
         hole_data.append(individual_data)
     return HoleGraphData(labels=df.index.strftime("%Y-%m-%d").to_list(), datasets=hole_data)
 
 
+def get_chart_payload(scale=True, start_time: datetime = None, end_time: datetime = None, max_points: int = None,
+                      media_type: str = LEGACY_JSON_MEDIA_TYPE) -> ChartPayload:
+    """/graph/ で返すエンコード済みのレスポンスを返す。
+    GraphDataのバージョン、scale、期間、点の数、形式が同じ間は、前に作ったものを使い回す。
+
+    Args:
+        scale (bool, optional): closeを0~1にスケーリングするか. Defaults to True.
+        start_time (datetime, optional): この日付以降のデータを描く. Defaults to None.
+        end_time (datetime, optional): この日付以前のデータを描く. Defaults to None.
+        max_points (int, optional): 1銘柄あたりの点の最大数. Defaults to None.
+        media_type (str, optional): CHART_ENCODERS にある形式.
+            Defaults to LEGACY_JSON_MEDIA_TYPE(HoleGraphData.to_json() の文字列をさらにjsonにしたもの).
+
+    Returns:
+        ChartPayload: media_type でエンコードしたbytesとETag
+    """
+    if media_type not in CHART_ENCODERS:
+        raise Exception(f"{media_type} は CHART_ENCODERS のリストに無い")
+    key = (get_data_version(), scale, start_time,
+           end_time, max_points, media_type)
+    return chart_payload_cache.get(key, lambda: make_chart_payload(
+        CHART_ENCODERS[media_type](make_chart_columns(make_chart_frame(
+            scale=scale, start_time=start_time, end_time=end_time, max_points=max_points))),
+        media_type=media_type))
+
+
 @dataclass_json
 @dataclass
 class Portfolio:
@@ -205,21 +345,249 @@ def calculate_portfolio(method: ICalculateMethod) -> Portfolios or Exception:
         print(
             f"In {calculate_portfolio.__name__} error occured :{error_of_calculate}")
         raise error_of_calculate
+    return make_portfolios(buy)
+
+
+def make_portfolios(buy: OrderedDict) -> Portfolios or Exception:
+    """計算結果を Portfolios に整形する
+
+    Args:
+        buy (OrderedDict): {sp500: 0.2, topix: 0.13}のような購入割合
+
+    Returns:
+        Portfolios: 銘柄ごとの購入割合、購入額、検索パラメータ
+        Exception: 整形失敗時のエラー
+    """
     portfolio: Portfolio
     portfolios: List[Portfolio] = []
     try:
+        search_params = dict(session.query(
+            NameBase.name, NameBase.searchkeyword).all())
         for k in buy.keys():
-            sbi_serach_name = session.query(
-                NameBase.searchkeyword).filter(
-                NameBase.name == k).first()
             purchace_percent = buy[k]
-            purchace_yen = int(33333 * purchace_percent)
+            purchace_yen = int(MONTHLY_PURCHASE_YEN * purchace_percent)
             portfolio = Portfolio(index_name=k, percent=purchace_percent,
-                                  yen=purchace_yen, search_param=sbi_serach_name[0])
+                                  yen=purchace_yen, search_param=search_params[k])
             portfolios.append(portfolio)
         _portforios = Portfolios(portfolio=portfolios)
     except Exception as e:
         print(
-            f"In {calculate_portfolio.__name__} error occured :{e}")
+            f"In {make_portfolios.__name__} error occured :{e}")
         raise e
     return _portforios
+
+
+def save_result_to_db(buy: OrderedDict, method_index: int, data_version: str, parameters: str) -> None:
+    """計算結果をCalculateResultに保存する
+
+    Args:
+        buy (OrderedDict): {sp500: 0.2, topix: 0.13}のような購入割合
+        method_index (int): 計算方式のindex
+        data_version (str): 計算に使ったGraphDataのバージョン
+        parameters (str): 計算方式に渡したパラメータのjson
+    """
+    now = datetime.now()
+    try:
+        session.add_all([CalculateResult(date=now, name=k, resultpercent=float(buy[k]),
+                                         resultint=int(
+                                             MONTHLY_PURCHASE_YEN * buy[k]),
+                                         method_name=method_index, data_version=data_version,
+                                         parameters=parameters) for k in buy.keys()])
+        session.commit()
+    except Exception as error_of_save_result:
+        print(
+            f"In {save_result_to_db.__name__} error occured :{error_of_save_result}")
+        session.rollback()
+
+
+def load_or_calculate_portfolio(method_name: str, parameters: dict = None) -> Portfolios or Exception:
+    """ポートフォリオを返す。
+    同じ計算方式、パラメータ、GraphDataのバージョンで計算した結果がCalculateResultにあればそれを返し、
+    無ければ計算してCalculateResultに保存する。
+
+    Args:
+        method_name (str): 計算方式の名前(EfficientReturn など)
+        parameters (dict, optional): 計算方式に渡すパラメータ({"target_return": 0.1} など). Defaults to None.
+
+    Returns:
+        Portfolios: 銘柄ごとの購入割合、購入額、検索パラメータ
+        Exception: 計算失敗時のエラー
+    """
+    if parameters is None:
+        parameters = dict()
+    parameters = get_method_parameters(
+        method_name=method_name, parameters=parameters)
+    parameters_json = json.dumps(parameters, sort_keys=True)
+    method_index = get_method_index(method_name=method_name)
+    data_version = get_data_version()
+    results = get_result_from_db(
+        method=method_index, data_version=data_version, parameters=parameters_json)
+    if len(results) == 0:
+        statistics = get_statistics(data_version=data_version)
+        try:
+            # 最適化はプロセスプールで行う
+            buy = get_process_pool().submit(
+                calculate_weights, method_name, statistics, parameters).result()
+        except Exception as error_of_calculate:
+            print(
+                f"In {load_or_calculate_portfolio.__name__} error occured :{error_of_calculate}")
+            raise error_of_calculate
+        save_result_to_db(buy=buy, method_index=method_index,
+                          data_version=data_version, parameters=parameters_json)
+        results = get_result_from_db(
+            method=method_index, data_version=data_version, parameters=parameters_json)
+    return results_to_portfolios(results)
+
+
+def results_to_portfolios(results: list(dict())) -> Portfolios:
+    """get_result_from_db の結果を Portfolios に整形する
+
+    Args:
+        results (list(dict)): get_result_from_db の結果
+
+    Returns:
+        Portfolios: 銘柄ごとの購入割合、購入額、検索パラメータ
+    """
+    return Portfolios(portfolio=[Portfolio(index_name=result["name"], percent=result["resultpercent"],
+                                           yen=result["resultint"], search_param=result["searchkeyword"])
+                                 for result in results])
+
+
+def simulate_portfolio(method_name: str, parameters: dict = None, monthly_yen: int = MONTHLY_PURCHASE_YEN, years: int = 20,
+                       paths: int = None, seed: int = 0) -> SimulationResult:
+    """method_name で計算したポートフォリオに毎月 monthly_yen 円を years 年積み立てた時の残高を、
+    GraphDataの平均と分散からモンテカルロ法で計算する
+
+    Args:
+        method_name (str): 計算方式の名前(EfficientReturn など)
+        parameters (dict, optional): 計算方式に渡すパラメータ({"target_return": 0.1} など). Defaults to None.
+        monthly_yen (int, optional): 毎月の購入額(円). Defaults to MONTHLY_PURCHASE_YEN.
+        years (int, optional): 積み立てる年数. Defaults to 20.
+        paths (int, optional): 経路の数. Defaults to CalculateConfig.simulation_paths.
+        seed (int, optional): 乱数のseed. Defaults to 0.
+
+    Returns:
+        SimulationResult: 各年の残高のパーセンタイルなど
+    """
+    portfolios = load_or_calculate_portfolio(
+        method_name=method_name, parameters=parameters)
+    weights = {portfolio.index_name: portfolio.percent
+               for portfolio in portfolios.portfolio}
+    return simulate(weights=weights, statistics=get_statistics(), monthly_yen=monthly_yen, years=years,
+                    paths=paths, seed=seed)
+
+
+def project_portfolio(method_name: str, parameters: dict = None, monthly_yen: List[int] = None, years: List[int] = None,
+                      returns: List[float] = None, withdrawal_start: List[int] = None) -> NisaProjection:
+    """method_name で計算したポートフォリオを積み立てた時の、NISAと課税口座の結果を全ての組み合わせで計算する。
+    指定が無いものは CalculateConfig.projection_* を使い、リターンはポートフォリオの期待リターンと標準偏差から作る
+
+    Args:
+        method_name (str): 計算方式の名前(EfficientReturn など)
+        parameters (dict, optional): 計算方式に渡すパラメータ({"target_return": 0.1} など). Defaults to None.
+        monthly_yen (List[int], optional): 毎月の購入額(円). Defaults to None.
+        years (List[int], optional): 積み立てる年数. Defaults to None.
+        returns (List[float], optional): 年率のリターン. Defaults to None.
+        withdrawal_start (List[int], optional): 積み立て始めてから全て売るまでの年数. Defaults to None.
+
+    Raises:
+        Exception: 組み合わせの数が CalculateConfig.projection_max_scenarios を超えた時
+
+    Returns:
+        NisaProjection: 全ての組み合わせの結果
+    """
+    portfolios = load_or_calculate_portfolio(
+        method_name=method_name, parameters=parameters)
+    weights = {portfolio.index_name: portfolio.percent
+               for portfolio in portfolios.portfolio}
+    expected_return, volatility = portfolio_performance(
+        weights=weights, statistics=get_statistics())
+    monthly_yen = monthly_yen or CalculateConfig.projection_monthly_yen
+    years = years or CalculateConfig.projection_years
+    returns = returns or make_return_scenarios(
+        expected_return=expected_return, volatility=volatility)
+    withdrawal_start = withdrawal_start or CalculateConfig.projection_withdrawal_start
+    scenarios = len(monthly_yen) * len(years) * \
+        len(returns) * len(withdrawal_start)
+    if scenarios > CalculateConfig.projection_max_scenarios:
+        raise Exception(
+            f"In {project_portfolio.__name__}. 組み合わせが多すぎる. scenarios= {scenarios}")
+    return project_nisa(monthly_yen=monthly_yen, years=years, returns=returns, withdrawal_start=withdrawal_start,
+                        expected_return=expected_return, volatility=volatility)
+
+
+def backtest_methods(method_names: List[str], lookback_days: int = None, rebalance_days: int = None,
+                     parameters: dict = None) -> Backtest:
+    """GraphDataの全期間で、計算方法ごとに定期的に買い直した時の結果を計算する
+
+    Args:
+        method_names (List[str]): 計算方法の名前(EfficientReturn など)のリスト
+        lookback_days (int, optional): 平均と分散の計算に使う営業日数. Defaults to CalculateConfig.backtest_lookback_days.
+        rebalance_days (int, optional): 買い直す間隔(営業日数). Defaults to CalculateConfig.backtest_rebalance_days.
+        parameters (dict, optional): {"target_return": 0.1, "risk_free_rate": 0.02} のようなパラメータ. Defaults to None.
+
+    Returns:
+        Backtest: 計算方法ごとの結果
+    """
+    return backtest(data=get_datas_from_db(), method_names=method_names, lookback_days=lookback_days,
+                    rebalance_days=rebalance_days, parameters=parameters)
+
+
+@dataclass_json
+@dataclass
+class BatchPortfolios:
+    """ 複数の計算方式のportfolioをまとめるためのクラス
+    portfolios: {計算方式の名前: Portfolios}
+    """
+    portfolios: Dict[str, Portfolios]
+
+
+def load_or_calculate_portfolios(method_names: List[str], parameters: dict = None) -> Dict[str, Portfolios]:
+    """複数の計算方式のポートフォリオをまとめて返す。
+    CalculateResultに無いものは、1つのStatisticsを使い、プロセスプールで並列に計算して保存する。
+
+    Args:
+        method_names (List[str]): 計算方式の名前(EfficientReturn など)のリスト
+        parameters (dict, optional): {"target_return": 0.1, "risk_free_rate": 0.02} のようなパラメータ.
+            各計算方式には、受け取るものだけを渡す. Defaults to None.
+
+    Returns:
+        Dict[str, Portfolios]: {計算方式の名前: Portfolios}
+    """
+    if parameters is None:
+        parameters = dict()
+    data_version = get_data_version()
+    portfolios: Dict[str, Portfolios] = dict()
+    pending = dict()
+    for method_name in method_names:
+        method_parameters = get_method_parameters(
+            method_name=method_name, parameters=parameters)
+        parameters_json = json.dumps(method_parameters, sort_keys=True)
+        method_index = get_method_index(method_name=method_name)
+        results = get_result_from_db(
+            method=method_index, data_version=data_version, parameters=parameters_json)
+        if len(results) > 0:
+            portfolios[method_name] = results_to_portfolios(results)
+        else:
+            pending[method_name] = (
+                method_index, method_parameters, parameters_json)
+    if len(pending) == 0:
+        return portfolios
+
+    statistics = get_statistics(data_version=data_version)
+    process_pool = get_process_pool()
+    futures = {method_name: process_pool.submit(calculate_weights, method_name, statistics, method_parameters)
+               for method_name, (_, method_parameters, _) in pending.items()}
+    for method_name, future in futures.items():
+        method_index, _, parameters_json = pending[method_name]
+        try:
+            buy = future.result()
+        except Exception as error_of_calculate:
+            print(
+                f"In {load_or_calculate_portfolios.__name__} error occured :{error_of_calculate}")
+            raise error_of_calculate
+        save_result_to_db(buy=buy, method_index=method_index,
+                          data_version=data_version, parameters=parameters_json)
+        portfolios[method_name] = results_to_portfolios(get_result_from_db(
+            method=method_index, data_version=data_version, parameters=parameters_json))
+    return portfolios
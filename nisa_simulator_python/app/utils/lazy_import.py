@@ -0,0 +1,28 @@
+import importlib
+import threading
+from typing import List
+
+# 起動を速くするため、最初に使う時にimportする最適化のライブラリ
+OPTIMIZER_MODULES = ["cvxpy", "pypfopt.efficient_frontier",
+                     "pypfopt.expected_returns", "pypfopt.risk_models"]
+
+# 複数のスレッドが同時に初めて同じライブラリをimportすると、importlibはデッドロックを避けるために
+# 読み込み途中のmoduleを返すことがあるので、最初のimportは1つずつ行う
+_lock = threading.Lock()
+
+
+def import_modules(names: List[str]) -> None:
+    """names のmoduleを1つのlockの中でimportする。import済みなら何もしない
+
+    Args:
+        names (List[str]): moduleの名前のリスト
+    """
+    with _lock:
+        for name in names:
+            importlib.import_module(name)
+
+
+def import_optimizer() -> None:
+    """pypfopt, cvxpy をimportする。プロセスプールのworkerでも実行できるように、module直下の関数にする
+    """
+    import_modules(OPTIMIZER_MODULES)
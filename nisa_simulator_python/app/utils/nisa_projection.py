@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from dataclasses_json import dataclass_json
+
+from utils.calculate_config import CalculateConfig
+
+MONTHS_PER_YEAR = 12
+
+
+@dataclass_json
+@dataclass
+class NisaProjection:
+    """毎月積み立てて、取り崩し開始の時に全て売った時の、NISAと課税口座の結果を 購入額 x 年数 x リターン x 取り崩し開始 の全ての組み合わせで計算したもの。
+    4次元の値は [monthly_yen][years][returns][withdrawal_start] の順に並ぶ
+    expected_return: ポートフォリオの期待リターン(年率)
+    volatility: ポートフォリオの標準偏差(年率)
+    monthly_yen: 毎月の購入額(円)
+    years: 積み立てる年数. 取り崩し開始の方が早ければ、そこで積み立てを止める
+    returns: 年率のリターン
+    withdrawal_start: 積み立て始めてから全て売るまでの年数
+    contributed: 積み立てた額の合計(円)
+    nisa_contributed: そのうちNISA口座で買った額(円). 枠を超えた分は課税口座で買う
+    nisa_balance: NISA口座と、枠を超えた分の課税口座の税引き後の残高(円)
+    taxable_balance: 全て課税口座で買った時の税引き後の残高(円)
+    tax_saved: nisa_balance - taxable_balance(円)
+    """
+    expected_return: float
+    volatility: float
+    monthly_yen: List[int]
+    years: List[int]
+    returns: List[float]
+    withdrawal_start: List[int]
+    contributed: List[List[List[List[int]]]]
+    nisa_contributed: List[List[List[List[int]]]]
+    nisa_balance: List[List[List[List[int]]]]
+    taxable_balance: List[List[List[List[int]]]]
+    tax_saved: List[List[List[List[int]]]]
+
+
+def make_return_scenarios(expected_return: float, volatility: float) -> List[float]:
+    """期待リターンから標準偏差の CalculateConfig.projection_volatility_steps 倍ずらしたリターンを返す
+
+    Args:
+        expected_return (float): ポートフォリオの期待リターン(年率)
+        volatility (float): ポートフォリオの標準偏差(年率)
+
+    Returns:
+        List[float]: 年率のリターンのリスト. -100%以下にはしない
+    """
+    steps = np.asarray(CalculateConfig.projection_volatility_steps, dtype="float64")
+    return np.maximum(expected_return + volatility * steps, -0.99).tolist()
+
+
+def cumulative_nisa_contributions(monthly_yen: np.ndarray, months: np.ndarray) -> np.ndarray:
+    """months ヶ月積み立てた時に、NISA口座で買える額の合計を返す。
+    毎月同じ額を買うので、年間の枠は12で割って毎月に割り振る。つみたて投資枠から先に使い、超えた分を成長投資枠で買う。
+    成長投資枠の生涯の枠と、全体の生涯の枠(簿価)を超えたら、NISA口座では買わない
+
+    Args:
+        monthly_yen (np.ndarray): shape (購入額の数,) の毎月の購入額(円)
+        months (np.ndarray): shape (月の数,) の積み立てた月数
+
+    Returns:
+        np.ndarray: shape (購入額の数, 月の数) のNISA口座で買った額の合計(円)
+    """
+    tsumitate = np.minimum(
+        monthly_yen, CalculateConfig.nisa_tsumitate_annual_cap / MONTHS_PER_YEAR)
+    growth = np.minimum(monthly_yen - tsumitate,
+                        CalculateConfig.nisa_growth_annual_cap / MONTHS_PER_YEAR)
+    return np.minimum(tsumitate[:, None] * months
+                      + np.minimum(growth[:, None] * months,
+                                   CalculateConfig.nisa_growth_lifetime_cap),
+                      CalculateConfig.nisa_lifetime_cap)
+
+
+def after_tax(balance: np.ndarray, cost: np.ndarray) -> np.ndarray:
+    """課税口座で全て売った時の、譲渡益に CalculateConfig.taxable_tax_rate の税金を引いた額を返す
+
+    Args:
+        balance (np.ndarray): 売る前の残高(円)
+        cost (np.ndarray): 買った額の合計(円)
+
+    Returns:
+        np.ndarray: 税引き後の額(円)
+    """
+    return balance - CalculateConfig.taxable_tax_rate * np.maximum(balance - cost, 0)
+
+
+def project_nisa(monthly_yen: List[int], years: List[int], returns: List[float], withdrawal_start: List[int],
+                 expected_return: float = None, volatility: float = None) -> NisaProjection:
+    """全ての組み合わせのNISAと課税口座の結果を、組み合わせごとにループせずに配列の計算で求める。
+    毎月の購入額を0ヶ月目の価値に割り引いて累積和を取っておけば、積み立てた月数で引くだけで
+    取り崩し開始の時の残高になるので、月ごとの計算は (購入額, リターン, 月) の配列で1回だけ行う
+
+    Args:
+        monthly_yen (List[int]): 毎月の購入額(円)
+        years (List[int]): 積み立てる年数
+        returns (List[float]): 年率のリターン
+        withdrawal_start (List[int]): 積み立て始めてから全て売るまでの年数
+        expected_return (float, optional): ポートフォリオの期待リターン(年率). 結果に含めるだけ. Defaults to None.
+        volatility (float, optional): ポートフォリオの標準偏差(年率). 結果に含めるだけ. Defaults to None.
+
+    Returns:
+        NisaProjection: 全ての組み合わせの結果
+    """
+    yen = np.asarray(monthly_yen, dtype="float64")
+    growth_per_month = (1 + np.asarray(returns, dtype="float64")) ** (1 / MONTHS_PER_YEAR)
+    withdrawal_months = np.asarray(withdrawal_start, dtype="int64") * MONTHS_PER_YEAR
+    # shape (年数, 取り崩し開始) の積み立てた月数
+    contribution_months = np.minimum(np.asarray(years, dtype="int64")[:, None] * MONTHS_PER_YEAR,
+                                     withdrawal_months[None, :])
+    max_months = int(contribution_months.max())
+
+    # k ヶ月目の購入額を0ヶ月目の価値に割り引き、最初の m ヶ月の合計を [..., m] に置く
+    discount = growth_per_month[:, None] ** -np.arange(max_months)
+    discounted_months = np.concatenate(
+        [np.zeros((len(growth_per_month), 1)), np.cumsum(discount, axis=1)], axis=1)
+    nisa_cost = cumulative_nisa_contributions(yen, np.arange(max_months + 1))
+    nisa_discounted = np.concatenate([np.zeros((len(yen), len(growth_per_month), 1)),
+                                      np.cumsum(np.diff(nisa_cost, axis=1)[:, None, :] * discount[None], axis=2)],
+                                     axis=2)
+
+    # shape (購入額, 年数, リターン, 取り崩し開始) に揃える
+    to_withdrawal = (growth_per_month[:, None] ** withdrawal_months[None, :])[None, None]
+    total_balance = (yen[:, None, None, None] * discounted_months[:, contribution_months].transpose(1, 0, 2)[None]
+                     * to_withdrawal)
+    nisa_only_balance = nisa_discounted[:, :, contribution_months].transpose(0, 2, 1, 3) * to_withdrawal
+    contributed = np.broadcast_to((yen[:, None, None] * contribution_months)[:, :, None, :],
+                                  total_balance.shape)
+    nisa_contributed = np.broadcast_to(nisa_cost[:, contribution_months][:, :, None, :],
+                                       total_balance.shape)
+
+    taxable_balance = after_tax(total_balance, contributed)
+    nisa_balance = nisa_only_balance + after_tax(total_balance - nisa_only_balance,
+                                                 contributed - nisa_contributed)
+
+    def to_yen(values: np.ndarray) -> list:
+        return np.rint(values).astype("int64").tolist()
+
+    return NisaProjection(expected_return=expected_return, volatility=volatility,
+                          monthly_yen=list(monthly_yen), years=list(years), returns=list(returns),
+                          withdrawal_start=list(withdrawal_start),
+                          contributed=to_yen(contributed), nisa_contributed=to_yen(nisa_contributed),
+                          nisa_balance=to_yen(nisa_balance), taxable_balance=to_yen(taxable_balance),
+                          tax_saved=to_yen(nisa_balance - taxable_balance))
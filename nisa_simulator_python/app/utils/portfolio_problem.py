@@ -0,0 +1,332 @@
+from collections import OrderedDict
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from utils.calculate_config import CalculateConfig
+from utils.lazy_import import import_optimizer
+from utils.statistics_cache import Statistics
+
+
+def parse_weight_bounds(values: List[str]) -> Dict[str, float]:
+    """["sp500:0.1", "topix:0.3"] のようなリクエストのパラメータを {sp500: 0.1, topix: 0.3} にする
+
+    Args:
+        values (List[str]): "銘柄の名前:購入割合" のリスト. Noneなら指定なし
+
+    Raises:
+        Exception: "名前:数値" の形になっていない時
+
+    Returns:
+        Dict[str, float]: {銘柄の名前: 購入割合}. 指定が無ければNone
+    """
+    if not values:
+        return None
+    bounds: Dict[str, float] = dict()
+    for value in values:
+        name, _, weight = value.rpartition(":")
+        try:
+            bounds[name] = float(weight)
+        except ValueError:
+            raise Exception(
+                f"In {parse_weight_bounds.__name__}. 購入割合の指定が 名前:数値 になっていない. value= {value}")
+        if name == "":
+            raise Exception(
+                f"In {parse_weight_bounds.__name__}. 購入割合の指定に銘柄の名前が無い. value= {value}")
+    return bounds
+
+
+def make_bounds(names: List[str], min_weights: Dict[str, float] = None,
+                max_weights: Dict[str, float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """銘柄ごとの購入割合の下限と上限を names の並びの配列にする。指定の無い銘柄は 0 以上 1 以下にする
+
+    Args:
+        names (List[str]): 銘柄の名前
+        min_weights (Dict[str, float], optional): {sp500: 0.1} のような購入割合の下限. Defaults to None.
+        max_weights (Dict[str, float], optional): {topix: 0.3} のような購入割合の上限. Defaults to None.
+
+    Raises:
+        Exception: 無い銘柄が指定された時と、下限と上限を満たして合計が1になる購入割合が無い時
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: 購入割合の下限と上限
+    """
+    lower = np.zeros(len(names))
+    upper = np.ones(len(names))
+    index = {name: i for i, name in enumerate(names)}
+    for bounds, array in [(min_weights, lower), (max_weights, upper)]:
+        for name, weight in (bounds or dict()).items():
+            if name not in index:
+                raise Exception(
+                    f"In {make_bounds.__name__}. 無い銘柄の購入割合が指定された. name= {name}")
+            array[index[name]] = weight
+    if (lower < 0).any() or (upper > 1).any() or (lower > upper).any() \
+            or lower.sum() > 1 or upper.sum() < 1:
+        raise Exception(
+            f"In {make_bounds.__name__}. 購入割合の下限と上限を満たすポートフォリオが無い. "
+            f"min_weights= {min_weights}, max_weights= {max_weights}")
+    return lower, upper
+
+
+def check_weight_bounds(weights: Dict[str, float], min_weights: Dict[str, float] = None,
+                        max_weights: Dict[str, float] = None) -> None:
+    """計算した購入割合が、指定された下限と上限をちょうど守っているかを確かめる
+
+    Args:
+        weights (Dict[str, float]): {sp500: 0.2, topix: 0.13}のような購入割合
+        min_weights (Dict[str, float], optional): {sp500: 0.1} のような購入割合の下限. Defaults to None.
+        max_weights (Dict[str, float], optional): {topix: 0.3} のような購入割合の上限. Defaults to None.
+
+    Raises:
+        Exception: 下限より小さいか、上限より大きい購入割合がある時
+    """
+    below = {name: weights.get(name, 0.0) for name, weight in (min_weights or dict()).items()
+             if weights.get(name, 0.0) < weight}
+    above = {name: weights.get(name, 0.0) for name, weight in (max_weights or dict()).items()
+             if weights.get(name, 0.0) > weight}
+    if below or above:
+        raise Exception(
+            f"In {check_weight_bounds.__name__}. 購入割合が下限か上限を守っていない. below= {below}, above= {above}")
+
+
+class PortfolioProblem:
+    """銘柄の並び(universe)ごとに1回だけ組み立てる、分散最小化、リターン制約付きの分散最小化、シャープ・レシオ最大化の問題。
+    期待リターン、共分散の分解、購入割合の下限と上限、目標リターン、無リスク金利は全て cvxpy.Parameter なので、
+    値だけを変えて解き直す時は問題の変換をやり直さず、前の解から warm start する。
+    シャープ・レシオ最大化は pypfopt の max_sharpe と同じく、合計を scale 倍した購入割合で分散最小化に変換して解く。
+    """
+
+    def __init__(self, names: List[str]) -> None:
+        """
+        Args:
+            names (List[str]): 銘柄の名前
+        """
+        # cvxpy は読み込みが遅いので、初めて問題を作る時にimportする
+        import_optimizer()
+        import cvxpy as cp
+
+        n_assets = len(names)
+        self.names = list(names)
+        self.mean = cp.Parameter(n_assets)
+        # sum_squares(factor @ weights) が分散になるように、共分散を分解したもの
+        self.factor = cp.Parameter((n_assets, n_assets))
+        self.lower = cp.Parameter(n_assets)
+        self.upper = cp.Parameter(n_assets)
+        self.target_return = cp.Parameter()
+        self.risk_free_rate = cp.Parameter()
+
+        self.weights = cp.Variable(n_assets)
+        variance = cp.sum_squares(self.factor @ self.weights)
+        constraints = [cp.sum(self.weights) == 1,
+                       self.weights >= self.lower, self.weights <= self.upper]
+        self.min_volatility_problem = cp.Problem(
+            cp.Minimize(variance), constraints)
+        self.efficient_return_problem = cp.Problem(cp.Minimize(variance),
+                                                   constraints + [self.mean @ self.weights >= self.target_return])
+
+        self.sharpe_weights = cp.Variable(n_assets)
+        self.scale = cp.Variable()
+        self.max_sharpe_problem = cp.Problem(
+            cp.Minimize(cp.sum_squares(self.factor @ self.sharpe_weights)),
+            [self.mean @ self.sharpe_weights - self.risk_free_rate * cp.sum(self.sharpe_weights) == 1,
+             cp.sum(self.sharpe_weights) == self.scale, self.scale >= 0,
+             self.sharpe_weights >= self.lower * self.scale,
+             self.sharpe_weights <= self.upper * self.scale])
+        # Parameter の値を入れてから解き終わるまでを、他のスレッドと重ならないようにする
+        self._lock = threading.Lock()
+        # 今 Parameter に入っている statistics.key と購入割合の下限、上限. 同じなら入れ直さない
+        self._statistics_key = None
+        self._bounds_key = None
+
+    def _set_values(self, statistics: Statistics, min_weights: Dict[str, float],
+                    max_weights: Dict[str, float]) -> None:
+        """statistics と購入割合の下限、上限を Parameter に入れる。
+        statistics_cache の同じ Statistics(key が同じ)と同じ下限、上限が続けて来たら、共分散の分解と make_bounds をやり直さない"""
+        if statistics.key is None or statistics.key != self._statistics_key:
+            self._statistics_key = None
+            self.mean.value = statistics.mean.loc[self.names].to_numpy(
+                dtype="float64")
+            cov = statistics.cov.loc[self.names, self.names].to_numpy(
+                dtype="float64")
+            eigenvalues, eigenvectors = np.linalg.eigh(cov)
+            self.factor.value = (eigenvectors *
+                                 np.sqrt(np.clip(eigenvalues, 0, None))).T
+            self._statistics_key = statistics.key
+        bounds_key = (tuple(sorted((min_weights or dict()).items())),
+                      tuple(sorted((max_weights or dict()).items())))
+        if bounds_key != self._bounds_key:
+            self._bounds_key = None
+            self.lower.value, self.upper.value = make_bounds(
+                self.names, min_weights=min_weights, max_weights=max_weights)
+            self._bounds_key = bounds_key
+
+    def _solve(self, problem, weights) -> np.ndarray:
+        """problem を warm start で解き、購入割合の値を返す"""
+        problem.solve(warm_start=True)
+        if problem.status not in ("optimal", "optimal_inaccurate") or weights.value is None:
+            raise Exception(
+                f"In {self._solve.__name__}. 解けなかった. status= {problem.status}")
+        return weights.value
+
+    def _make_output_weights(self, weights: np.ndarray) -> OrderedDict:
+        """ソルバーの誤差で下限と上限を少しはみ出した値を戻し、合計を1に揃える。
+        下限か上限から CalculateConfig.weight_bound_tolerance 以内の購入割合はちょうどその値にし、
+        合計を揃える時は下限にも上限にも付いていない購入割合だけを割り直すので、指定した下限と上限を必ず守る
+
+        Raises:
+            Exception: 下限と上限を守って合計を1にできなかった時
+        """
+        lower, upper = self.lower.value, self.upper.value
+        tolerance = CalculateConfig.weight_bound_tolerance
+        weights = np.clip(weights, lower, upper)
+        pinned = np.zeros(len(weights), dtype=bool)
+        for _ in range(len(weights)):
+            at_lower = ~pinned & (weights <= lower + tolerance)
+            at_upper = ~pinned & (weights >= upper - tolerance)
+            weights[at_lower] = lower[at_lower]
+            weights[at_upper] = upper[at_upper]
+            pinned |= at_lower | at_upper
+            free_total = weights[~pinned].sum()
+            if free_total <= 0:
+                break
+            weights[~pinned] *= (1 - weights[pinned].sum()) / free_total
+            if ((weights >= lower) & (weights <= upper)).all():
+                break
+            weights = np.clip(weights, lower, upper)
+        if (weights < lower).any() or (weights > upper).any() or abs(weights.sum() - 1) > tolerance:
+            raise Exception(
+                f"In {self._make_output_weights.__name__}. 購入割合の下限と上限を守れなかった. weights= {weights.tolist()}")
+        return OrderedDict(zip(self.names, weights.tolist()))
+
+    def min_volatility(self, statistics: Statistics, min_weights: Dict[str, float] = None,
+                       max_weights: Dict[str, float] = None) -> OrderedDict:
+        """分散を最小化する
+
+        Args:
+            statistics (Statistics): 期待リターンと共分散
+            min_weights (Dict[str, float], optional): 購入割合の下限. Defaults to None.
+            max_weights (Dict[str, float], optional): 購入割合の上限. Defaults to None.
+
+        Returns:
+            OrderedDict: {sp500: 0.2, topix: 0.13}のような購入割合
+        """
+        with self._lock:
+            self._set_values(statistics, min_weights, max_weights)
+            return self._make_output_weights(self._solve(self.min_volatility_problem, self.weights))
+
+    def efficient_return(self, statistics: Statistics, target_return: float, min_weights: Dict[str, float] = None,
+                         max_weights: Dict[str, float] = None) -> OrderedDict:
+        """期待リターンが target_return 以上で分散を最小化する
+
+        Args:
+            statistics (Statistics): 期待リターンと共分散
+            target_return (float): 目標リターン
+            min_weights (Dict[str, float], optional): 購入割合の下限. Defaults to None.
+            max_weights (Dict[str, float], optional): 購入割合の上限. Defaults to None.
+
+        Returns:
+            OrderedDict: {sp500: 0.2, topix: 0.13}のような購入割合
+        """
+        with self._lock:
+            self._set_values(statistics, min_weights, max_weights)
+            self.target_return.value = target_return
+            return self._make_output_weights(self._solve(self.efficient_return_problem, self.weights))
+
+    def efficient_returns(self, statistics: Statistics, target_returns: List[float], min_weights: Dict[str, float] = None,
+                          max_weights: Dict[str, float] = None) -> List[OrderedDict]:
+        """目標リターンを target_returns の順に変えながら、期待リターンが目標リターン以上で分散を最小化する。
+        期待リターン、共分散の分解、下限と上限は最初に1回だけ入れ、目標リターンの Parameter だけを変えて
+        前の解から warm start で解き直す
+
+        Args:
+            statistics (Statistics): 期待リターンと共分散
+            target_returns (List[float]): 目標リターンのリスト
+            min_weights (Dict[str, float], optional): 購入割合の下限. Defaults to None.
+            max_weights (Dict[str, float], optional): 購入割合の上限. Defaults to None.
+
+        Returns:
+            List[OrderedDict]: target_returns の順の {sp500: 0.2, topix: 0.13}のような購入割合. 解けなかった目標リターンはNone
+        """
+        results: List[OrderedDict] = []
+        with self._lock:
+            self._set_values(statistics, min_weights, max_weights)
+            for target_return in target_returns:
+                self.target_return.value = target_return
+                try:
+                    results.append(self._make_output_weights(
+                        self._solve(self.efficient_return_problem, self.weights)))
+                except Exception as error_of_solve:
+                    print(
+                        f"In {self.efficient_returns.__name__} error occured :{error_of_solve}")
+                    results.append(None)
+        return results
+
+    def max_sharpe(self, statistics: Statistics, risk_free_rate: float, min_weights: Dict[str, float] = None,
+                   max_weights: Dict[str, float] = None) -> OrderedDict:
+        """シャープ・レシオを最大化する
+
+        Args:
+            statistics (Statistics): 期待リターンと共分散
+            risk_free_rate (float): 無リスク金利
+            min_weights (Dict[str, float], optional): 購入割合の下限. Defaults to None.
+            max_weights (Dict[str, float], optional): 購入割合の上限. Defaults to None.
+
+        Raises:
+            Exception: 無リスク金利より期待リターンが大きい銘柄が無い時
+
+        Returns:
+            OrderedDict: {sp500: 0.2, topix: 0.13}のような購入割合
+        """
+        with self._lock:
+            self._set_values(statistics, min_weights, max_weights)
+            if (self.mean.value <= risk_free_rate).all():
+                raise Exception(
+                    f"In {self.max_sharpe.__name__}. 期待リターンが無リスク金利より大きい銘柄が無い. risk_free_rate= {risk_free_rate}")
+            self.risk_free_rate.value = risk_free_rate
+            scaled = self._solve(self.max_sharpe_problem, self.sharpe_weights)
+            return self._make_output_weights(scaled / self.scale.value)
+
+
+class ProblemCache:
+    """PortfolioProblem を銘柄の並びごとに覚えておくクラス。
+    プロセスプールのプロセスごとに持ち、max_size を超えたら古い順に捨てる。
+    """
+
+    def __init__(self, max_size: int = 4) -> None:
+        """
+        Args:
+            max_size (int, optional): 覚えておく PortfolioProblem の数. Defaults to 4.
+        """
+        self.max_size = max_size
+        self._problems: "OrderedDict[Tuple[str, ...], PortfolioProblem]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, names: List[str]) -> PortfolioProblem:
+        """names の PortfolioProblem を返す。無ければ組み立てて覚えておく
+
+        Args:
+            names (List[str]): 銘柄の名前
+
+        Returns:
+            PortfolioProblem: 組み立て済みの問題
+        """
+        key = tuple(names)
+        with self._lock:
+            if key in self._problems:
+                self._problems.move_to_end(key)
+                return self._problems[key]
+            problem = PortfolioProblem(names=list(names))
+            self._problems[key] = problem
+            while len(self._problems) > self.max_size:
+                self._problems.popitem(last=False)
+        return problem
+
+    def clear(self) -> None:
+        """覚えている PortfolioProblem を全て捨てる
+        """
+        with self._lock:
+            self._problems.clear()
+
+
+problem_cache = ProblemCache(max_size=CalculateConfig.problem_cache_size)
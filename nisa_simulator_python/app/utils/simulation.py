@@ -0,0 +1,216 @@
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+from dataclasses_json import dataclass_json
+
+from utils.calculate_config import CalculateConfig
+from utils.executors import imap_in_process_pool
+from utils.statistics_cache import Statistics
+
+MONTHS_PER_YEAR = 12
+
+
+@dataclass_json
+@dataclass
+class SimulationResult:
+    """毎月積み立てた時の残高をモンテカルロ法で計算した結果
+    paths: 計算した経路の数
+    years: 積み立てる年数
+    monthly_yen: 毎月の購入額(円)
+    seed: 乱数のseed. 同じseedなら同じ結果になる
+    weights: {sp500: 0.2, topix: 0.13}のような購入割合
+    year: 1, 2, ..., years 年目
+    contributed: 各年の終わりまでに積み立てた額の合計(円)
+    bands: {"p5": [1年目の5パーセンタイル, 2年目の..., ...], "p50": [...], ...} のような各年の残高のパーセンタイル(円)
+    final_balance: {"p5": 最後の残高の5パーセンタイル, ...} と平均の "mean"(円)
+    """
+    paths: int
+    years: int
+    monthly_yen: int
+    seed: int
+    weights: Dict[str, float]
+    year: List[int]
+    contributed: List[float]
+    bands: Dict[str, List[float]]
+    final_balance: Dict[str, float]
+
+
+def make_monthly_parameters(weights: Dict[str, float], statistics: Statistics):
+    """購入する銘柄の月次の対数リターンの平均と、共分散のコレスキー分解を作る。
+    mean は mean_historical_return の年率の複利リターンなので、log(1 + mean) / 12 を月次の対数リターンの平均にし、
+    共分散は年率なので 12 で割る。
+
+    Args:
+        weights (Dict[str, float]): {sp500: 0.2, topix: 0.13}のような購入割合
+        statistics (Statistics): 期待リターンと共分散
+
+    Returns:
+        Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]: 購入割合が0より大きい銘柄の名前、その購入割合、
+            月次の対数リターンの平均、factor @ factor.T が月次の共分散になる下三角行列
+    """
+    names = [name for name, weight in weights.items() if weight > 0]
+    if len(names) == 0:
+        raise Exception(
+            f"In {make_monthly_parameters.__name__}. 購入する銘柄が無い")
+    weight_array = np.array([weights[name] for name in names], dtype="float64")
+    weight_array /= weight_array.sum()
+    drift = np.log1p(statistics.mean.loc[names].to_numpy(
+        dtype="float64")) / MONTHS_PER_YEAR
+    cov = statistics.cov.loc[names, names].to_numpy(
+        dtype="float64") / MONTHS_PER_YEAR
+    try:
+        factor = np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        # 銘柄の値動きが重なっていて共分散が正定値でない時は、固有値分解で作る
+        eigenvalues, eigenvectors = np.linalg.eigh(cov)
+        factor = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+    return names, weight_array, drift, factor
+
+
+def get_chunk_paths(n_assets: int) -> int:
+    """1回にまとめて計算する経路の数を返す。1年分の乱数が CalculateConfig.simulation_chunk_bytes に収まるようにする
+
+    Args:
+        n_assets (int): 購入する銘柄の数
+
+    Returns:
+        int: 1つのchunkの経路の数
+    """
+    by_memory = CalculateConfig.simulation_chunk_bytes // (
+        MONTHS_PER_YEAR * n_assets * 8)
+    return max(1, min(CalculateConfig.simulation_chunk_paths, by_memory))
+
+
+def get_contributed(monthly_yen: int, years: int) -> np.ndarray:
+    """各年の終わりまでに積み立てた額の合計を返す
+
+    Args:
+        monthly_yen (int): 毎月の購入額(円)
+        years (int): 積み立てる年数
+
+    Returns:
+        np.ndarray: shape (years,) の積み立てた額(円)
+    """
+    return monthly_yen * MONTHS_PER_YEAR * np.arange(1, years + 1, dtype="float64")
+
+
+def simulate_chunk(weights: np.ndarray, drift: np.ndarray, factor: np.ndarray, monthly_yen: int, years: int,
+                   paths: int, seed: np.random.SeedSequence) -> Tuple[np.ndarray, np.ndarray]:
+    """paths 本の経路で、毎月 monthly_yen 円を積み立てて weights の割合で買い直した時の各年の終わりの残高を計算する。
+    プロセスプールから呼ばれる。
+    経路の数によらず結果の大きさが決まるように、各年の残高は 残高 / 積み立てた額 の対数の
+    CalculateConfig.simulation_histogram_bins 個のビンのヒストグラムと、残高の合計にまとめて返す。
+    範囲の外の残高は両端のビンに入れる
+
+    Args:
+        weights (np.ndarray): 購入割合
+        drift (np.ndarray): 月次の対数リターンの平均
+        factor (np.ndarray): 月次の共分散のコレスキー分解
+        monthly_yen (int): 毎月の購入額(円)
+        years (int): 積み立てる年数
+        paths (int): 経路の数
+        seed (np.random.SeedSequence): このchunkの乱数のseed
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: shape (years, simulation_histogram_bins) の各年のヒストグラムと、
+            shape (years,) の各年の残高の合計(円)
+    """
+    bins = CalculateConfig.simulation_histogram_bins
+    log_range = CalculateConfig.simulation_histogram_log_range
+    contributed = get_contributed(monthly_yen, years)
+    rng = np.random.default_rng(seed)
+    balances = np.zeros(paths)
+    histograms = np.empty((years, bins), dtype="int64")
+    totals = np.empty(years)
+    for year in range(years):
+        # 1年分の相関のある対数リターンをまとめて作り、銘柄ごとの値動きをポートフォリオの値動きにする
+        shocks = rng.standard_normal((MONTHS_PER_YEAR, paths, len(weights)))
+        growth = np.exp(drift + shocks @ factor.T) @ weights
+        for month in range(MONTHS_PER_YEAR):
+            balances += monthly_yen
+            balances *= growth[month]
+        index = ((np.log(balances / contributed[year]) + log_range)
+                 * (bins / (2 * log_range))).astype("int64")
+        histograms[year] = np.bincount(
+            np.clip(index, 0, bins - 1), minlength=bins)
+        totals[year] = balances.sum()
+    return histograms, totals
+
+
+def get_percentiles(histograms: np.ndarray, contributed: np.ndarray, percentiles: List[float]) -> np.ndarray:
+    """simulate_chunk のヒストグラムから、各年の残高のパーセンタイルを求める。
+    np.percentile と同じく順位 p / 100 * (経路の数 - 1) の残高を、ビンの中では線形に補間して求める
+
+    Args:
+        histograms (np.ndarray): shape (years, simulation_histogram_bins) の各年のヒストグラム
+        contributed (np.ndarray): shape (years,) の各年の積み立てた額(円)
+        percentiles (List[float]): 求めるパーセンタイル
+
+    Returns:
+        np.ndarray: shape (len(percentiles), years) の残高のパーセンタイル(円)
+    """
+    bins = histograms.shape[1]
+    log_range = CalculateConfig.simulation_histogram_log_range
+    width = 2 * log_range / bins
+    cumulative = np.cumsum(histograms, axis=1)
+    bands = np.empty((len(percentiles), len(contributed)))
+    for year, counts in enumerate(cumulative):
+        ranks = np.asarray(percentiles, dtype="float64") / 100 * (counts[-1] - 1)
+        index = np.searchsorted(counts, ranks, side="right")
+        before = np.where(index > 0, counts[index - 1], 0)
+        fraction = (ranks - before + 0.5) / histograms[year, index]
+        bands[:, year] = np.exp(-log_range + (index + fraction) * width) * contributed[year]
+    return bands
+
+
+def simulate(weights: Dict[str, float], statistics: Statistics, monthly_yen: int, years: int,
+             paths: int = None, seed: int = 0) -> SimulationResult:
+    """weights のポートフォリオに毎月 monthly_yen 円を years 年積み立てた時の残高を、paths 本の経路で計算する。
+    経路は get_chunk_paths 本ずつのchunkに分けて imap_in_process_pool で並列に計算し、
+    chunkごとに seed から作った乱数を使うので、プロセス数によらず同じ seed なら同じ結果になる。
+    chunkの結果はヒストグラムにまとめてから順番に足すので、経路の数を増やしても使うメモリは増えない。
+    パーセンタイルはヒストグラムのビンの幅(約 2 * simulation_histogram_log_range / simulation_histogram_bins の相対誤差)で近似する。
+
+    Args:
+        weights (Dict[str, float]): {sp500: 0.2, topix: 0.13}のような購入割合
+        statistics (Statistics): 期待リターンと共分散
+        monthly_yen (int): 毎月の購入額(円)
+        years (int): 積み立てる年数
+        paths (int, optional): 経路の数. Defaults to CalculateConfig.simulation_paths.
+        seed (int, optional): 乱数のseed. Defaults to 0.
+
+    Returns:
+        SimulationResult: 各年の残高のパーセンタイルなど
+    """
+    if paths is None:
+        paths = CalculateConfig.simulation_paths
+    names, weight_array, drift, factor = make_monthly_parameters(
+        weights=weights, statistics=statistics)
+    chunk_paths = get_chunk_paths(len(names))
+    chunk_sizes = [min(chunk_paths, paths - start)
+                   for start in range(0, paths, chunk_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    histograms = np.zeros(
+        (years, CalculateConfig.simulation_histogram_bins), dtype="int64")
+    totals = np.zeros(years)
+    for chunk_histograms, chunk_totals in imap_in_process_pool(simulate_chunk, [
+            (weight_array, drift, factor, monthly_yen, years, size, chunk_seed)
+            for size, chunk_seed in zip(chunk_sizes, seeds)]):
+        histograms += chunk_histograms
+        totals += chunk_totals
+
+    percentiles = CalculateConfig.simulation_percentiles
+    contributed = get_contributed(monthly_yen, years)
+    bands = get_percentiles(histograms, contributed, percentiles)
+    final_balance = {f"p{p}": float(band[-1])
+                     for p, band in zip(percentiles, bands)}
+    final_balance["mean"] = float(totals[-1] / paths)
+    return SimulationResult(paths=paths, years=years, monthly_yen=monthly_yen, seed=seed,
+                            weights=dict(zip(names, weight_array.tolist())),
+                            year=list(range(1, years + 1)),
+                            contributed=contributed.tolist(),
+                            bands={f"p{p}": band.tolist()
+                                   for p, band in zip(percentiles, bands)},
+                            final_balance=final_balance)
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+from typing import Callable, Hashable
+
+from pandas import DataFrame, Series
+
+from utils.lazy_import import import_optimizer
+
+
+@dataclass
+class Statistics:
+    """ポートフォリオの計算に使う統計量
+    mean: 銘柄ごとの期待リターン(年率)
+    cov: 銘柄間の共分散(年率)
+    key: StatisticsCache のkey(データのバージョンと期間など). keyが同じなら中身も同じ. キャッシュしていなければNone
+    """
+    mean: Series
+    cov: DataFrame
+    key: Hashable = None
+
+
+def calculate_statistics(data: DataFrame) -> Statistics:
+    """closeのデータから期待リターンと共分散を計算する
+
+    Args:
+        data (DataFrame): index: 日付, cols: NameBase.name のclose
+
+    Returns:
+        Statistics: 期待リターンと共分散
+    """
+    # pypfopt は読み込みが遅いので、初めて計算する時にimportする
+    import_optimizer()
+    from pypfopt import expected_returns, risk_models
+
+    return Statistics(mean=expected_returns.mean_historical_return(data),
+                      cov=risk_models.sample_cov(data))
+
+
+class StatisticsCache:
+    """Statistics を (データのバージョン, 期間) などのkeyごとに覚えておくクラス。
+    GraphDataが更新されるとバージョンが変わるので、古いkeyは使われなくなり、max_size を超えたら古い順に捨てる。
+    """
+
+    def __init__(self, max_size: int = 8) -> None:
+        """
+        Args:
+            max_size (int, optional): 覚えておくStatisticsの数. Defaults to 8.
+        """
+        self.max_size = max_size
+        self._statistics: "OrderedDict[Hashable, Statistics]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load_data: Callable[[], DataFrame]) -> Statistics:
+        """key のStatisticsを返す。無ければ load_data で読み込んだデータから計算して覚えておく
+
+        Args:
+            key (Hashable): データのバージョンと期間など
+            load_data (Callable[[], DataFrame]): 計算に使うデータを読み込む関数. keyが無い時だけ呼ばれる
+
+        Returns:
+            Statistics: 期待リターンと共分散
+        """
+        with self._lock:
+            if key in self._statistics:
+                self._statistics.move_to_end(key)
+                return self._statistics[key]
+        statistics = calculate_statistics(load_data())
+        statistics.key = key
+        with self._lock:
+            self._statistics[key] = statistics
+            while len(self._statistics) > self.max_size:
+                self._statistics.popitem(last=False)
+        return statistics
+
+    def clear(self) -> None:
+        """覚えているStatisticsを全て捨てる
+        """
+        with self._lock:
+            self._statistics.clear()
+
+
+statistics_cache = StatisticsCache()
@@ -0,0 +1,341 @@
+from dataclasses import dataclass, field, replace
+import datetime
+import json
+import threading
+import time
+from typing import Dict
+import uuid
+
+from dataclasses_json import dataclass_json
+
+from db.db_config import DBConfig
+from db.Model import Session, UpdateJob, _GraphData, update_lock
+
+
+@dataclass_json
+@dataclass
+class UpdateJobStatus:
+    """GraphDataの更新ジョブの状態
+    job_id: ジョブのid
+    state: "running" | "succeeded" | "failed"
+    started_at: 開始した時刻
+    finished_at: 終了した時刻. 実行中ならNone
+    duration_seconds: かかった秒数. 実行中なら開始からの秒数
+    instruments: {NameBase.name: "pending" | "fetching" | "fetched" | "failed" | "skipped"}
+    inserted, updated, unchanged: 書き込んだ行数(UpsertResult)
+    error: 失敗した時のエラー
+    """
+    job_id: str
+    state: str
+    started_at: str
+    finished_at: str = None
+    duration_seconds: float = 0.0
+    instruments: Dict[str, str] = field(default_factory=dict)
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    error: str = None
+
+
+class UpdateJobManager:
+    """GraphDataの更新をバックグラウンドで実行するクラス。
+    gunicorn のworkerなど全てのプロセスで同時に実行する更新は1つだけで、Model.update_lock を取れたプロセスが実行する。
+    実行中に start が呼ばれたら実行中のジョブを返す。
+    ジョブの状態はdbの UpdateJob に書くので、どのプロセスの get でも同じ状態を返す。
+    """
+
+    def __init__(self, max_history: int = 20, running_wait_seconds: float = 2.0) -> None:
+        """
+        Args:
+            max_history (int, optional): 状態を覚えておくジョブの数. Defaults to 20.
+            running_wait_seconds (float, optional): 他のプロセスがロックを取ってから、
+                実行中のジョブがdbに書かれるまで待つ秒数. Defaults to 2.0.
+        """
+        self.max_history = max_history
+        self.running_wait_seconds = running_wait_seconds
+        self._lock = threading.Lock()
+
+    def start(self) -> UpdateJobStatus:
+        """更新ジョブを開始する。実行中のジョブがあれば、新しく開始せずにそれを返す
+
+        Raises:
+            Exception: 更新ジョブ以外(_GraphData.create など)が更新中の時
+
+        Returns:
+            UpdateJobStatus: 開始した、または実行中のジョブの状態
+        """
+        with self._lock:
+            if not update_lock.acquire(blocking=False):
+                return self._wait_running()
+            try:
+                # ロックを取れたので、前に落ちたプロセスが残した実行中のジョブは終わっている
+                self._fail_interrupted()
+                job = UpdateJobStatus(job_id=uuid.uuid4().hex, state="running",
+                                      started_at=datetime.datetime.now().isoformat())
+                self._save(job, insert=True)
+                threading.Thread(target=self._run, args=(job,),
+                                 name=f"update-{job.job_id}", daemon=True).start()
+            except Exception:
+                update_lock.release()
+                raise
+            return self._copy(job)
+
+    def get(self, job_id: str) -> UpdateJobStatus:
+        """ジョブの状態を返す
+
+        Args:
+            job_id (str): ジョブのid
+
+        Returns:
+            UpdateJobStatus: ジョブの状態. 知らないidならNone
+        """
+        session = Session()
+        try:
+            return self._to_status(session.get(UpdateJob, job_id))
+        finally:
+            session.close()
+
+    def get_running(self) -> UpdateJobStatus:
+        """実行中のジョブの状態を返す
+
+        Returns:
+            UpdateJobStatus: 実行中のジョブの状態. 無ければNone
+        """
+        session = Session()
+        try:
+            return self._to_status(session.query(UpdateJob).filter(UpdateJob.state == "running").order_by(
+                UpdateJob.started_at.desc()).first())
+        finally:
+            session.close()
+
+    def wait(self, job_id: str, poll_interval: float = 1.0) -> UpdateJobStatus:
+        """ジョブが終わるまで待つ
+
+        Args:
+            job_id (str): ジョブのid
+            poll_interval (float, optional): 状態を確認する間隔(秒). Defaults to 1.0.
+
+        Returns:
+            UpdateJobStatus: 終わったジョブの状態
+        """
+        while True:
+            job = self.get(job_id)
+            if job is None or job.state != "running":
+                return job
+            time.sleep(poll_interval)
+
+    def _wait_running(self) -> UpdateJobStatus:
+        """他のプロセスがロックを持っている時に、そのプロセスの実行中のジョブを返す。
+        ロックを取ってからdbに書くまでの間なら、running_wait_seconds まで待つ
+
+        Raises:
+            Exception: 待っても実行中のジョブが無い時
+
+        Returns:
+            UpdateJobStatus: 実行中のジョブの状態
+        """
+        deadline = time.monotonic() + self.running_wait_seconds
+        while True:
+            running = self.get_running()
+            if running is not None:
+                return running
+            if time.monotonic() >= deadline:
+                raise Exception(
+                    f"In {self.start.__name__}. 他のプロセスがGraphDataを更新中")
+            time.sleep(0.1)
+
+    def _run(self, job: UpdateJobStatus) -> None:
+        """_GraphData.update を実行し、job に進み具合と結果を書き込む。終わったら update_lock を外す
+
+        Args:
+            job (UpdateJobStatus): 実行するジョブの状態
+        """
+        timer = time.perf_counter()
+        # progress は銘柄を取得するスレッドから呼ばれるので、job の書き換えとdbへの書き込みを1つずつにする
+        job_lock = threading.Lock()
+
+        def progress(name: str, state: str) -> None:
+            with job_lock:
+                job.instruments[name] = state
+                job.duration_seconds = time.perf_counter() - timer
+                try:
+                    self._save(job)
+                except Exception as error_of_save_progress:
+                    # 進み具合を書けなくても、更新は続ける
+                    print(f"In {progress.__name__} error occured :{error_of_save_progress}")
+
+        result = None
+        error = None
+        try:
+            graph = _GraphData(db_config=DBConfig())
+            result = graph.update(progress=progress)
+            if result is None:
+                error = "データの取得に失敗した"
+        except Exception as error_of_update:
+            print(f"In {self._run.__name__} error occured :{error_of_update}")
+            error = str(error_of_update)
+        try:
+            if error is None:
+                job.inserted = result.inserted
+                job.updated = result.updated
+                job.unchanged = result.unchanged
+                job.state = "succeeded"
+            else:
+                job.state = "failed"
+                job.error = error
+            job.finished_at = datetime.datetime.now().isoformat()
+            job.duration_seconds = time.perf_counter() - timer
+            self._save(job)
+            self._trim_history()
+        except Exception as error_of_save_job:
+            print(f"In {self._run.__name__} error occured :{error_of_save_job}")
+        finally:
+            update_lock.release()
+
+    def _save(self, job: UpdateJobStatus, insert: bool = False) -> None:
+        """ジョブの状態をdbに書く
+
+        Args:
+            job (UpdateJobStatus): ジョブの状態
+            insert (bool, optional): Trueなら新しい行を作る. Defaults to False.
+        """
+        values = dict(state=job.state, started_at=job.started_at, finished_at=job.finished_at,
+                      duration_seconds=job.duration_seconds, instruments=json.dumps(job.instruments),
+                      inserted=job.inserted, updated=job.updated, unchanged=job.unchanged, error=job.error)
+        session = Session()
+        try:
+            if insert:
+                session.add(UpdateJob(job_id=job.job_id, **values))
+            else:
+                session.query(UpdateJob).filter(
+                    UpdateJob.job_id == job.job_id).update(values)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _fail_interrupted(self) -> None:
+        """ロックを持っていないのに実行中のままのジョブ(途中でプロセスが落ちたもの)を失敗にする。update_lock を持って呼ぶ
+        """
+        session = Session()
+        try:
+            session.query(UpdateJob).filter(UpdateJob.state == "running").update(
+                dict(state="failed", error="更新中にプロセスが終了した",
+                     finished_at=datetime.datetime.now().isoformat()))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _trim_history(self) -> None:
+        """新しい順に max_history 個より古いジョブを消す
+        """
+        session = Session()
+        try:
+            old_job_ids = [job_id for job_id, in session.query(UpdateJob.job_id).order_by(
+                UpdateJob.started_at.desc()).offset(self.max_history).all()]
+            if len(old_job_ids) > 0:
+                session.query(UpdateJob).filter(UpdateJob.job_id.in_(
+                    old_job_ids)).delete(synchronize_session=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _to_status(self, row: UpdateJob) -> UpdateJobStatus:
+        """UpdateJob の行を UpdateJobStatus にする
+
+        Args:
+            row (UpdateJob): dbの行. Noneでもよい
+
+        Returns:
+            UpdateJobStatus: ジョブの状態. row がNoneならNone
+        """
+        if row is None:
+            return None
+        return UpdateJobStatus(job_id=row.job_id, state=row.state, started_at=row.started_at,
+                               finished_at=row.finished_at, duration_seconds=row.duration_seconds or 0.0,
+                               instruments=json.loads(row.instruments or "{}"),
+                               inserted=row.inserted or 0, updated=row.updated or 0,
+                               unchanged=row.unchanged or 0, error=row.error)
+
+    def _copy(self, job: UpdateJobStatus) -> UpdateJobStatus:
+        """ジョブの状態のコピーを返す
+
+        Args:
+            job (UpdateJobStatus): ジョブの状態
+
+        Returns:
+            UpdateJobStatus: instruments もコピーしたジョブの状態
+        """
+        return replace(job, instruments=dict(job.instruments))
+
+
+class UpdateScheduler:
+    """毎日 DBConfig.scheduled_update_hour:scheduled_update_minute に更新ジョブを開始するクラス。
+    市場が閉まった後に更新しておくことで、利用者が /update を待たなくてよくなる。
+    """
+
+    def __init__(self, manager: UpdateJobManager) -> None:
+        """
+        Args:
+            manager (UpdateJobManager): 更新ジョブを実行するクラス
+        """
+        self.manager = manager
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def start(self) -> None:
+        """スケジュールを開始する
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="update-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """スケジュールを止める
+        """
+        self._stop.set()
+        self._thread = None
+
+    def get_next_run(self, now: datetime.datetime) -> datetime.datetime:
+        """now の次に更新する時刻を返す
+
+        Args:
+            now (datetime.datetime): 現在の時刻
+
+        Returns:
+            datetime.datetime: 次に更新する時刻
+        """
+        next_run = now.replace(hour=DBConfig.scheduled_update_hour,
+                               minute=DBConfig.scheduled_update_minute, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += datetime.timedelta(days=1)
+        return next_run
+
+    def _run(self) -> None:
+        """次の更新時刻まで待って更新ジョブを開始する、を止められるまで繰り返す
+        """
+        while not self._stop.is_set():
+            now = datetime.datetime.now()
+            if self._stop.wait((self.get_next_run(now) - now).total_seconds()):
+                return
+            try:
+                job = self.manager.start()
+                self.manager.wait(job.job_id)
+            except Exception as error_of_scheduled_update:
+                # 他の更新と重なった日は飛ばして、次の更新時刻まで待つ
+                print(f"In {self._run.__name__} error occured :{error_of_scheduled_update}")
+
+
+update_job_manager = UpdateJobManager()
+update_scheduler = UpdateScheduler(manager=update_job_manager)
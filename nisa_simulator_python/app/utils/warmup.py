@@ -0,0 +1,159 @@
+from dataclasses import dataclass, field
+import gc
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from dataclasses_json import dataclass_json
+from sqlalchemy import text
+
+from db import Model
+from db.db_config import DBConfig
+from utils import get_finance
+from utils.calculate_config import CalculateConfig
+from utils.executors import get_process_pool
+from utils.lazy_import import import_optimizer
+
+
+@dataclass_json
+@dataclass
+class Readiness:
+    """重い部品の準備ができているか
+    ready: 全ての部品の準備ができたか
+    components: {部品の名前: "pending" | "warming" | "ready" | "failed"}
+    seconds: {部品の名前: 準備にかかった秒数}
+    errors: {部品の名前: 失敗した時のエラー}
+    """
+    ready: bool = False
+    components: Dict[str, str] = field(default_factory=dict)
+    seconds: Dict[str, float] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
+def warm_database() -> None:
+    """コネクションプールにdbへのコネクションを作っておく
+    """
+    with Model.engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+def warm_optimizer() -> None:
+    """このプロセスと、プロセスプールの全てのworkerで最適化のライブラリをimportしておく
+    """
+    import_optimizer()
+    process_pool = get_process_pool()
+    futures = [process_pool.submit(import_optimizer)
+               for _ in range(CalculateConfig.process_pool_workers)]
+    for future in futures:
+        future.result()
+
+
+def warm_statistics() -> None:
+    """今のGraphDataの平均と分散を計算して、statistics_cache に入れておく
+    """
+    try:
+        get_finance.get_statistics()
+    finally:
+        Model.ScopedSession.remove()
+
+
+def preload() -> None:
+    """gunicorn のmasterで、workerをforkする前に呼ぶ。
+    最適化のライブラリ、price cube、平均と分散をmasterで読み込んでおき、forkしたworkerにcopy-on-writeで共有する。
+    masterはリクエストを受けないので、使ったdbのコネクションは捨てておく。
+    古いスキーマのdbは、workerが読み込む前にここで今のスキーマに移す
+    """
+    try:
+        Model.MigrateDatabase()
+        import_optimizer()
+        if DBConfig.price_cube_enabled:
+            get_finance.price_cube_reader.get()
+        warm_statistics()
+    except Exception as error_of_preload:
+        # 読み込めなかったものは、各workerが最初に使う時に読み込む
+        print(f"In {preload.__name__} error occured :{error_of_preload}")
+    finally:
+        Model.engine.dispose()
+    # 読み込んだオブジェクトをGCの対象から外し、workerでGCが走った時に共有しているページを書き換えないようにする
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork(workers: int) -> None:
+    """gunicorn でforkしたworkerで最初に呼ぶ。
+    masterから引き継いだdbのコネクションを使わないように捨て、
+    workerごとのプロセスプールを合わせてもCPU数を超えないように、process_pool_workers を CPU数 / worker数 以下にする
+
+    Args:
+        workers (int): workerの数
+    """
+    Model.engine.dispose()
+    CalculateConfig.process_pool_workers = max(1, min(CalculateConfig.process_pool_workers,
+                                                      (os.cpu_count() or 1) // workers))
+
+
+class Warmup:
+    """起動時に、重い部品(dbのコネクション、最適化のライブラリ、平均と分散)をバックグラウンドで準備するクラス。
+    import では読み込まずに最初に使う時まで遅らせているものを、リクエストが来る前に読み込んでおく。
+    """
+
+    def __init__(self, components: List[Tuple[str, Callable[[], None]]]) -> None:
+        """
+        Args:
+            components (List[Tuple[str, Callable[[], None]]]): (部品の名前, 準備する関数) のリスト. 順番に準備する
+        """
+        self.components = components
+        self._readiness = Readiness(
+            components={name: "pending" for name, _ in components})
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """バックグラウンドで準備を始める。既に始めていたら何もしない
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def get_readiness(self) -> Readiness:
+        """準備の状況を返す
+
+        Returns:
+            Readiness: 準備の状況のコピー
+        """
+        with self._lock:
+            return Readiness(ready=self._readiness.ready,
+                             components=dict(self._readiness.components),
+                             seconds=dict(self._readiness.seconds),
+                             errors=dict(self._readiness.errors))
+
+    def _run(self) -> None:
+        """部品を順番に準備する
+        """
+        for name, warm in self.components:
+            with self._lock:
+                self._readiness.components[name] = "warming"
+            timer = time.perf_counter()
+            try:
+                warm()
+                state = "ready"
+            except Exception as error_of_warmup:
+                print(f"In {self._run.__name__} error occured :{error_of_warmup}")
+                state = "failed"
+                with self._lock:
+                    self._readiness.errors[name] = str(error_of_warmup)
+            with self._lock:
+                self._readiness.components[name] = state
+                self._readiness.seconds[name] = time.perf_counter() - timer
+        with self._lock:
+            self._readiness.ready = all(
+                state == "ready" for state in self._readiness.components.values())
+
+
+warmup = Warmup(components=[("database", warm_database),
+                            ("optimizer", warm_optimizer),
+                            ("statistics", warm_statistics)])